@@ -1,32 +1,39 @@
 import os
+import shutil
 import tempfile
-import subprocess
 import threading
 import time
-import re
-import json
-import shutil # أُضيف لنسخ الملفات للألبوم
-from concurrent.futures import ThreadPoolExecutor
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaVideo
-from pyrogram.errors import MessageEmpty, UserNotParticipant, MessageNotModified, FloodWait
 
 from config import *
+from engine import (
+    CompressionJob, AlbumSink, AlbumQuotaExceeded, compress, plan_segments, CompressionScheduler,
+    WorkerPool, DownloadRegistry, estimate_download_work,
+    ProgressDispatcher, get_telegram_duration, get_video_duration, get_video_info_and_thumb, discard_thumbnails,
+    clear_media_info_cache, call_with_flood_wait,
+    LoopTimer, run_when_done, start_metrics_server,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
+# مجلد فرعي لكل مستخدم داخل مجلد التنزيلات (نفس القرص، فنقل الناتج إليه إعادة تسمية لا نسخ)
+ALBUM_STAGING_DIR = os.path.join(DOWNLOADS_DIR, "album")
+
 # التزامنية لـ 3 مهام كحد أقصى للتحميل و 3 للضغط
-download_executor = ThreadPoolExecutor(max_workers=3)
-compression_executor = ThreadPoolExecutor(max_workers=3)
+download_executor = WorkerPool('download', 3, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
+album_prepare_executor = WorkerPool('album-prepare', ALBUM_PREPARE_WORKERS, user_max_jobs=None)  # ملفات الألبوم كلها لنفس المستخدم
 
 # قواميس التخزين الأساسية
 user_states = {}
 user_settings = {}
 user_video_data = {}
-PROGRESS_TRACKER = {} # لتتبع وقت آخر تحديث لرسائل التقدم (تجنب الحظر FloodWait)
+progress_dispatcher = ProgressDispatcher()  # كل تعديلات رسائل التقدم تمر عبره (دمج وحد للمعدل وFloodWait)
 
 # للإدارة والتخزين الخاص بالألبوم والمهام المتزامنة والتنظيف التلقائي
 user_active_tasks = {}       # يحفظ عدد الفيديوهات الجاري معالجتها حالياً للمستخدم
@@ -56,6 +63,11 @@ def track_message_for_cleanup(user_id, message_id):
     user_cleanup_messages[user_id].append(message_id)
 
 # -------------------------- دالة إرسال الألبوم والتنظيف --------------------------
+def prepare_album_item(f_path):
+    """تجهيز عنصر الألبوم: المدة والأبعاد والصورة المصغرة (غالباً محفوظة مسبقاً من خطوة الترميز)."""
+    thumb, dur, w, h = get_video_info_and_thumb(f_path)
+    return InputMediaVideo(f_path, thumb=thumb, duration=int(dur), width=w, height=h, supports_streaming=True)
+
 def send_user_album(client, chat_id, user_id):
     """تقوم بجمع الفيديوهات المنجزة وإرسالها ومسح الملفات والرسائل المؤقتة"""
     with task_lock:
@@ -67,27 +79,34 @@ def send_user_album(client, chat_id, user_id):
 
     st_msg = client.send_message(chat_id, "📤 جاري تجهيز ورفع النتيجة النهائية...")
 
-    # تجزئة الإرسال لكل 10 ملفات كحد أقصى للألبوم في تيليجرام
-    for i in range(0, len(files_to_send), 10):
-        chunk = files_to_send[i:i+10]
-        media_group = []
-        for f_path in chunk:
-            thumb, dur, w, h = get_video_info_and_thumb(f_path)
-            media_group.append(InputMediaVideo(f_path, thumb=thumb, duration=int(dur), width=w, height=h))
+    # تجزئة الإرسال لكل 10 ملفات كحد أقصى للألبوم في تيليجرام.
+    # تجهيز كل الملفات يبدأ فوراً بالتوازي (بحد ALBUM_PREPARE_WORKERS)، فبينما تُرفع مجموعة
+    # تكون المجموعة التالية قيد التجهيز. الرفع نفسه بالترتيب ليظهر الألبوم كما أُرسل.
+    chunks = [files_to_send[i:i+10] for i in range(0, len(files_to_send), 10)]
+    prepared_chunks = [
+        [album_prepare_executor.submit(prepare_album_item, f_path, user_id=user_id) for f_path in chunk]
+        for chunk in chunks
+    ]
 
+    for chunk, prepared in zip(chunks, prepared_chunks):
         try:
+            media_group = [future.result() for future in prepared]
             if len(media_group) == 1:
-                client.send_video(
-                    chat_id, video=chunk[0], caption="📦 النتيجة النهائية للملف.",
-                    duration=int(dur), width=w, height=h, thumb=thumb, supports_streaming=True
+                item = media_group[0]
+                call_with_flood_wait(
+                    client.send_video,
+                    chat_id, video=item.media, caption="📦 النتيجة النهائية للملف.",
+                    duration=item.duration, width=item.width, height=item.height, thumb=item.thumb, supports_streaming=True
                 )
             else:
-                client.send_media_group(chat_id, media=media_group)
+                call_with_flood_wait(client.send_media_group, chat_id, media=media_group)
         except Exception as e:
             client.send_message(chat_id, f"❌ خطأ أثناء رفع المجموعة: {e}")
         finally:
             for f_path in chunk:
                 if os.path.exists(f_path): os.remove(f_path)
+                discard_thumbnails(f_path)
+                clear_media_info_cache(f_path)
 
     try: st_msg.delete()
     except: pass
@@ -100,6 +119,19 @@ def send_user_album(client, chat_id, user_id):
         user_cleanup_messages[user_id] = []
 
 
+def add_finished_file(user_id, album_path, client, chat_id):
+    """تسجيل ملف مضغوط جاهز للألبوم، مع إرسال فوري عند اكتمال 10 ملفات في الوضع التلقائي"""
+    with task_lock:
+        if user_id not in user_finished_files:
+            user_finished_files[user_id] = []
+        user_finished_files[user_id].append(album_path)
+        files_count_now = len(user_finished_files[user_id])
+
+        # فحص إرسال الـ 10 ملفات مباشرة في حالة التلقائي لتفريغ الطابور 
+        if get_user_settings(user_id)['auto_send_album'] and files_count_now >= 10:
+            threading.Thread(target=send_user_album, args=(client, chat_id, user_id)).start()
+
+
 def check_and_prompt_album(user_id, client, chat_id):
     """ تتحقق إذا انتهت جميع العمليات بالخلفية للمستخدم لتعرض له الألبوم أو ترسله تلقائياً """
     with task_lock:
@@ -131,16 +163,15 @@ def check_and_prompt_album(user_id, client, chat_id):
 
 # -------------------------- وظائف المساعدة وحساب الحجم والتقدم --------------------------
 
-def update_progress_msg(current, total, client, message, action, start_time, known_size=0):
+def update_progress_msg(current, total, client, message, action, start_time, known_size=0, encode_event=None):
     now = time.time()
     msg_id = message.id
 
     if total <= 0 and known_size > 0: total = known_size
     is_finished = (current >= total) if total > 0 else False
 
-    if msg_id in PROGRESS_TRACKER and (now - PROGRESS_TRACKER[msg_id]) < 5.0 and not is_finished:
+    if not progress_dispatcher.due(message.chat.id, msg_id, final=is_finished):
         return
-    PROGRESS_TRACKER[msg_id] = now
 
     percent = (current * 100 / total) if total > 0 else 0
     filled = int(percent / 10) if percent > 0 else 0
@@ -167,57 +198,26 @@ def update_progress_msg(current, total, client, message, action, start_time, kno
                 speed_text = f"🚀 **السرعة:** `{speed_mb:.2f} MB/s`\n"
                 console_speed = f"| السرعة: {speed_mb:.2f} MB/s "
 
+    # الضغط: السرعة والوقت المتبقي من تقدم FFmpeg نفسه بدلاً من تقديرهما من الزمن المنقضي
+    if encode_event is not None and encode_event.speed > 0:
+        speed_text = f"🚀 **السرعة:** `{encode_event.speed:.2f}x` | `{encode_event.fps:.0f} fps`\n"
+        if encode_event.projected_size > 0:
+            speed_text += f"📦 **الحجم المتوقع:** `{encode_event.projected_size / (1024 * 1024):.2f} MB`\n"
+        console_speed = f"| السرعة: {encode_event.speed:.2f}x "
+        if encode_event.eta is not None:
+            eta_text = f"{int(encode_event.eta)} ثانية"
+
+    if encode_event is not None and encode_event.attempt > 1:
+        action = f"{action} (إعادة ترميز لضبط الحجم، محاولة {encode_event.attempt})"
+    if encode_event is not None and encode_event.stage == 'resolution':
+        action = "🔍 **جاري اختيار أفضل دقة للحجم المطلوب (ترميز عينات)...**"
+        curr_val, total_val = f"{current:.0f} عينة", f"{total:.0f} عينة"
     text = (f"{action}\n{bar} `{percent:.1f}%`\n📊 **التقدم:** `{curr_val} / {total_val}`\n{speed_text}⏱ **الوقت المتبقي:** `{eta_text}`")
     clean_action = action.replace('*', '').replace('`', '').split('\n')[0].strip()
     console_log = f"[Task Msg:{msg_id}] {clean_action} | {percent:.1f}% | {curr_val} / {total_val} {console_speed}| المتبقي: {eta_text}"
     print(console_log)
 
-    try: client.edit_message_text(chat_id=message.chat.id, message_id=message.id, text=text)
-    except FloodWait as e: time.sleep(e.value)
-    except Exception: pass
-
-def get_video_info_and_thumb(file_path):
-    duration, width, height, thumb_path = 0.0, 0, 0, None
-    try:
-        cmd = f'ffprobe -v quiet -print_format json -show_streams "{file_path}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-
-        for stream in data.get('streams', []):
-            if stream.get('codec_type') == 'video':
-                width = int(stream.get('width', 0))
-                height = int(stream.get('height', 0))
-                duration = float(stream.get('duration', 0))
-                break
-
-        thumb_time = min(1.0, duration * 0.1) if duration > 0 else 1.0
-        thumb_path = file_path + "_thumb.jpg"
-        thumb_cmd = f'ffmpeg -y -ss {thumb_time} -i "{file_path}" -vframes 1 -vf "scale=320:-1" -q:v 5 "{thumb_path}" -loglevel quiet'
-        subprocess.run(thumb_cmd, shell=True)
-        if not os.path.exists(thumb_path): thumb_path = None
-    except Exception as e: print(f"Error getting video info: {e}")
-    return thumb_path, duration, width, height
-
-def time_to_seconds(time_str):
-    try: h, m, s = time_str.split(':'); return int(h) * 3600 + int(m) * 60 + float(s)
-    except: return 0
-
-def get_telegram_duration(message):
-    if message.video and message.video.duration: return float(message.video.duration)
-    elif message.animation and message.animation.duration: return float(message.animation.duration)
-    return 0
-
-def get_video_duration(file_path):
-    try:
-        cmd = f'ffprobe -v quiet -print_format json -show_format "{file_path}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return float(json.loads(result.stdout)['format']['duration'])
-    except: return 0
-
-def calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps=128):
-    if duration_seconds <= 0: return 500
-    total_bitrate_kbps = (target_size_mb * 8192) / duration_seconds
-    return max(50, int(total_bitrate_kbps - audio_bitrate_kbps))
+    progress_dispatcher.push(client, message.chat.id, msg_id, text, final=is_finished)
 
 def cleanup_downloads():
     print("Cleaning up downloads directory...")
@@ -226,6 +226,7 @@ def cleanup_downloads():
         try:
             if os.path.isfile(file_path): os.remove(file_path); print(f"Deleted old file: {file_path}")
         except Exception: pass
+    shutil.rmtree(ALBUM_STAGING_DIR, ignore_errors=True)
 
 # -------------------------- تهيئة العميل --------------------------
 app = Client("video_compressor_bot", api_id=API_ID, api_hash=API_HASH, bot_token=API_TOKEN)
@@ -252,7 +253,7 @@ def process_video_for_compression(video_data):
         try:
             app.edit_message_reply_markup(
                 chat_id=message.chat.id, message_id=button_message_id,
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⏳ تم وضعه بطابور المعالجة...", callback_data="none")]])
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⚙️ جاري المعالجة الآن...", callback_data="none")]])
             )
             # إضافة للمنظف
             track_message_for_cleanup(user_id, button_message_id)
@@ -268,56 +269,55 @@ def process_video_for_compression(video_data):
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
 
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            duration=total_duration,
+            segments=plan_segments(total_duration, encoder),
+            faststart=True,
+            thumbnail_count=THUMBNAIL_CANDIDATES  # عدة صور مرشحة من نفس الترميز تُحفظ مع ملف الألبوم
+        )
         if isinstance(quality, dict) and 'target_size' in quality:
             target_size_mb = quality['target_size']
-            target_v_bitrate = calculate_target_bitrate(target_size_mb, total_duration, 128)
-            quality_settings = f"-b:v {target_v_bitrate}k -maxrate {target_v_bitrate}k -bufsize {target_v_bitrate*2}k -preset fast"
+            job.target_size_mb = target_size_mb
+            job.two_pass = True
+            job.auto_resolution = TARGET_SIZE_AUTO_RESOLUTION  # الدقة تُختار بالعينات عند بدء الضغط
             used_mode_text = f"🎯 حجم مستهدف/نسبة مئوية: ~{target_size_mb:.2f} MB"
         else:
             quality_value = int(quality.split('_')[1]) if isinstance(quality, str) and 'crf_' in quality else int(quality)
-            preset = "fast"
-            if quality_value <= 18: preset = "slow"
-            elif quality_value <= 23: preset = "medium"
-            elif quality_value >= 27: preset = "veryfast" if encoder == 'libx264' else "fast"
-            quality_param = "cq" if "nvenc" in encoder else "crf"
-            quality_settings = f"-{quality_param} {quality_value} -preset {preset}"
+            job.quality_value = quality_value
             used_mode_text = f"🎥 الجودة: CRF {quality_value}"
 
-        ffmpeg_command = f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} -c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} -ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -map_metadata -1 {quality_settings} -movflags +faststart "{temp_compressed_filename}"'
+        compression_executor.choose_preset(job, message)
 
         progress_msg = message.reply_text("🔄 **بدأ ضغط الفيديو (متزامن)...**", quote=True)
         start_time = time.time()
 
-        process = subprocess.Popen(ffmpeg_command, shell=True, stderr=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
-        for line in process.stderr:
-            if total_duration > 0:
-                time_match = re.search(r"time=\s*(\d{2}:\d{2}:\d{2}\.\d+)", line)
-                if time_match:
-                    update_progress_msg(time_to_seconds(time_match.group(1)), total_duration, app, progress_msg, "⚙️ **جاري المعالجة...**", start_time)
+        result = compress(job, lambda event: update_progress_msg(event.out_time, event.duration, app, progress_msg, "⚙️ **جاري المعالجة والضغط...**", start_time, encode_event=event))
+        if job.mode == 'target_size':
+            used_mode_text += f"\n🔁 عدد تمريرات الترميز: {result.passes}"
 
-        process.wait()
-        if process.returncode != 0: raise Exception("FFmpeg failed.")
+        progress_dispatcher.forget(progress_msg.chat.id, progress_msg.id)
 
         try: progress_msg.delete()
         except: pass
 
-        compressed_file_size_mb = os.path.getsize(temp_compressed_filename) / (1024 * 1024)
+        compressed_file_size_mb = result.output_size_mb
 
-        # حفظ الملف لاستخدامه لاحقاً في الألبوم (دون رفع فردي)
+        # نقل الملف لمجلد ألبوم المستخدم لاستخدامه لاحقاً (دون رفع فردي)
+        album_sink = AlbumSink(
+            ALBUM_STAGING_DIR, user_id,
+            lambda album_path: add_finished_file(user_id, album_path, app, message.chat.id),
+            quota_mb=ALBUM_STAGING_QUOTA_MB
+        )
         try:
-            album_copy_path = os.path.join(DOWNLOADS_DIR, f"album_file_{user_id}_{int(time.time()*100)}.mp4")
-            shutil.copy2(temp_compressed_filename, album_copy_path)
-            with task_lock:
-                if user_id not in user_finished_files:
-                    user_finished_files[user_id] = []
-                user_finished_files[user_id].append(album_copy_path)
-                files_count_now = len(user_finished_files[user_id])
-
-                # فحص إرسال الـ 10 ملفات مباشرة في حالة التلقائي لتفريغ الطابور 
-                if user_prefs['auto_send_album'] and files_count_now >= 10:
-                    threading.Thread(target=send_user_album, args=(app, message.chat.id, user_id)).start()
-
-        except Exception as ex: print(f"Failed copy: {ex}")
+            album_sink.deliver(result)
+        except AlbumQuotaExceeded as ex:
+            # المساحة ممتلئة: نرسل الألبوم المتجمع لتفريغها ثم نحفظ الملف الجديد
+            print(f"[{threading.current_thread().name}] {ex}; sending pending album first.")
+            send_user_album(app, message.chat.id, user_id)
+            album_sink.deliver(result)
 
         # رسالة مؤقتة يتم تنظيفها تلقائيا لاحقاً
         fin_msg = message.reply_text(
@@ -330,6 +330,7 @@ def process_video_for_compression(video_data):
         message.reply_text(f"❌ حدث خطأ: `{str(e)[:150]}`", quote=True)
     finally:
         if temp_compressed_filename and os.path.exists(temp_compressed_filename): os.remove(temp_compressed_filename)
+        if temp_compressed_filename: discard_thumbnails(temp_compressed_filename)
 
         auto_msg_id = video_data.get('auto_compress_status_message_id')
         if auto_msg_id:
@@ -343,6 +344,10 @@ def process_video_for_compression(video_data):
         check_and_prompt_album(user_id, app, message.chat.id)
 
 
+# إرسال المهمة لمجمع مرمز المستخدم وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها
+enqueue_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
 def auto_select_medium_quality(button_message_id):
     if button_message_id in user_video_data:
         video_data = user_video_data[button_message_id]
@@ -354,7 +359,7 @@ def auto_select_medium_quality(button_message_id):
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ تم التفعيل لانقضاء الوقت", callback_data="none")]]))
                 track_message_for_cleanup(video_data['user_id'], button_message_id)
             except: pass
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
 
 # -------------------------- معالجات رسائل تيليجرام --------------------------
 
@@ -382,7 +387,7 @@ def handle_text_inputs(client, message):
             if button_msg_id in user_video_data:
                 video_data = user_video_data[button_msg_id]
                 video_data['quality'] = {"target_size": size}
-                compression_executor.submit(process_video_for_compression, video_data)
+                enqueue_compression(video_data)
                 del user_states[user_id]
             else: message.reply_text("❌ الجلسة منتهية.")
         except: message.reply_text("❌ أرسل رقماً صحيحاً.")
@@ -398,7 +403,7 @@ def handle_text_inputs(client, message):
                 video_data = user_video_data[button_msg_id]
                 orig_size = os.path.getsize(video_data['file']) / (1024 * 1024)
                 video_data['quality'] = {"target_size": (pct/100) * orig_size}
-                compression_executor.submit(process_video_for_compression, video_data)
+                enqueue_compression(video_data)
                 del user_states[user_id]
             else: message.reply_text("❌ الزر منتهي الصلاحية.")
         except: message.reply_text("❌ أرسل من 1 لـ 100 فقط.")
@@ -460,6 +465,7 @@ def post_download_actions(original_message_id):
 
     try:
         video_data['file'] = video_data['download_future'].result()
+        progress_dispatcher.forget(download_msg.chat.id, download_msg.id)
         try: download_msg.delete()
         except: pass
 
@@ -474,7 +480,7 @@ def post_download_actions(original_message_id):
 
             st_msg = message.reply_text("🚀 تلقائي: جاري إضافة الملف لمعالج الضغط...", quote=True)
             video_data['auto_compress_status_message_id'] = st_msg.id
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
         else:
             markup = InlineKeyboardMarkup([
                 [InlineKeyboardButton("ضعيفة (CRF 27)", callback_data="crf_27"),
@@ -489,12 +495,13 @@ def post_download_actions(original_message_id):
 
             video_data['button_message_id'] = rep.id
             user_video_data[rep.id] = user_video_data.pop(original_message_id)
-            timer = threading.Timer(300, auto_select_medium_quality, args=[rep.id])
+            timer = LoopTimer(app, 300, auto_select_medium_quality, args=[rep.id])
             user_video_data[rep.id]['timer'] = timer
             timer.start()
 
     except Exception as e:
         message.reply_text(f"❌ خطأ أثناء التحميل: {e}")
+        download_registry.release_source(video_data)
         if original_message_id in user_video_data: del user_video_data[original_message_id]
         check_and_prompt_album(user_id, app, message.chat.id)
 
@@ -511,17 +518,18 @@ def handle_incoming_video(client, message):
 
     download_msg = message.reply_text("📥 في طابور التنزيل...", quote=True)
 
-    download_future = download_executor.submit(
-        client.download_media, message=file_id, file_name=file_name,
-        progress=update_progress_msg, progress_args=(client, download_msg, "📥 **جاري التنزيل...**", time.time(), file_size)
-    )
+    download_future, _ = download_registry.download(message, lambda: download_executor.submit(
+            client.download_media, message=file_id, file_name=file_name,
+            progress=update_progress_msg, progress_args=(client, download_msg, "📥 **جاري التنزيل...**", time.time(), file_size),
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+    ))
 
     user_video_data[message.id] = {
         'message': message, 'download_msg': download_msg, 'download_future': download_future,
         'file': None, 'button_message_id': None, 'timer': None, 'quality': None,
         'processing_started': False, 'user_id': user_id, 'auto_compress_status_message_id': None 
     }    
-    threading.Thread(target=post_download_actions, args=[message.id]).start()
+    run_when_done(app, download_future, post_download_actions, message.id)
 
 @app.on_callback_query()
 def universal_callback_handler(client, callback_query):
@@ -591,7 +599,7 @@ def universal_callback_handler(client, callback_query):
 
     if data == "cancel_compression":
         if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
-        if video_data.get('file') and os.path.exists(video_data['file']): os.remove(video_data['file'])
+        download_registry.release_source(video_data)
         try: message.delete()
         except: pass
         check_and_prompt_album(user_id, client, message.chat.id)
@@ -614,9 +622,10 @@ def universal_callback_handler(client, callback_query):
 
     if video_data.get('timer'): video_data['timer'].cancel()
     video_data['quality'] = data
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
 
 if __name__ == "__main__":
     cleanup_downloads()
+    start_metrics_server(METRICS_PORT)
     print("\n✅ البوت يعمل بطوابير المزامنة والألبومات والتنظيف التلقائي...")
     app.run()
@@ -0,0 +1,206 @@
+"""
+مصفوفة قياس الترميز: كل مقطع مرجعي عبر كل تركيبة (مرمز × preset × CRF) يمكن للبوت إنتاجها،
+بنفس أمر FFmpeg الذي يبنيه المحرك. يُسجل الزمن الفعلي وزمن المعالج وحجم الناتج ودرجة الجودة
+(VMAF أو SSIM بمرشحات FFmpeg)، ثم يطبع جدولاً بالتركيبات المثلى (Pareto) لاختيار الإعدادات بالبيانات.
+
+الاستخدام:
+    python benchmarks/encode_matrix.py [مقاطع...] --encoders libx264,libx265 --crf 18,23,27,30 --metric vmaf
+بدون مقاطع تُولد مقاطع اختبارية بـ lavfi.
+"""
+import os
+import re
+import csv
+import json
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import (
+    CompressionJob, FFmpegError, build_ffmpeg_command, get_video_duration, probe_media, quality_score, run_ffmpeg,
+    select_preset,
+)
+
+# مقاطع مولدة بمحتوى مختلف: حركة ناعمة، تفاصيل كثيفة، وضوضاء (الأصعب ضغطاً)
+SYNTHETIC_SOURCES = {
+    'testsrc2': "testsrc2=size={size}:rate=30",
+    'mandelbrot': "mandelbrot=size={size}:rate=30",
+    'noise': "testsrc2=size={size}:rate=30,noise=alls=30:allf=t",
+}
+BOT_CRF_VALUES = "18,23,27,30"  # أزرار الجودة (18/23/27) والقيمة التلقائية الافتراضية (30)
+
+
+def generate_corpus(directory, seconds, size):
+    clips = []
+    for name, source in SYNTHETIC_SOURCES.items():
+        path = os.path.join(directory, f"{name}.mp4")
+        subprocess.run([
+            "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", source.format(size=size),
+            "-t", str(seconds), "-c:v", "libx264", "-crf", "10", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path,
+        ], check=True)
+        clips.append(path)
+    return clips
+
+
+def ladder_presets(encoder, crf_values):
+    """الـ presets التي يختارها سلم البوت (select_preset) لقيم CRF المعطاة، بالترتيب من الأسرع."""
+    order = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+    return sorted({select_preset(crf, encoder) for crf in crf_values}, key=order.index)
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def clip_duration(path):
+    """المدة من ffprobe، أو من سطر Duration في مخرجات ffmpeg -i إذا لم يتوفر ffprobe."""
+    duration = get_video_duration(path)
+    if duration:
+        return duration
+    stderr = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True).stderr
+    match = re.search(r"Duration:\s*(\d+):(\d+):([\d.]+)", stderr)
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3)) if match else 0.0
+
+
+def measure(clip, encoder, preset, crf, metric, workdir):
+    duration = clip_duration(clip)
+    output = os.path.join(workdir, f"out_{encoder}_{preset}_{crf}.mp4")
+    job = CompressionJob(input_path=clip, output_path=output, encoder=encoder, quality_value=crf,
+                         preset=preset, duration=duration)
+    command = build_ffmpeg_command(job)
+
+    cpu_before = children_cpu_seconds()
+    start = time.perf_counter()
+    run_ffmpeg(command, duration)
+    wall = time.perf_counter() - start
+    cpu = children_cpu_seconds() - cpu_before
+
+    size = os.path.getsize(output)
+    score = quality_score(output, clip, metric)
+    os.remove(output)
+    return {
+        'wall': wall, 'cpu': cpu, 'size': size, 'quality': score,
+        'speed': duration / wall if wall > 0 else 0.0,
+        'kbps': size * 8 / 1000 / duration if duration else 0.0,
+    }
+
+
+def clip_pixels(path, fallback_size):
+    try:
+        width, height = probe_media(path).display_size
+    except Exception:
+        width, height = (int(value) for value in fallback_size.split('x'))
+    return width * height
+
+
+def write_preset_table(path, rows, reference_pixels):
+    """جدول PresetPolicy: متوسط السرعة ومعدل البت لكل مرمز وpreset عبر قيم CRF المقاسة."""
+    encoders = {}
+    for row in rows:
+        encoders.setdefault(row['encoder'], {}).setdefault(row['preset'], []).append(row)
+    table = {
+        'reference_pixels': reference_pixels,
+        'encoders': {
+            encoder: {
+                preset: {
+                    'speed': round(statistics.mean(row['speed'] for row in preset_rows), 3),
+                    'kbps': round(statistics.mean(row['kbps'] for row in preset_rows), 1),
+                }
+                for preset, preset_rows in presets.items()
+            }
+            for encoder, presets in encoders.items()
+        },
+    }
+    with open(path, "w") as handle:
+        json.dump(table, handle, indent=2)
+    print(f"Wrote preset table for {', '.join(encoders)} to {path}")
+
+
+def pareto_front(rows):
+    """التركيبات التي لا توجد غيرها أسرع وأصغر وأعلى جودة منها معاً (لكل مرمز على حدة)."""
+    front = set()
+    for index, row in enumerate(rows):
+        dominated = any(
+            other is not row and other['encoder'] == row['encoder']
+            and other['wall'] <= row['wall'] and other['kbps'] <= row['kbps'] and other['quality'] >= row['quality']
+            and (other['wall'], other['kbps'], other['quality']) != (row['wall'], row['kbps'], row['quality'])
+            for other in rows
+        )
+        if not dominated:
+            front.add(index)
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder/preset/CRF benchmark matrix with a Pareto table.")
+    parser.add_argument("clips", nargs="*", help="reference clips (default: generated lavfi corpus)")
+    parser.add_argument("--encoders", default="libx264,libx265")
+    parser.add_argument("--presets", default=None,
+                        help="comma-separated presets (default: the ones the bot's ladder emits for the CRF values)")
+    parser.add_argument("--crf", default=BOT_CRF_VALUES, help="comma-separated CRF/CQ values")
+    parser.add_argument("--metric", choices=("vmaf", "ssim"), default="vmaf")
+    parser.add_argument("--seconds", type=float, default=5, help="length of generated clips")
+    parser.add_argument("--size", default="1280x720", help="resolution of generated clips")
+    parser.add_argument("--csv", help="also write every measurement to this CSV file")
+    parser.add_argument("--table-out", help="write the speed table used by PresetPolicy (PRESET_TABLE_PATH)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="encode_matrix_")
+    clips = args.clips or generate_corpus(workdir, args.seconds, args.size)
+    crf_values = [int(value) for value in args.crf.split(',')]
+    encoders = args.encoders.split(',')
+
+    try:
+        quality_score(clips[0], clips[0], args.metric)
+    except (FFmpegError, ValueError) as e:
+        print(f"{e}; falling back to SSIM.")
+        args.metric = 'ssim'
+
+    rows = []
+    for encoder in encoders:
+        presets = args.presets.split(',') if args.presets else ladder_presets(encoder, crf_values)
+        for preset in presets:
+            for crf in crf_values:
+                samples = []
+                for clip in clips:
+                    sample = measure(clip, encoder, preset, crf, args.metric, workdir)
+                    print(f"{encoder:<8} {preset:<9} crf {crf:<3} {os.path.basename(clip):<18} "
+                          f"{sample['wall']:6.2f}s  {sample['kbps']:8.0f} kb/s  {args.metric} {sample['quality']:.4f}")
+                    samples.append(sample)
+                rows.append({
+                    'encoder': encoder, 'preset': preset, 'crf': crf,
+                    'ladder': select_preset(crf, encoder) == preset,
+                    **{key: statistics.mean(sample[key] for sample in samples) for key in samples[0]},
+                })
+
+    front = pareto_front(rows)
+    print(f"\n=== {len(clips)} clip(s), averaged; * = Pareto-optimal (time, bitrate, {args.metric}); "
+          f"L = current ladder choice ===")
+    print(f"{'':2}{'encoder':<9}{'preset':<10}{'crf':>4}{'wall s':>9}{'cpu s':>9}{'speed x':>9}{'kb/s':>9}{args.metric:>9}")
+    for index, row in sorted(enumerate(rows), key=lambda item: (item[1]['encoder'], -item[1]['quality'])):
+        mark = ("*" if index in front else " ") + ("L" if row['ladder'] else " ")
+        print(f"{mark}{row['encoder']:<9}{row['preset']:<10}{row['crf']:>4}{row['wall']:>9.2f}{row['cpu']:>9.2f}"
+              f"{row['speed']:>9.2f}{row['kbps']:>9.0f}{row['quality']:>9.4f}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as handle:
+            writer = csv.DictWriter(handle, fieldnames=list(rows[0]) + ['pareto'])
+            writer.writeheader()
+            for index, row in enumerate(rows):
+                writer.writerow({**row, 'pareto': index in front})
+        print(f"\nWrote {len(rows)} rows to {args.csv}")
+    if args.table_out:
+        reference_pixels = statistics.mean(clip_pixels(clip, args.size) for clip in clips)
+        write_preset_table(args.table_out, rows, reference_pixels)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
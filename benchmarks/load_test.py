@@ -0,0 +1,364 @@
+"""
+اختبار حمل لبوت googlepro3 بعميل تيليجرام وهمي داخل نفس العملية ومقاطع مولدة بـ FFmpeg (lavfi).
+العميل الوهمي يحاكي سرعة التنزيل والرفع وحد تعديل الرسائل (مع FloodWait)، والمعالجات الحقيقية
+(handle_incoming_video / post_download_actions / universal_callback_handler / process_video_for_compression)
+تعمل كما هي. يطبع عدد المهام بالدقيقة وزمن الإنجاز p50/p95 وزمن كل مرحلة.
+
+الاستخدام:
+    python benchmarks/load_test.py --jobs 20 --rate 2 --mix auto=0.5,manual=0.3,target=0.1,duplicate=0.1
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram.errors import FloodWait
+
+CHUNK_SIZE = 512 * 1024
+MIX_KINDS = ('auto', 'manual', 'target', 'duplicate')
+
+# ------ المقاطع المولدة ------
+
+
+def generate_clip(path, seconds, size):
+    """مقطع اختباري (testsrc2 + نغمة) بترتيب faststart ليصلح للضغط أثناء التنزيل أيضاً."""
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "3M", "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+faststart", "-shortest", path,
+    ], check=True)
+    return path
+
+
+# ------ العميل والرسائل الوهمية ------
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}  # message_id -> dict أوقات المراحل
+        self.edits = 0
+        self.flood_waits = 0
+
+    def mark(self, message_id, name, when=None, first=False):
+        with self.lock:
+            job = self.jobs.get(message_id)
+            if job is None or (first and name in job):
+                return
+            job[name] = when or time.time()
+
+
+class FakeMessage:
+    def __init__(self, client, chat_id, user_id, message_id, text=None, video=None):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.video = video
+        self.animation = None
+        self.document = None
+        self.empty = False
+
+    def reply_text(self, text, quote=False, reply_markup=None, **kwargs):
+        return self._client.send_message(self.chat.id, self.from_user.id, text, reply_markup=reply_markup, reply_to=self)
+
+    def reply_document(self, document, caption=None, progress=None, progress_args=(), **kwargs):
+        return self._client.send_document(self, document, progress, progress_args)
+
+    def edit_text(self, text, reply_markup=None, **kwargs):
+        return self._client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+    def delete(self):
+        return True
+
+
+class FakeClient:
+    """بديل لـ pyrogram.Client بالدوال التي يستدعيها البوت فقط، مع محاكاة الشبكة وحدود تيليجرام."""
+
+    def __init__(self, clips, metrics, args):
+        self.clips = clips                  # file_id -> مسار المقطع
+        self.metrics = metrics
+        self.down_bps = args.down_mbps * 1024 * 1024
+        self.up_bps = args.up_mbps * 1024 * 1024
+        self.edit_interval = args.edit_interval
+        self.flood_seconds = args.flood_seconds
+        self.on_buttons = None              # يُستدعى عند عرض أزرار الجودة (محاكاة المستخدم)
+        self._ids = iter(range(10 ** 6, 10 ** 9))
+        self._id_lock = threading.Lock()
+        self._last_edit = {}                # chat_id -> وقت آخر تعديل
+        self._edit_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(args.handler_workers, thread_name_prefix="Handler")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="FakeClientLoop", daemon=True).start()
+
+    def next_id(self):
+        with self._id_lock:
+            return next(self._ids)
+
+    def _transfer(self, size, bps, progress, progress_args, on_chunk=None):
+        done = 0
+        while done < size:
+            step = min(CHUNK_SIZE, size - done)
+            time.sleep(step / bps)
+            done += step
+            if on_chunk:
+                on_chunk(done - step, step)
+            if progress:
+                progress(done, size, *progress_args)
+
+    # ------ الرسائل ------
+
+    def send_message(self, chat_id, user_id, text, reply_markup=None, reply_to=None):
+        sent = FakeMessage(self, chat_id, user_id, self.next_id(), text=text)
+        callbacks = {
+            button.callback_data for row in getattr(reply_markup, 'inline_keyboard', []) for button in row
+        }
+        if 'target_size_prompt' in callbacks and self.on_buttons and reply_to is not None:
+            self.on_buttons(reply_to, sent)
+        return sent
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        now = time.time()
+        with self._edit_lock:
+            last = self._last_edit.get(chat_id, 0)
+            if now - last < self.edit_interval:
+                self.metrics.flood_waits += 1
+                raise FloodWait(value=self.flood_seconds)
+            self._last_edit[chat_id] = now
+            self.metrics.edits += 1
+        return True
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None, **kwargs):
+        return True
+
+    def delete_messages(self, chat_id, message_ids, **kwargs):
+        return True
+
+    # ------ الملفات ------
+
+    def download_media(self, message, file_name, progress=None, progress_args=(), **kwargs):
+        job_id = int(message.split('-')[1])
+        self.metrics.mark(job_id, 'download_start')
+        source = self.clips[message]
+        with open(source, 'rb') as src, open(file_name, 'wb') as dst:
+            self._transfer(os.path.getsize(source), self.down_bps, progress, progress_args,
+                           lambda offset, step: dst.write(src.read(step)))
+        self.metrics.mark(job_id, 'download_end')
+        return file_name
+
+    def stream_media(self, message):
+        self.metrics.mark(message.id, 'download_start')
+        source = self.clips[message.video.file_id]
+        size = os.path.getsize(source)
+        with open(source, 'rb') as src:
+            done = 0
+            while done < size:
+                chunk = src.read(CHUNK_SIZE)
+                time.sleep(len(chunk) / self.down_bps)
+                done += len(chunk)
+                yield chunk
+        self.metrics.mark(message.id, 'download_end')
+
+    def send_document(self, message, document, progress, progress_args):
+        if os.path.exists(str(document)):
+            self.metrics.mark(message.id, 'upload_start')
+            self._transfer(os.path.getsize(document), self.up_bps, progress, progress_args)
+            self.metrics.mark(message.id, 'upload_end')
+            file_id = f"doc-{self.next_id()}"
+        else:
+            file_id = document  # إعادة إرسال file_id محفوظ: بدون رفع
+            self.metrics.mark(message.id, 'cached')
+        self.metrics.mark(message.id, 'done')
+        return SimpleNamespace(id=self.next_id(), document=SimpleNamespace(file_id=file_id))
+
+
+# ------ تشغيل السيناريو ------
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in MIX_KINDS:
+            raise argparse.ArgumentTypeError(f"unknown traffic kind '{kind}' (expected {', '.join(MIX_KINDS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="compress_load_")
+    os.chdir(workdir)  # البوت ينشئ ./downloads وقاعدة المهام في المجلد الحالي
+    import googlepro3 as bot
+
+    random.seed(args.seed)
+    durations = [float(value) for value in args.clip_seconds.split(',')]
+    print(f"Generating {len(durations)} clip(s) ({args.size}) in {workdir} ...")
+    sources = [generate_clip(os.path.join(workdir, f"clip_{index}.mp4"), seconds, args.size)
+               for index, seconds in enumerate(durations)]
+
+    metrics = Metrics()
+    client = FakeClient({}, metrics, args)
+    bot.app = client
+    bot.STREAMING_COMPRESSION = args.streaming
+
+    def user_clicks(video_message, button_message):
+        plan = plans[video_message.id]
+
+        def click():
+            query = SimpleNamespace(
+                data=f"crf_{args.crf}" if plan['kind'] != 'target' else 'target_size_prompt',
+                from_user=video_message.from_user, message=button_message,
+                answer=lambda *a, **k: None,
+            )
+            bot.universal_callback_handler(client, query)
+            if plan['kind'] == 'target':
+                reply = FakeMessage(client, video_message.chat.id, video_message.from_user.id,
+                                    client.next_id(), text=str(plan['target_mb']))
+                bot.handle_text_inputs(client, reply)
+
+        client.loop.call_soon_threadsafe(client.loop.call_later, args.think, client.executor.submit, click)
+
+    client.on_buttons = user_clicks
+
+    # نغلف process_video_for_compression لتسجيل بداية ونهاية المعالجة، ونعيد بناء دالة الإرسال
+    # للطابور لأنها تحتفظ بالدالة الأصلية منذ تحميل الوحدة
+    process = bot.process_video_for_compression
+
+    def timed_process(video_data):
+        message_id = video_data['message'].id
+        metrics.mark(message_id, 'process_start')
+        try:
+            return process(video_data)
+        finally:
+            metrics.mark(message_id, 'done')
+
+    bot.process_video_for_compression = timed_process
+    bot.submit_compression = bot.compression_executor.video_submitter(timed_process, bot.get_user_settings, client=bot.app)
+
+    kinds, weights = zip(*args.mix.items())
+    plans = {}
+    sent_unique = []
+    start = time.time()
+    for index in range(args.jobs):
+        kind = random.choices(kinds, weights)[0]
+        if kind == 'duplicate' and not sent_unique:
+            kind = 'auto'
+        message_id = index + 1
+        user_id = 1000 + index
+        if kind == 'duplicate':
+            unique_id, source, quality_kind = random.choice(sent_unique)
+        else:
+            source = random.choice(sources)
+            unique_id, quality_kind = f"uniq-{message_id}", kind
+            sent_unique.append((unique_id, source, kind))
+        file_id = f"file-{message_id}"
+        client.clips[file_id] = source
+        info = bot.get_user_settings(user_id)
+        info['encoder'] = args.encoder
+        info['auto_compress'] = quality_kind == 'auto'
+        info['auto_quality_value'] = args.crf
+        duration = durations[sources.index(source)]
+        video = SimpleNamespace(
+            file_id=file_id, file_unique_id=unique_id, duration=int(duration),
+            width=int(args.size.split('x')[0]), height=int(args.size.split('x')[1]),
+            file_size=os.path.getsize(source),
+        )
+        plans[message_id] = {'kind': quality_kind, 'target_mb': args.target_mb}  # المكرر يتبع اختيار الطلب الأصلي
+        message = FakeMessage(client, chat_id=user_id, user_id=user_id, message_id=message_id, video=video)
+        with metrics.lock:
+            metrics.jobs[message_id] = {'kind': kind, 'arrive': time.time()}
+        client.executor.submit(bot.handle_incoming_video, client, message)
+        time.sleep(random.expovariate(args.rate) if args.rate > 0 else 0)
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        with metrics.lock:
+            pending = [job for job in metrics.jobs.values() if 'done' not in job]
+        if not pending:
+            break
+        time.sleep(0.5)
+    elapsed = time.time() - start
+    report(metrics, elapsed, args)
+    bot.job_store.close()
+    os.chdir(os.path.dirname(workdir))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def report(metrics, elapsed, args):
+    jobs = list(metrics.jobs.values())
+    finished = [job for job in jobs if 'done' in job]
+    print(f"\n=== Load test: {len(jobs)} jobs, mix {args.mix}, streaming={args.streaming}, encoder={args.encoder} ===")
+    print(f"Finished {len(finished)}/{len(jobs)} in {elapsed:.1f}s -> {len(finished) / elapsed * 60:.1f} jobs/minute")
+
+    turnaround = [job['done'] - job['arrive'] for job in finished]
+    print(f"Turnaround   p50 {percentile(turnaround, 0.5):7.2f}s   p95 {percentile(turnaround, 0.95):7.2f}s")
+
+    phases = {
+        'download': [job['download_end'] - job['download_start'] for job in finished if 'download_end' in job],
+        'queue': [
+            job['process_start'] - job.get('download_end', job['arrive']) for job in finished
+            if 'process_start' in job and job.get('download_end', job['arrive']) <= job['process_start']
+        ],
+        'encode': [job['upload_start'] - job['process_start'] for job in finished if 'upload_start' in job and 'process_start' in job],
+        'upload': [job['upload_end'] - job['upload_start'] for job in finished if 'upload_end' in job],
+    }
+    print("\nPhase        count    mean      p50      p95   (queue includes the think time of manual/target jobs)")
+    for name, values in phases.items():
+        if values:
+            print(f"{name:<12} {len(values):5d} {statistics.mean(values):7.2f}s {percentile(values, 0.5):7.2f}s {percentile(values, 0.95):7.2f}s")
+        else:
+            print(f"{name:<12} {0:5d}       -        -        -")
+
+    print("\nKind         count   p50 turnaround")
+    for kind in MIX_KINDS:
+        values = [job['done'] - job['arrive'] for job in finished if job['kind'] == kind]
+        if values:
+            print(f"{kind:<12} {len(values):5d} {percentile(values, 0.5):9.2f}s")
+    cached = sum(1 for job in finished if 'cached' in job)
+    print(f"\nResult cache hits: {cached} | progress edits: {metrics.edits} | FloodWaits raised: {metrics.flood_waits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for googlepro3 with a fake Telegram client.")
+    parser.add_argument("--jobs", type=int, default=10, help="number of incoming videos")
+    parser.add_argument("--rate", type=float, default=1.0, help="mean arrivals per second (Poisson)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("auto=0.5,manual=0.3,target=0.1,duplicate=0.1"),
+                        help="traffic mix, e.g. auto=0.5,manual=0.3,target=0.1,duplicate=0.1")
+    parser.add_argument("--clip-seconds", default="10,30", help="comma-separated durations of generated clips")
+    parser.add_argument("--size", default="640x360", help="resolution of generated clips")
+    parser.add_argument("--encoder", default="libx264")
+    parser.add_argument("--crf", type=int, default=28)
+    parser.add_argument("--target-mb", type=float, default=2.0, help="target size for 'target' jobs")
+    parser.add_argument("--think", type=float, default=1.0, help="seconds before a user presses a quality button")
+    parser.add_argument("--down-mbps", type=float, default=20.0, help="simulated download MB/s per transfer")
+    parser.add_argument("--up-mbps", type=float, default=10.0, help="simulated upload MB/s per transfer")
+    parser.add_argument("--edit-interval", type=float, default=1.0, help="min seconds between edits per chat before FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=3, help="FloodWait duration returned by the fake client")
+    parser.add_argument("--handler-workers", type=int, default=8, help="size of the fake client's handler executor")
+    parser.add_argument("--streaming", action="store_true", help="enable STREAMING_COMPRESSION for auto jobs")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+قياس زمن تشغيل FFmpeg: أمر نصي عبر shell=True مقابل قائمة وسائط (argv) مباشرة.
+الاستخدام: python benchmarks/spawn_latency.py [عدد التكرارات]
+"""
+import os
+import sys
+import time
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import run_ffprobe
+
+
+def measure(label, fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<22} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+    return statistics.median(samples)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    args = ["ffmpeg", "-hide_banner", "-version"]
+    command = 'ffmpeg -hide_banner -version'
+
+    shell = measure("shell=True (string)", lambda: subprocess.run(command, shell=True, capture_output=True, text=True), runs)
+    argv = measure("argv (run_ffprobe)", lambda: run_ffprobe(args), runs)
+    print(f"\nSpawn latency saved per invocation: {shell - argv:.2f} ms ({(1 - argv / shell) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
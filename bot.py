@@ -1,23 +1,26 @@
 import os
 import tempfile
-import subprocess
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor # لاستخدام التحميل والضغط المتوازيين
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import MessageEmpty, UserNotParticipant # لاستثناءات Pyrogram
 
 # استيراد المتغيرات من ملف config.py
 from config import *
+from engine import (
+    CompressionJob, ChannelDocumentSink, FFmpegError, CompressionScheduler, WorkerPool, compress,
+    DownloadRegistry, estimate_download_work,
+    LoopTimer, run_when_done, start_metrics_server,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
-download_executor = ThreadPoolExecutor(max_workers=5) 
-compression_executor = ThreadPoolExecutor(max_workers=3) 
+download_executor = WorkerPool('download', 5, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
 
 # --- [إضافة جديدة] --- قاموس لتخزين إعدادات كل مستخدم ---
 # user_settings = { user_id: {'encoder': ..., 'auto_compress': ..., 'auto_quality': ...} }
@@ -40,6 +43,13 @@ def get_user_settings(user_id):
 # -----------------------------------------------------------
 
 
+# مستويات الجودة المعروضة في الأزرار: (قيمة CRF/CQ، الإعداد المسبق) لكل نوع مرمز
+QUALITY_PRESETS = {
+    "crf_27": {'nvenc': (37, "fast"), 'cpu': (27, "veryfast")},
+    "crf_23": {'nvenc': (23, "medium"), 'cpu': (23, "medium")},
+    "crf_18": {'nvenc': (18, "slow"), 'cpu': (18, "slow")},
+}
+
 # -------------------------- وظائف المساعدة --------------------------
 
 def progress(current, total, message_type="Generic"):
@@ -123,74 +133,44 @@ def process_video_for_compression(video_data):
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
 
-        # --- [تعديل] --- إعداد أمر FFmpeg باستخدام الترميز المختار ---
-        ffmpeg_command = ""
-        # بناء الجزء المشترك من الأمر
-        common_ffmpeg_part = (
-            f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} '
-            f'-c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} '
-            f'-ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -profile:v high -map_metadata -1'
-        )
-        
+        # --- [تعديل] --- إعداد مهمة الضغط باستخدام الترميز المختار ---
         # إضافة إعدادات الجودة بناءً على الترميز
-        if quality == "crf_27":
-            quality_settings = "-cq 37 -preset fast" if "nvenc" in encoder else "-crf 27 -preset veryfast"
-        elif quality == "crf_23":
-            quality_settings = "-cq 23 -preset medium" if "nvenc" in encoder else "-crf 23 -preset medium"
-        elif quality == "crf_18":
-            quality_settings = "-cq 18 -preset slow" if "nvenc" in encoder else "-crf 18 -preset slow"
-        else:
+        if quality not in QUALITY_PRESETS:
             print(f"[{thread_name}] Internal error: Invalid compression quality '{quality}'.")
             message.reply_text("حدث خطأ داخلي: جودة ضغط غير صالحة.", quote=True)
             return
-
-        ffmpeg_command = f'{common_ffmpeg_part} {quality_settings} "{temp_compressed_filename}"'
-
-        print(f"[{thread_name}][FFmpeg] Executing command for '{os.path.basename(file_path)}':\n{ffmpeg_command}")
-        process = subprocess.run(ffmpeg_command, shell=True, check=True, capture_output=True, text=True, encoding='utf-8')
-        print(f"[{thread_name}][FFmpeg] Command executed successfully for '{os.path.basename(file_path)}'.")
-        if process.stdout:
-            print(f"[{thread_name}][FFmpeg] Stdout for '{os.path.basename(file_path)}':\n{process.stdout.strip()}")
-        if process.stderr:
-            print(f"[{thread_name}][FFmpeg] Stderr for '{os.path.basename(file_path)}':\n{process.stderr.strip()}")
-
-        compressed_file_size_mb = 0
-        if os.path.exists(temp_compressed_filename):
-            compressed_file_size_bytes = os.path.getsize(temp_compressed_filename)
-            compressed_file_size_mb = compressed_file_size_bytes / (1024 * 1024)
-            print(f"[{thread_name}] Compressed file '{os.path.basename(temp_compressed_filename)}' size: {compressed_file_size_mb:.2f} MB")
-        else:
-            print(f"[{thread_name}] Error: Compressed file {temp_compressed_filename} not found after FFmpeg completion.")
-            message.reply_text("حدث خطأ أثناء ضغط الفيديو: لم يتم إنشاء الملف المضغوط بنجاح.")
-            return
+        quality_value, preset = QUALITY_PRESETS[quality]['nvenc' if "nvenc" in encoder else 'cpu']
+
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            quality_value=quality_value,
+            preset=preset,
+            profile="high"
+        )
 
         # ------------------- رفع الفيديو الأصلي والمضغوط إلى القناة معاً -------------------
+        quality_text = quality.replace('crf_', 'CRF ')
+        sink = None
         if CHANNEL_ID:
+            sink = ChannelDocumentSink(
+                app, CHANNEL_ID, message,
+                caption=lambda result: f"📦 الفيديو المضغوط (الجودة: {quality_text})\nالحجم: {result.output_size_mb:.2f} ميجابايت",
+                original_caption=" المضغوط اعلا ⬆️🔺🎞️ الفيديو الأصلي",
+                progress=lambda current, total: progress(current, total, f"ChannelUpload-MsgID:{message.id}")
+            )
+
+        result = compress(job)
+        compressed_file_size_mb = result.output_size_mb
+        print(f"[{thread_name}] Compressed file '{os.path.basename(temp_compressed_filename)}' size: {compressed_file_size_mb:.2f} MB")
+
+        if sink:
             try:
-                sent_to_channel_message = app.send_document(
-                    chat_id=CHANNEL_ID,
-                    document=temp_compressed_filename,
-                    progress=lambda current, total: progress(current, total, f"ChannelUpload-MsgID:{message.id}"),
-                    caption=f"📦 الفيديو المضغوط (الجودة: {quality.replace('crf_', 'CRF ')})\nالحجم: {compressed_file_size_mb:.2f} ميجابايت"
-                )
-                print(f"[{thread_name}] Compressed video uploaded to channel: {CHANNEL_ID} for original message ID {message.id}.")
-        
-                try:
-                    app.copy_message(
-                        chat_id=CHANNEL_ID,
-                        from_chat_id=message.chat.id,
-                        message_id=message.id,
-                        caption=" المضغوط اعلا ⬆️🔺🎞️ الفيديو الأصلي"
-                    )
-                    print(f"[{thread_name}] Original video (ID: {message.id}) copied to channel: {CHANNEL_ID}.")
-                except (MessageEmpty, UserNotParticipant) as e:
-                    print(f"[{thread_name}] Warning: Could not copy original message {message.id} to channel {CHANNEL_ID} due to: {e}.")
-                except Exception as e:
-                    print(f"[{thread_name}] Error copying original video to channel: {e}")
-        
+                sink.deliver(result)
                 message.reply_text(
                     f"✅ تم ضغط الفيديو ورفعه بنجاح إلى القناة!\n"
-                    f"الجودة المختارة: **{quality.replace('crf_', 'CRF ')}**\n"
+                    f"الجودة المختارة: **{quality_text}**\n"
                     f"الحجم الجديد: **{compressed_file_size_mb:.2f} ميجابايت**",
                     quote=True
                 )
@@ -205,14 +185,16 @@ def process_video_for_compression(video_data):
                 quote=True
             )
 
-    except subprocess.CalledProcessError as e:
+    except FFmpegError as e:
         print(f"[{thread_name}][FFmpeg] error occurred for '{os.path.basename(file_path)}'!")
-        print(f"[{thread_name}][FFmpeg] stdout: {e.stdout}")
-        print(f"[{thread_name}][FFmpeg] stderr: {e.stderr}")
-        user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr.strip() if e.stderr else 'غير معروف'}`"
+        print(f"[{thread_name}][FFmpeg] stderr: {e.stderr_tail}")
+        user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr_tail.strip() if e.stderr_tail else 'غير معروف'}`"
         if len(user_error_message) > 500:
             user_error_message = user_error_message[:497] + "..."
         message.reply_text(user_error_message, quote=True)
+    except FileNotFoundError as e:
+        print(f"[{thread_name}] Error: {e}")
+        message.reply_text("حدث خطأ أثناء ضغط الفيديو: لم يتم إنشاء الملف المضغوط بنجاح.")
     except Exception as e:
         print(f"[{thread_name}] General error during video processing for '{os.path.basename(file_path)}': {e}")
         message.reply_text(f"حدث خطأ غير متوقع أثناء معالجة الفيديو: `{e}`", quote=True)
@@ -255,13 +237,16 @@ def process_video_for_compression(video_data):
             except Exception as e:
                 print(f"[{thread_name}] Error re-displaying quality options: {e}")
         else: # في حالة الضغط التلقائي، لا توجد رسالة أزرار لتحديثها، فقط نحذف الملف الأصلي
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"[{thread_name}] Deleted original file after auto-compression: {file_path}")
+            download_registry.release_source(video_data)
+            print(f"[{thread_name}] Released original file after auto-compression: {file_path}")
             if video_data['message'].id in user_video_data:
                  del user_video_data[video_data['message'].id]
 
 
+# إرسال المهمة لمجمع مرمز المستخدم وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها
+enqueue_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
 def auto_select_medium_quality(button_message_id):
     thread_name = threading.current_thread().name
     print(f"\n[{thread_name}] Auto-select triggered for Button ID: {button_message_id}.")
@@ -279,7 +264,7 @@ def auto_select_medium_quality(button_message_id):
             except Exception as e:
                 print(f"[{thread_name}] Error updating message reply markup after auto-select: {e}")
             print(f"[{thread_name}][Auto-Select] Submitting auto-selected video (ID: {button_message_id}) to compression_executor.")
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
         else:
             print(f"[{thread_name}][Auto-Select] Processing already started for message ID: {button_message_id}. Skipping auto-selection.")
 
@@ -362,12 +347,13 @@ def handle_incoming_video(client, message):
     file_name_prefix = os.path.join(DOWNLOADS_DIR, f"{message.from_user.id}_{message.id}_{int(time.time())}")
     
     print(f"[{thread_name}] Submitting download for Message ID: {message.id} to download_executor.")
-    download_future = download_executor.submit(
-        client.download_media,
-        file_id,
-        file_name=file_name_prefix, 
-        progress=lambda current, total: progress(current, total, f"Download-MsgID:{message.id}") 
-    )
+    download_future, _ = download_registry.download(message, lambda: download_executor.submit(
+            client.download_media,
+            file_id,
+            file_name=file_name_prefix, 
+            progress=lambda current, total: progress(current, total, f"Download-MsgID:{message.id}"),
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+    ))
     print(f"[{thread_name}] Download submission for Message ID: {message.id} completed. Bot is ready for next incoming message.")
 
     # تخزين البيانات الأولية للفيديو مع هوية المستخدم
@@ -382,7 +368,7 @@ def handle_incoming_video(client, message):
         'user_id': message.from_user.id # --- [إضافة جديدة] --- تخزين هوية المستخدم
     }
     
-    threading.Thread(target=post_download_actions, args=[message.id], name=f"PostDownloadThread-{message.id}").start()
+    run_when_done(app, download_future, post_download_actions, message.id)
 
 def post_download_actions(original_message_id):
     """
@@ -419,7 +405,7 @@ def post_download_actions(original_message_id):
             )
             # يمكن لاحقاً حذف هذه الرسالة بعد انتهاء الضغط if needed
             
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
             print(f"[{thread_name}] Auto-compression task submitted for user {user_id}.")
             # لا حاجة لتغيير مفتاح القاموس هنا لأننا لا نستخدم رسالة أزرار
         
@@ -446,9 +432,8 @@ def post_download_actions(original_message_id):
             video_data['button_message_id'] = reply_message.id
             user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
 
-            timer = threading.Timer(300, auto_select_medium_quality, args=[reply_message.id])
+            timer = LoopTimer(app, 300, auto_select_medium_quality, args=[reply_message.id])
             user_video_data[reply_message.id]['timer'] = timer
-            timer.name = f"AutoSelectTimer-{reply_message.id}"
             timer.start()
 
         print(f"[{thread_name}] Post-download actions completed for Message ID: {original_message_id}.")
@@ -457,9 +442,7 @@ def post_download_actions(original_message_id):
         print(f"[{thread_name}] Error during post-download actions for original message ID {original_message_id}: {e}")
         message.reply_text(f"حدث خطأ أثناء تنزيل الفيديو الخاص بك: `{e}`")
         if original_message_id in user_video_data:
-            temp_file_path = user_video_data[original_message_id].get('file')
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+            download_registry.release_source(user_video_data[original_message_id])
             del user_video_data[original_message_id]
 
 
@@ -547,12 +530,11 @@ def universal_callback_handler(client, callback_query):
     if data in ["cancel_compression", "finish_process"]:
         callback_query.answer("🚫 يتم إنهاء العملية...", show_alert=False)
         file_path = video_data.get('file')
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                print(f"[{thread_name}] Deleted file during finish/cancel: {file_path}")
-            except Exception as e:
-                print(f"[{thread_name}] Error deleting file during finish/cancel: {e}")
+        try:
+            download_registry.release_source(video_data)
+            print(f"[{thread_name}] Released file during finish/cancel: {file_path}")
+        except Exception as e:
+            print(f"[{thread_name}] Error deleting file during finish/cancel: {e}")
         try:
             message.delete()
             video_data['message'].reply_text("✅ تم إنهاء العملية وحذف الملف المؤقت.", quote=True)
@@ -591,7 +573,7 @@ def universal_callback_handler(client, callback_query):
         print(f"[{thread_name}] Error editing message reply markup for message ID {button_message_id}: {e}")
 
     print(f"[{thread_name}] Submitting compression for Message ID: {video_data['message'].id} (Button ID: {button_message_id}) to compression_executor.")
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
     print(f"[{thread_name}] Compression submission completed for Button ID: {button_message_id}.")
 
 # -------------------------- وظائف التشغيل والإدارة --------------------------
@@ -611,5 +593,6 @@ def check_channel_on_start():
 
 threading.Thread(target=check_channel_on_start, daemon=True, name="ChannelCheckThread").start()
 
+start_metrics_server(METRICS_PORT)
 print("🚀 البوت بدأ العمل! بانتظار الفيديوهات...")
 app.run()
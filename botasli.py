@@ -1,23 +1,28 @@
 import os
 import tempfile
-import subprocess
 import threading
 import time
-import re
-from concurrent.futures import ThreadPoolExecutor
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import MessageEmpty, UserNotParticipant
+from pyrogram.errors import MessageEmpty
 
 from config import *
+from engine import (
+    CompressionJob, ReplyDocumentSink, FFmpegError, compress, plan_segments, CompressionScheduler,
+    WorkerPool, DownloadRegistry, estimate_download_work,
+    ProgressDispatcher, get_telegram_duration, get_video_duration, predict_crf, clear_curve_cache,
+    LoopTimer, run_when_done, start_metrics_server,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
-download_executor = ThreadPoolExecutor(max_workers=5)
-compression_executor = ThreadPoolExecutor(max_workers=3)
+download_executor = WorkerPool('download', 5, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
+progress_dispatcher = ProgressDispatcher()  # كل تعديلات رسائل التقدم تمر عبره (دمج وحد للمعدل وFloodWait)
 
 # قاموس لتخزين "الحالة" الحالية للمستخدم
 user_states = {}
@@ -49,14 +54,23 @@ def cleanup_downloads():
             print(f"Error deleting file {file_path}: {e}")
     print("Downloads directory cleaned.")
 
-def estimate_crf_for_target_size(file_path, target_size_mb, initial_crf=23):
+def estimate_crf_for_target_size(file_path, target_size_mb, encoder, duration, initial_crf=23):
     """
     تقدير قيمة CRF للوصول إلى حجم معين.
-    كلما زادت قيمة CRF، قل الحجم وزاد الضغط (قلت الجودة).
-    كلما قلت قيمة CRF، زاد الحجم وقل الضغط (زادت الجودة).
+    نعتمد على ترميز عينات قصيرة من الملف بعدة قيم CRF ومطابقة منحنى الحجم (محفوظ لكل ملف)،
+    ونرجع للتقدير التقريبي بنسبة الحجم فقط إذا تعذر أخذ العينات.
     """
     original_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-    
+    print(f"  Original size: {original_size_mb:.2f} MB")
+    print(f"  Target size: {target_size_mb:.2f} MB")
+
+    try:
+        estimated_crf = predict_crf(file_path, target_size_mb, encoder, duration, VIDEO_AUDIO_BITRATE)
+        print(f"  Predicted CRF (sampled): {estimated_crf}")
+        return estimated_crf
+    except Exception as e:
+        print(f"  CRF prediction failed ({e}), falling back to size ratio.")
+
     # حساب النسبة بين الحجم المستهدف والأصلي
     ratio = target_size_mb / original_size_mb
     
@@ -71,8 +85,6 @@ def estimate_crf_for_target_size(file_path, target_size_mb, initial_crf=23):
         crf_decrease = int((ratio - 1) * 10)  # تقليل يصل إلى 10
         estimated_crf = max(0, initial_crf - crf_decrease)
     
-    print(f"  Original size: {original_size_mb:.2f} MB")
-    print(f"  Target size: {target_size_mb:.2f} MB")
     print(f"  Ratio: {ratio:.3f}")
     print(f"  Estimated CRF: {estimated_crf}")
     
@@ -107,7 +119,7 @@ def process_video_for_compression(video_data):
     # تحديد رسالة "جاري الضغط تلقائيًا" لحذفها لاحقًا
     auto_compress_status_message_id = video_data.get('auto_compress_status_message_id')
 
-    if button_message_id and button_message_id in user_video_
+    if button_message_id and button_message_id in user_video_data:
         user_video_data[button_message_id]['processing_started'] = True
         try:
             # تحديث الرسالة بناءً على نوع الضغط
@@ -135,16 +147,17 @@ def process_video_for_compression(video_data):
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
 
-        common_ffmpeg_part = (
-            f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} '
-            f'-c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} '
-            f'-ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -map_metadata -1'
-        )
-        
+        total_duration_sec = get_telegram_duration(message)
+        if total_duration_sec <= 0:
+            total_duration_sec = get_video_duration(file_path)
+        if total_duration_sec <= 0:
+            print(f"[{thread_name}] Warning: Could not determine original video duration.")
+
         # تحديد القيمة بناءً على نوع الضغط
+        target_size_mb = None
         if isinstance(quality, dict) and 'target_size' in quality:
             target_size_mb = quality['target_size']
-            estimated_crf = estimate_crf_for_target_size(file_path, target_size_mb)
+            estimated_crf = estimate_crf_for_target_size(file_path, target_size_mb, encoder, total_duration_sec)
             print(f"[{thread_name}] Estimated CRF {estimated_crf} for target size {target_size_mb} MB")
             quality_value = estimated_crf
         else:
@@ -157,88 +170,38 @@ def process_video_for_compression(video_data):
             else:
                 message.reply_text("حدث خطأ داخلي: جودة ضغط غير صالحة.", quote=True)
                 return
-    
-        # الخطوة 2: تحديد الإعداد المسبق بناءً على القيمة الرقمية ونوع المرمز
-        preset = "fast" # قيمة افتراضية آمنة تعمل على الجميع
-        
-        if quality_value <= 18:
-            preset = "slow"
-        elif quality_value <= 23:
-            preset = "medium"
-        elif quality_value >= 27:
-            preset = "veryfast" if encoder == 'libx264' else "fast"
-        # القيم بين 24-26 ستستخدم الإعداد الافتراضي "fast"
-        # ========================================================
-        quality_param = "cq" if "nvenc" in encoder else "crf"
-        quality_settings = f'-{quality_param} {quality_value} -preset {preset}'
-        ffmpeg_command = f'{common_ffmpeg_part} {quality_settings} "{temp_compressed_filename}"'
-        
-        print(f"[{thread_name}][FFmpeg] Executing command for '{os.path.basename(file_path)}':\n{ffmpeg_command}")
-        
+
+        # الإعداد المسبق يُحدد داخل المحرك بناءً على القيمة الرقمية ونوع المرمز
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            quality_value=quality_value,
+            duration=total_duration_sec,
+            segments=plan_segments(total_duration_sec, encoder)
+        )
+
+        compression_executor.choose_preset(job, message)
+
         # إرسال رسالة تتبع التقدم
         progress_msg = message.reply_text("🔄 جاري ضغط الفيديو... [░░░░░░░░░░░░░░░░░░░░] 0.0%", quote=True)
-        
-        # --- تنفيذ FFmpeg وتحليل التقدم ---
-        try:
-            process = subprocess.Popen(
-                ffmpeg_command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1  # Buffer line by line
+
+        def encode_progress(event):
+            if not progress_dispatcher.due(message.chat.id, progress_msg.id):
+                return
+            speed_text = f" | ⚡ {event.speed:.2f}x" if event.speed > 0 else ""
+            progress_dispatcher.push(
+                app, message.chat.id, progress_msg.id,
+                f"🔄 جاري ضغط الفيديو... {create_progress_bar(event.percent)}{speed_text}"
             )
 
-            # Get original duration from input
-            duration_match = re.search(r'Duration: (\d{2}):(\d{2}):(\d{2}\.\d{2})', subprocess.check_output(f'ffprobe -v quiet -show_format -show_streams "{file_path}"', shell=True, text=True))
-            if duration_match:
-                h, m, s = map(float, duration_match.groups())
-                total_duration_sec = h * 3600 + m * 60 + s
-            else:
-                total_duration_sec = 0
-                print(f"[{thread_name}] Warning: Could not determine original video duration.")
-
-            last_time = 0
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    # Look for time= in the output
-                    time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}\.\d{2})', output)
-                    if time_match:
-                        h, m, s = map(float, time_match.groups())
-                        current_time_sec = h * 3600 + m * 60 + s
-                        if total_duration_sec > 0:
-                            percentage = min(100.0, (current_time_sec / total_duration_sec) * 100)
-                        else:
-                            # Fallback if duration is unknown
-                            percentage = 0.0
-                        
-                        # Update progress message
-                        progress_bar_str = create_progress_bar(percentage)
-                        try:
-                            app.edit_message_text(
-                                chat_id=message.chat.id,
-                                message_id=progress_msg.id,
-                                text=f"🔄 جاري ضغط الفيديو... {progress_bar_str}"
-                            )
-                        except:
-                            pass # Ignore errors if message is deleted
-                        
-                        last_time = current_time_sec
-
-            rc = process.poll()
-            if rc != 0:
-                # Read remaining stderr for error details
-                stderr_output = process.stderr.read()
-                raise subprocess.CalledProcessError(rc, ffmpeg_command, stderr=stderr_output)
-
-        except subprocess.CalledProcessError as e:
+        # --- تنفيذ FFmpeg وتحليل التقدم ---
+        try:
+            result = compress(job, encode_progress)
+        except FFmpegError as e:
             print(f"[{thread_name}][FFmpeg] error occurred for '{os.path.basename(file_path)}'!")
-            print(f"[{thread_name}][FFmpeg] stdout: {e.stdout}")
-            print(f"[{thread_name}][FFmpeg] stderr: {e.stderr}")
-            user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr.strip() if e.stderr else 'غير معروف'}`"
+            print(f"[{thread_name}][FFmpeg] stderr: {e.stderr_tail}")
+            user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr_tail.strip() if e.stderr_tail else 'غير معروف'}`"
             message.reply_text(user_error_message[:4000], quote=True)
             return # Exit after handling error
         except Exception as e:
@@ -247,12 +210,13 @@ def process_video_for_compression(video_data):
             return # Exit after handling error
 
         # حذف رسالة التقدم بعد الانتهاء
+        progress_dispatcher.forget(message.chat.id, progress_msg.id)
         try:
             progress_msg.delete()
         except:
             pass
 
-        compressed_file_size_mb = os.path.getsize(temp_compressed_filename) / (1024 * 1024)
+        compressed_file_size_mb = result.output_size_mb
         print(f"[{thread_name}] Compressed file '{os.path.basename(temp_compressed_filename)}' size: {compressed_file_size_mb:.2f} MB")
 
         # إرسال الملف المضغوط إلى الدردشة نفسها
@@ -262,25 +226,20 @@ def process_video_for_compression(video_data):
             
             # دالة تقدم الرفع
             def upload_progress(current, total):
-                if total > 0:
-                    percent = (current / total) * 100
-                    bar = create_progress_bar(percent)
-                    try:
-                        app.edit_message_text(
-                            chat_id=message.chat.id,
-                            message_id=upload_progress_msg.id,
-                            text=f"📤 جاري رفع الفيديو المضغوط... {bar}"
-                        )
-                    except:
-                        pass # لا تفعل شيئاً إذا فشل التحديث (مثلاً إذا حذفت الرسالة)
-            
-            message.reply_document(
-                document=temp_compressed_filename,
-                progress=upload_progress, # استخدام دالة التقدم
-                caption=f"📦 الفيديو المضغوط (الهدف: {target_size_mb} ميجابايت)\nالحجم الأصلي: {os.path.getsize(file_path) / (1024 * 1024):.2f} ميجابايت\nالحجم الجديد: {compressed_file_size_mb:.2f} ميجابايت ({((compressed_file_size_mb - target_size_mb) / target_size_mb) * 100:+.1f}% من الهدف)\nالجودة المستخدمة: CRF {quality_value}"
-            )
+                if total > 0 and progress_dispatcher.due(message.chat.id, upload_progress_msg.id):
+                    bar = create_progress_bar((current / total) * 100)
+                    progress_dispatcher.push(
+                        app, message.chat.id, upload_progress_msg.id, f"📤 جاري رفع الفيديو المضغوط... {bar}"
+                    )
+
+            if target_size_mb:
+                caption = f"📦 الفيديو المضغوط (الهدف: {target_size_mb} ميجابايت)\nالحجم الأصلي: {result.input_size_mb:.2f} ميجابايت\nالحجم الجديد: {compressed_file_size_mb:.2f} ميجابايت ({((compressed_file_size_mb - target_size_mb) / target_size_mb) * 100:+.1f}% من الهدف)\nالجودة المستخدمة: CRF {quality_value}"
+            else:
+                caption = f"📦 الفيديو المضغوط\nالحجم الأصلي: {result.input_size_mb:.2f} ميجابايت\nالحجم الجديد: {compressed_file_size_mb:.2f} ميجابايت\nالجودة المستخدمة: CRF {quality_value}"
+            ReplyDocumentSink(message, caption, progress=upload_progress).deliver(result)
             
             # حذف رسالة تقدم الرفع بعد الانتهاء
+            progress_dispatcher.forget(message.chat.id, upload_progress_msg.id)
             try:
                 upload_progress_msg.delete()
             except:
@@ -314,7 +273,7 @@ def process_video_for_compression(video_data):
                 print(f"[{thread_name}] Error deleting auto-compress status message {auto_compress_status_message_id}: {e}")
 
         # باقي الكود يجب أن يكون متقدماً بمستوى واحد داخل `finally`
-        if button_message_id and button_message_id in user_video_
+        if button_message_id and button_message_id in user_video_data:
             user_video_data[button_message_id]['processing_started'] = False
             user_video_data[button_message_id]['quality'] = None
             try:
@@ -335,20 +294,26 @@ def process_video_for_compression(video_data):
             except Exception as e:
                 print(f"[{thread_name}] Error re-displaying quality options: {e}")
         else: # هذه الحالة تحدث عادة للضغط التلقائي
-            if os.path.exists(file_path): os.remove(file_path)
+            download_registry.release_source(video_data)
+            clear_curve_cache(file_path)
             # هذه هي النقطة التي تحتاج إلى ضبط منطق الحذف فيها
             # إذا لم يكن هناك button_message_id (كما في حالة الضغط التلقائي)، نستخدم original_message_id
             # ويجب التأكد أن المفتاح لا يزال موجوداً في القاموس قبل حذفه
-            if button_message_id and button_message_id in user_video_
+            if button_message_id and button_message_id in user_video_data:
                 del user_video_data[button_message_id]
             # في حالة الضغط التلقائي، قد لا يكون هناك button_message_id. نعتمد على original_message_id.
-            elif video_data['message'].id in user_video_ # نستخدم المفتاح الأصلي للفيديو هنا
+            elif video_data['message'].id in user_video_data: # نستخدم المفتاح الأصلي للفيديو هنا
                 del user_video_data[video_data['message'].id]
                 
+
+# إرسال المهمة لمجمع مرمز المستخدم وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها
+enqueue_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
 def auto_select_medium_quality(button_message_id):
     thread_name = threading.current_thread().name
     print(f"\n[{thread_name}] Auto-select triggered for Button ID: {button_message_id}.")
-    if button_message_id in user_video_
+    if button_message_id in user_video_data:
         video_data = user_video_data[button_message_id]
         if not video_data.get('processing_started'):
             video_data['quality'] = "crf_23"
@@ -357,7 +322,7 @@ def auto_select_medium_quality(button_message_id):
                     chat_id=video_data['message'].chat.id, message_id=button_message_id,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ تم اختيار جودة متوسطة تلقائيًا", callback_data="none")]]))
             except Exception: pass
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
 
 # -------------------------- معالجات رسائل تيليجرام --------------------------
 @app.on_message(filters.command("start"))
@@ -407,7 +372,7 @@ def handle_text_input(client, message):
             if size <= 0:
                 raise ValueError("Size must be positive")
                 
-            if button_message_id and button_message_id in user_video_
+            if button_message_id and button_message_id in user_video_data:
                 video_data = user_video_data[button_message_id]
                 if not video_data.get('processing_started') and video_data.get('file'):
                     video_data['quality'] = {"target_size": size}
@@ -419,7 +384,7 @@ def handle_text_input(client, message):
                             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"🎯 تم تحديد الحجم ~{size} ميجابايت", callback_data="none")]]))
                     except Exception: pass
                     
-                    compression_executor.submit(process_video_for_compression, video_data)
+                    enqueue_compression(video_data)
                     del user_states[user_id]
                     message.reply_text(f"✅ بدأ الضغط للوصول لحجم ~{size} ميجابايت", quote=True)
                 else:
@@ -472,23 +437,19 @@ def handle_incoming_video(client, message):
             bar = create_progress_bar(percent)
             # لا يمكننا تحرير رسالة قيد الإنشاء، لذا نستخدم رسالة مؤقتة
             if hasattr(handle_incoming_video, '_dl_progress_msg'):
-                try:
-                    app.edit_message_text(
-                        chat_id=message.chat.id,
-                        message_id=handle_incoming_video._dl_progress_msg.id,
-                        text=f"📥 جاري تنزيل الفيديو... {bar}"
-                    )
-                except:
-                    pass # Ignore if message is deleted
+                msg_id = handle_incoming_video._dl_progress_msg.id
+                if progress_dispatcher.due(message.chat.id, msg_id, final=current >= total):
+                    progress_dispatcher.push(app, message.chat.id, msg_id, f"📥 جاري تنزيل الفيديو... {bar}")
 
     # إرسال رسالة تقدم التنزيل
     dl_progress_msg = message.reply_text("📥 جاري تنزيل الفيديو... [░░░░░░░░░░░░░░░░░░░░] 0.0%", quote=True)
     handle_incoming_video._dl_progress_msg = dl_progress_msg
 
-    download_future = download_executor.submit(
-        client.download_media, file_id, file_name=file_name_prefix,
-        progress=download_progress # استخدام دالة التقدم
-    )
+    download_future, _ = download_registry.download(message, lambda: download_executor.submit(
+            client.download_media, file_id, file_name=file_name_prefix,
+            progress=download_progress, # استخدام دالة التقدم
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+    ))
 
     user_video_data[message.id] = {
         'message': message,
@@ -501,12 +462,12 @@ def handle_incoming_video(client, message):
         'user_id': message.from_user.id,
         'auto_compress_status_message_id': None
     }    
-    threading.Thread(target=post_download_actions, args=[message.id], name=f"PostDownloadThread-{message.id}").start()
+    run_when_done(app, download_future, post_download_actions, message.id)
 
 def post_download_actions(original_message_id):
     thread_name = threading.current_thread().name
     print(f"\n[{thread_name}] Starting post-download actions for original message ID: {original_message_id}")
-    if original_message_id not in user_video_ return
+    if original_message_id not in user_video_data: return
 
     video_data = user_video_data[original_message_id]
     message = video_data['message']
@@ -518,8 +479,10 @@ def post_download_actions(original_message_id):
         print(f"[{thread_name}] Download complete for original message ID {original_message_id}.")
         
         # حذف رسالة تقدم التنزيل
+        dl_msg = handle_incoming_video._dl_progress_msg
+        progress_dispatcher.forget(dl_msg.chat.id, dl_msg.id)
         try:
-            handle_incoming_video._dl_progress_msg.delete()
+            dl_msg.delete()
         except:
             pass # إذا لم توجد الرسالة أو تم حذفها مسبقًا
 
@@ -529,7 +492,7 @@ def post_download_actions(original_message_id):
             # هنا نقوم بتخزين ID الرسالة التي سنرسلها <--- التعديل هنا
             status_msg = message.reply_text(f"✅ تم التنزيل. جاري الضغط تلقائيًا بالجودة المحددة: **CRF {video_data['quality']}**", quote=True)
             video_data['auto_compress_status_message_id'] = status_msg.id # <--- هذا هو التعديل
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
             
         else:
             markup = InlineKeyboardMarkup([
@@ -542,13 +505,14 @@ def post_download_actions(original_message_id):
             reply_message = message.reply_text("✅ تم تنزيل الفيديو.\nاختر جودة الضغط، أو سيتم اختيار جودة متوسطة بعد **300 ثانية**:", reply_markup=markup, quote=True)
             video_data['button_message_id'] = reply_message.id
             user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
-            timer = threading.Timer(300, auto_select_medium_quality, args=[reply_message.id])
+            timer = LoopTimer(app, 300, auto_select_medium_quality, args=[reply_message.id])
             user_video_data[reply_message.id]['timer'] = timer
             timer.start()
     except Exception as e:
         print(f"[{thread_name}] Error during post-download actions for original_message_id {original_message_id}: {e}")
         message.reply_text(f"حدث خطأ أثناء تنزيل الفيديو: `{e}`")
-        if original_message_id in user_video_ del user_video_data[original_message_id]
+        download_registry.release_source(video_data)
+        if original_message_id in user_video_data: del user_video_data[original_message_id]
 
 @app.on_callback_query()
 def universal_callback_handler(client, callback_query):
@@ -593,7 +557,7 @@ def universal_callback_handler(client, callback_query):
         return
         
     button_message_id = message.id
-    if button_message_id not in user_video_
+    if button_message_id not in user_video_data:
         callback_query.answer("انتهت صلاحية هذا الطلب.", show_alert=True)
         try: message.delete()
         except: pass
@@ -606,12 +570,13 @@ def universal_callback_handler(client, callback_query):
     if data in ["cancel_compression", "finish_process"]:
         if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
         file_path = video_data.get('file')
-        if file_path and os.path.exists(file_path): os.remove(file_path)
+        download_registry.release_source(video_data)
+        if file_path: clear_curve_cache(file_path)
         try:
             message.delete()
             video_data['message'].reply_text("✅ تم إنهاء العملية وحذف الملف المؤقت.", quote=True)
         except Exception: pass
-        if button_message_id in user_video_ del user_video_data[button_message_id]
+        if button_message_id in user_video_data: del user_video_data[button_message_id]
         return
 
     if data == "target_size_prompt":
@@ -643,9 +608,10 @@ def universal_callback_handler(client, callback_query):
         app.edit_message_reply_markup(chat_id=message.chat.id, message_id=button_message_id,
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"⏳ جاري الضغط... (CRF {quality_display_value})", callback_data="none")]]))
     except Exception: pass
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
 
 # -------------------------- وظائف التشغيل والإدارة --------------------------
 cleanup_downloads()
+start_metrics_server(METRICS_PORT)
 print("🚀 البوت بدأ العمل! بانتظار الفيديوهات...")
 app.run()
@@ -1,22 +1,26 @@
 import os
 import tempfile
-import subprocess
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import MessageEmpty, UserNotParticipant
+from pyrogram.errors import MessageEmpty
 
 from config import *
+from engine import (
+    CompressionJob, ChannelDocumentSink, FFmpegError, CompressionScheduler, WorkerPool, compress,
+    DownloadRegistry, estimate_download_work,
+    LoopTimer, run_when_done, start_metrics_server,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
-download_executor = ThreadPoolExecutor(max_workers=5)
-compression_executor = ThreadPoolExecutor(max_workers=3)
+download_executor = WorkerPool('download', 5, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
 
 # قاموس لتخزين "الحالة" الحالية للمستخدم
 user_states = {}
@@ -103,14 +107,6 @@ def process_video_for_compression(video_data):
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
 
-        common_ffmpeg_part = (
-            f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} '
-            f'-c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} '
-            f'-ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -profile:v high -map_metadata -1'
-        )
-        # ===== هذا هو التعديل المنطقي المطلوب (منطق موحد) =====
-        quality_value = 0
-        
         # الخطوة 1: الحصول على القيمة الرقمية للجودة
         if isinstance(quality, str) and 'crf_' in quality:
             quality_value = int(quality.split('_')[1])
@@ -119,41 +115,28 @@ def process_video_for_compression(video_data):
         else:
             message.reply_text("حدث خطأ داخلي: جودة ضغط غير صالحة.", quote=True)
             return
-    
-        # الخطوة 2: تحديد الإعداد المسبق بناءً على القيمة الرقمية ونوع المرمز
-        preset = "fast" # قيمة افتراضية آمنة تعمل على الجميع
-        
-        if quality_value <= 18:
-            preset = "slow"
-        elif quality_value <= 23:
-            preset = "medium"
-        elif quality_value >= 27:
-            preset = "veryfast" if encoder == 'libx264' else "fast"
-        # القيم بين 24-26 ستستخدم الإعداد الافتراضي "fast"
-        # ========================================================
-        quality_param = "cq" if "nvenc" in encoder else "crf"
-        quality_settings = f'-{quality_param} {quality_value} -preset {preset}'
-        ffmpeg_command = f'{common_ffmpeg_part} {quality_settings} "{temp_compressed_filename}"'
-        
-        print(f"[{thread_name}][FFmpeg] Executing command for '{os.path.basename(file_path)}':\n{ffmpeg_command}")
-        process = subprocess.run(ffmpeg_command, shell=True, check=True, capture_output=True, text=True, encoding='utf-8')
-        if process.stdout: print(f"[{thread_name}][FFmpeg] Stdout for '{os.path.basename(file_path)}':\n{process.stdout.strip()}")
-        if process.stderr: print(f"[{thread_name}][FFmpeg] Stderr for '{os.path.basename(file_path)}':\n{process.stderr.strip()}")
 
-        compressed_file_size_mb = os.path.getsize(temp_compressed_filename) / (1024 * 1024)
+        # الخطوة 2: الإعداد المسبق يُختار من جدول القياس حسب حالة الطابور، أو من سلم الجودة ونوع المرمز
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            quality_value=quality_value,
+            profile="high"
+        )
+        compression_executor.choose_preset(job, message)
+        result = compress(job)
+        compressed_file_size_mb = result.output_size_mb
         print(f"[{thread_name}] Compressed file '{os.path.basename(temp_compressed_filename)}' size: {compressed_file_size_mb:.2f} MB")
 
         if CHANNEL_ID:
             try:
-                app.send_document(
-                    chat_id=CHANNEL_ID, document=temp_compressed_filename,
-                    progress=lambda c, t: progress(c, t, f"ChannelUpload-MsgID:{message.id}"),
-                    caption=f"📦 الفيديو المضغوط (الجودة: CRF {quality_value})\nالحجم: {compressed_file_size_mb:.2f} ميجابايت"
-                )
-                app.copy_message(
-                    chat_id=CHANNEL_ID, from_chat_id=message.chat.id, message_id=message.id,
-                    caption=" المضغوط  ⬆️🔺🎞️ الفيديو الأصلي"
-                )
+                ChannelDocumentSink(
+                    app, CHANNEL_ID, message,
+                    caption=f"📦 الفيديو المضغوط (الجودة: CRF {quality_value})\nالحجم: {compressed_file_size_mb:.2f} ميجابايت",
+                    original_caption=" المضغوط  ⬆️🔺🎞️ الفيديو الأصلي",
+                    progress=lambda c, t: progress(c, t, f"ChannelUpload-MsgID:{message.id}")
+                ).deliver(result)
                 message.reply_text(
                     f"✅ تم ضغط الفيديو ورفعه بنجاح!\n"
                     f"الجودة المختارة: **CRF {quality_value}**\n"
@@ -164,11 +147,10 @@ def process_video_for_compression(video_data):
         else:
             message.reply_text(f"✅ تم ضغط الفيديو بنجاح!\nالحجم: **{compressed_file_size_mb:.2f} ميجابايت**", quote=True)
 
-    except subprocess.CalledProcessError as e:
+    except FFmpegError as e:
         print(f"[{thread_name}][FFmpeg] error occurred for '{os.path.basename(file_path)}'!")
-        print(f"[{thread_name}][FFmpeg] stdout: {e.stdout}")
-        print(f"[{thread_name}][FFmpeg] stderr: {e.stderr}")
-        user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr.strip() if e.stderr else 'غير معروف'}`"
+        print(f"[{thread_name}][FFmpeg] stderr: {e.stderr_tail}")
+        user_error_message = f"حدث خطأ أثناء ضغط الفيديو:\n`{e.stderr_tail.strip() if e.stderr_tail else 'غير معروف'}`"
         message.reply_text(user_error_message[:4000], quote=True)
     except Exception as e:
         print(f"[{thread_name}] General error during video processing for '{os.path.basename(file_path)}': {e}")
@@ -209,7 +191,7 @@ def process_video_for_compression(video_data):
             except Exception as e:
                 print(f"[{thread_name}] Error re-displaying quality options: {e}")
         else: # هذه الحالة تحدث عادة للضغط التلقائي
-            if os.path.exists(file_path): os.remove(file_path)
+            download_registry.release_source(video_data)
             # هذه هي النقطة التي تحتاج إلى ضبط منطق الحذف فيها
             # إذا لم يكن هناك button_message_id (كما في حالة الضغط التلقائي)، نستخدم original_message_id
             # ويجب التأكد أن المفتاح لا يزال موجوداً في القاموس قبل حذفه
@@ -219,6 +201,11 @@ def process_video_for_compression(video_data):
             elif video_data['message'].id in user_video_data: # نستخدم المفتاح الأصلي للفيديو هنا
                 del user_video_data[video_data['message'].id]
                 
+
+# إرسال المهمة لمجمع مرمز المستخدم وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها
+enqueue_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
 def auto_select_medium_quality(button_message_id):
     thread_name = threading.current_thread().name
     print(f"\n[{thread_name}] Auto-select triggered for Button ID: {button_message_id}.")
@@ -231,7 +218,7 @@ def auto_select_medium_quality(button_message_id):
                     chat_id=video_data['message'].chat.id, message_id=button_message_id,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ تم اختيار جودة متوسطة تلقائيًا", callback_data="none")]]))
             except Exception: pass
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
 
 # -------------------------- معالجات رسائل تيليجرام --------------------------
 @app.on_message(filters.command("start"))
@@ -299,10 +286,11 @@ def handle_incoming_video(client, message):
     file_id = message.video.file_id if message.video else message.animation.file_id
     file_name_prefix = os.path.join(DOWNLOADS_DIR, f"{message.from_user.id}_{message.id}_{int(time.time())}")
     
-    download_future = download_executor.submit(
-        client.download_media, file_id, file_name=file_name_prefix,
-        progress=lambda c, t: progress(c, t, f"Download-MsgID:{message.id}")
-    )
+    download_future, _ = download_registry.download(message, lambda: download_executor.submit(
+            client.download_media, file_id, file_name=file_name_prefix,
+            progress=lambda c, t: progress(c, t, f"Download-MsgID:{message.id}"),
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+    ))
 
     user_video_data[message.id] = {
         'message': message,
@@ -315,7 +303,7 @@ def handle_incoming_video(client, message):
         'user_id': message.from_user.id,
         'auto_compress_status_message_id': None # <--- هذا هو الإضافة الجديدة
     }    
-    threading.Thread(target=post_download_actions, args=[message.id], name=f"PostDownloadThread-{message.id}").start()
+    run_when_done(app, download_future, post_download_actions, message.id)
 
 def post_download_actions(original_message_id):
     thread_name = threading.current_thread().name
@@ -337,7 +325,7 @@ def post_download_actions(original_message_id):
             # هنا نقوم بتخزين ID الرسالة التي سنرسلها <--- التعديل هنا
             status_msg = message.reply_text(f"✅ تم التنزيل. جاري الضغط تلقائيًا بالجودة المحددة: **CRF {video_data['quality']}**", quote=True)
             video_data['auto_compress_status_message_id'] = status_msg.id # <--- هذا هو التعديل
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
             
         else:
             markup = InlineKeyboardMarkup([
@@ -349,12 +337,13 @@ def post_download_actions(original_message_id):
             reply_message = message.reply_text("✅ تم تنزيل الفيديو.\nاختر جودة الضغط، أو سيتم اختيار جودة متوسطة بعد **300 ثانية**:", reply_markup=markup, quote=True)
             video_data['button_message_id'] = reply_message.id
             user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
-            timer = threading.Timer(300, auto_select_medium_quality, args=[reply_message.id])
+            timer = LoopTimer(app, 300, auto_select_medium_quality, args=[reply_message.id])
             user_video_data[reply_message.id]['timer'] = timer
             timer.start()
     except Exception as e:
         print(f"[{thread_name}] Error during post-download actions for original message ID {original_message_id}: {e}")
         message.reply_text(f"حدث خطأ أثناء تنزيل الفيديو: `{e}`")
+        download_registry.release_source(video_data)
         if original_message_id in user_video_data: del user_video_data[original_message_id]
 
 @app.on_callback_query()
@@ -412,8 +401,7 @@ def universal_callback_handler(client, callback_query):
 
     if data in ["cancel_compression", "finish_process"]:
         if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
-        file_path = video_data.get('file')
-        if file_path and os.path.exists(file_path): os.remove(file_path)
+        download_registry.release_source(video_data)
         try:
             message.delete()
             video_data['message'].reply_text("✅ تم إنهاء العملية وحذف الملف المؤقت.", quote=True)
@@ -434,7 +422,7 @@ def universal_callback_handler(client, callback_query):
         app.edit_message_reply_markup(chat_id=message.chat.id, message_id=button_message_id,
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"⏳ جاري الضغط... (CRF {quality_display_value})", callback_data="none")]]))
     except Exception: pass
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
 
 # -------------------------- وظائف التشغيل والإدارة --------------------------
 cleanup_downloads()
@@ -454,5 +442,6 @@ def check_channel_on_start():
         print("⚠️ لم يتم تحديد CHANNEL_ID في ملف config.py. لن يتم رفع الفيديوهات إلى قناة.")
 threading.Thread(target=check_channel_on_start, daemon=True, name="ChannelCheckThread").start()
 
+start_metrics_server(METRICS_PORT)
 print("🚀 البوت بدأ العمل! بانتظار الفيديوهات...")
 app.run()
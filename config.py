@@ -2,7 +2,7 @@
 
 from os import getenv
 import os 
-API_ID = int(os.getenv("API_ID"))
+API_ID = int(os.getenv("API_ID") or 0)  # 0 إذا لم يُضبط، فيمكن استيراد المحرك والأدوات بدون بيانات البوت
 API_HASH = os.getenv("API_HASH")
 API_TOKEN = os.getenv("API_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")  # قم بتغيير هذا إلى معرف قناة Telegram الخاص بك
@@ -28,3 +28,45 @@ VIDEO_AUDIO_SAMPLE_RATE = 48000  # الحفاظ على معدل العينة ا
 # Temporary file settings
 TEMP_FILE_SUFFIX_AUDIO = ".mp3"  
 TEMP_FILE_SUFFIX_VIDEO = ".mp4"  
+# Target size settings
+TARGET_SIZE_TOLERANCE = 0.05  # نسبة الخطأ المقبولة بين الحجم الناتج والمستهدف (5%)
+TARGET_SIZE_MAX_RETRIES = 2  # أقصى عدد لإعادة الترميز إذا خرج الحجم عن النسبة المقبولة
+# Segment-parallel encoding settings
+SEGMENT_PARALLEL_MIN_DURATION = 600  # أقل مدة (بالثواني) لتقسيم الفيديو وترميز أجزائه بالتوازي
+SEGMENT_PARALLEL_MAX_CHUNKS = 4  # أقصى عدد أجزاء (يُحد أيضاً بعدد أنوية المعالج)
+# Compression scheduler settings
+CPU_ENCODER_MAX_JOBS = None  # أقصى عدد مهام ترميز بالمعالج بالتوازي (None = ربع عدد الأنوية)
+NVENC_MAX_SESSIONS = 3  # أقصى عدد جلسات NVENC بالتوازي (حد كرت الشاشة)
+CPU_LOAD_HIGH_WATERMARK = 1.0  # لا تبدأ مهمة معالج جديدة إذا تجاوز متوسط الحمل (عدد الأنوية × هذه القيمة)
+LOAD_RECHECK_SECONDS = 2.0  # فترة إعادة فحص الحمل للمهام المنتظرة
+USER_MAX_CONCURRENT_JOBS = 1  # أقصى عدد مهام ضغط تعمل بالتوازي لنفس المستخدم عند انتظار مستخدمين آخرين (بدونهم تُستخدم كل الخانات)
+SHORT_CLIP_PRIORITY_SECONDS = 60  # المقاطع الأقصر من هذه المدة تتقدم في الطابور (0 لتعطيل الأولوية)
+SCHEDULING_POLICY = "fair"  # "fair" = تناوب بين المستخدمين، "sjf" = المهمة الأقل عملاً مقدراً أولاً (مع تقادم)
+SJF_AGING_FACTOR = 1.0  # كل ثانية انتظار تخصم هذا القدر من العمل المقدر للمهمة (يمنع تجويع الملفات الطويلة)
+ENCODER_COST_FACTORS = {  # ثواني ترميز تقريبية لكل ثانية فيديو بدقة 1080p
+    "libx264": 0.6,
+    "libx265": 2.0,
+    "h264_nvenc": 0.1,
+    "hevc_nvenc": 0.12,
+}
+DOWNLOAD_BYTES_PER_SECOND = 5 * 1024 * 1024  # سرعة تنزيل تقديرية لحساب أولوية طابور التنزيل
+DOWNLOAD_USER_MAX_CONCURRENT = None  # أقصى عدد تنزيلات متوازية لنفس المستخدم (None = بلا حد، يبقى الترتيب بالتناوب)
+# Streaming settings
+STREAMING_COMPRESSION = True  # في الضغط التلقائي يبدأ الترميز أثناء التنزيل إذا سمحت بنية الملف ولم يكن التنزيل المقدر أبطأ من الترميز
+STREAMING_UPLOAD = True  # رفع الناتج أثناء الترميز (MP4 مجزأ) بدل انتظار انتهاء FFmpeg
+# Result cache settings
+RESULT_CACHE_MAX_ENTRIES = 1000  # أقصى عدد نتائج مضغوطة محفوظة (file_id) لإعادة إرسالها بدون ترميز (googlepro3 فقط)
+THUMBNAIL_CANDIDATES = 3  # عدد الصور المصغرة المرشحة في وضع الألبوم (تُستخرج أثناء نفس الترميز)
+# Telegram upload settings
+FLOOD_WAIT_MAX_RETRIES = 3  # عدد مرات إعادة الطلب بعد FloodWait قبل اعتباره فشلاً
+ALBUM_PREPARE_WORKERS = 4  # عدد الملفات التي تُجهز بياناتها (الأبعاد والصورة المصغرة) بالتوازي قبل رفع الألبوم
+ALBUM_STAGING_QUOTA_MB = 2000  # أقصى مساحة لملفات الألبوم المنتظرة لكل مستخدم قبل إرسالها
+PROGRESS_UPDATE_INTERVAL = 5  # أقل مدة (بالثواني) بين تحديثين لنفس رسالة التقدم
+PROGRESS_EDITS_PER_SECOND = 5  # حد تعديلات رسائل التقدم لكل البوت في الثانية (يبقى أقل من حدود تيليجرام)
+PROGRESS_STATE_TTL = 600  # حذف حالة رسالة تقدم لم تُحدّث منذ هذه المدة (ثوانٍ) لمنع نمو الذاكرة
+METRICS_PORT = 9100  # منفذ محلي لعرض مقاييس الأداء بصيغة Prometheus على /metrics (0 للتعطيل)
+PRESET_TABLE_PATH = "./preset_table.json"  # جدول سرعات الـ presets المقاسة (benchmarks/encode_matrix.py --table-out)؛ بدونه يُستخدم السلم الثابت
+ENCODE_LATENCY_SLO_SECONDS = 600  # الهدف لزمن الانتظار + الترميز لكل مهمة؛ يُختار أبطأ preset يحققه
+RESOLUTION_LADDER = (1080, 720, 540, 480)  # الدقات المرشحة (الضلع الأقصر) في نمط الحجم المستهدف
+RESOLUTION_LADDER_METRIC = "ssim"  # مقياس جودة العينات: ssim أو vmaf (يحتاج FFmpeg مبني مع libvmaf)
+TARGET_SIZE_AUTO_RESOLUTION = True  # اختيار دقة الناتج تلقائياً بالعينات عند الضغط لحجم معين
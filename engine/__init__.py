@@ -0,0 +1,48 @@
+"""
+محرك الضغط المشترك بين جميع نسخ البوت:
+نموذج المهمة، بناء أمر FFmpeg، التشغيل وتحليل التقدم، ووجهات الإخراج.
+"""
+
+from .job import CompressionJob, CompressionResult
+from .commands import (
+    build_ffmpeg_command, build_movflags_args, build_quality_args, build_scale_args, scaled_size,
+    audio_stream_bytes, calculate_target_bitrate, parse_audio_bitrate_k, select_preset,
+)
+from .progress import ProgressEvent, ProgressParser
+from .probe import (
+    MediaInfo, probe_media, parse_media_info, remember_media_info, clear_media_info_cache,
+    get_telegram_duration, get_video_duration, get_video_info_and_thumb,
+)
+from .runner import (
+    FFmpegError, ProcessRun, format_command, run_ffmpeg, run_capture, run_ffprobe,
+    compress, compress_two_pass, process_job,
+)
+from .thumbnails import thumbnail_path, finalize_thumbnail, discard_thumbnails
+from .streaming import is_streamable, can_stream, stream_compress
+from .segments import plan_segments, split_at_keyframes, compress_segmented
+from .crf_predictor import predict_crf, fit_size_curve, clear_curve_cache, sample_positions
+from .scheduler import (
+    CompressionScheduler, WorkerPool, encoder_class, current_task_wait,
+    estimate_work, estimate_message_work, estimate_download_work, stream_keeps_encoder_busy,
+)
+from .downloads import DownloadRegistry
+from .result_cache import ResultCache, media_unique_id, result_cache_key
+from .jobstore import (
+    JobStore, make_job_key, RECOVERABLE_PHASES,
+    PHASE_DOWNLOADING, PHASE_DOWNLOADED, PHASE_QUEUED, PHASE_COMPRESSING, PHASE_UPLOADING,
+)
+from .sinks import (
+    OutputSink, ChannelDocumentSink, ReplyDocumentSink, ReplyVideoSink, StreamingVideoSink, AlbumSink,
+    AlbumQuotaExceeded, staging_usage,
+)
+from .upload import GrowingFileUploader
+from .flood import call_with_flood_wait
+from .dispatcher import ProgressDispatcher
+from .loop import LoopTimer, run_when_done
+from .preset_policy import PresetPolicy, load_preset_table
+from .quality import quality_score
+from .resolution_ladder import candidate_resolutions, choose_resolution
+from .metrics import (
+    Counter, Gauge, Histogram, JobTimeline, render_metrics, start_metrics_server,
+    JOB_PHASE_SECONDS, JOBS_TOTAL, QUEUE_DEPTH, POOL_WAIT_SECONDS, POOL_RUN_SECONDS,
+)
@@ -0,0 +1,162 @@
+import os
+
+from .thumbnails import build_thumbnail_args
+
+# -------------------------- بناء أوامر FFmpeg --------------------------
+
+def parse_audio_bitrate_k(value, default=128):
+    """تحويل قيمة مثل "128k" إلى رقم بالكيلوبت."""
+    try:
+        return int(str(value).lower().replace('k', '').strip())
+    except Exception:
+        return default
+
+
+def audio_stream_bytes(audio_bitrate_kbps, duration_seconds):
+    """
+    حجم مسار الصوت بالبايت. كل حسابات الحجم المستهدف بالبايت (1MB = 1024×1024)،
+    ومعدلات البت بوحدة FFmpeg (1k = 1000 بت في الثانية).
+    """
+    return audio_bitrate_kbps * 1000 / 8 * max(0, duration_seconds)
+
+
+def calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps=128):
+    """
+    المعادلة الدقيقة لحساب معدل البت (Bitrate) اللازم للوصول إلى حجم محدد (Target Size).
+    """
+    if duration_seconds <= 0:
+        return 500 # قيمة افتراضية آمنة إذا فشل تحديد مدة الفيديو
+
+    # المساحة المتبقية للصورة بالبايت (بطرح مساحة الصوت المحجوزة)
+    video_bytes = target_size_mb * 1024 * 1024 - audio_stream_bytes(audio_bitrate_kbps, duration_seconds)
+
+    # تحويلها إلى معدل بت بوحدة FFmpeg
+    video_bitrate_kbps = int(video_bytes * 8 / 1000 / duration_seconds)
+
+    # حد أدنى آمن لكي لا تنهار جودة الفيديو وتفشل العملية تماماً (50kbps)
+    return max(50, video_bitrate_kbps)
+
+
+def select_preset(quality_value, encoder):
+    """سلم اختيار الإعداد المسبق (preset) حسب قيمة الجودة ونوع المرمز."""
+    preset = "fast" # القيم بين 24-26 تستخدم الإعداد الافتراضي
+    if quality_value <= 18:
+        preset = "slow"
+    elif quality_value <= 23:
+        preset = "medium"
+    elif quality_value >= 27:
+        preset = "veryfast" if encoder == 'libx264' else "fast"
+    return preset
+
+
+def target_video_bitrate(job):
+    """معدل بت الفيديو لنمط الحجم المستهدف (أو القيمة المعدّلة بعد فحص الحجم)."""
+    if job.video_bitrate_k is not None:
+        return job.video_bitrate_k
+    audio_k = parse_audio_bitrate_k(job.audio_bitrate) if job.include_audio else 0
+    return calculate_target_bitrate(job.target_size_mb, job.duration, audio_k)
+
+
+def build_pass_args(job, pass_number, passlog):
+    """خيارات التمرير (pass) الخاصة بكل مرمز في وضع التمريرتين."""
+    if "nvenc" in job.encoder:
+        # NVENC ينفذ التمريرتين داخل نفس العملية
+        return ["-multipass", "fullres"]
+    if job.encoder == 'libx265':
+        return ["-x265-params", f"pass={pass_number}:stats={passlog}.log"]
+    return ["-pass", str(pass_number), "-passlogfile", passlog]
+
+
+def supports_analysis_pass(encoder):
+    """المرمزات التي تحتاج عملية تحليل منفصلة (التمريرة الأولى) قبل الترميز."""
+    return "nvenc" not in encoder
+
+
+def build_quality_args(job):
+    """بناء جزء الجودة من الأمر حسب نمط المهمة (حجم مستهدف / بتريت ثابت / CRF)."""
+    if job.mode == 'target_size':
+        target_v_bitrate = target_video_bitrate(job)
+        preset = job.preset or "fast"
+        # في وضع التمريرتين نترك للمرمز حرية توزيع البتات مع سقف يمنع القفزات الكبيرة
+        maxrate = int(target_v_bitrate * 1.5) if job.two_pass else target_v_bitrate
+        return [
+            "-b:v", f"{target_v_bitrate}k", "-maxrate", f"{maxrate}k",
+            "-bufsize", f"{target_v_bitrate*2}k", "-preset", preset,
+        ]
+
+    if job.mode == 'bitrate':
+        preset = job.preset or "fast"
+        return ["-b:v", f"{job.video_bitrate_k}k", "-preset", preset]
+
+    preset = job.preset or select_preset(job.quality_value, job.encoder)
+    quality_param = "-cq" if "nvenc" in job.encoder else "-crf"
+    return [quality_param, str(job.quality_value), "-preset", preset]
+
+
+def build_scale_args(job):
+    """تصغير الضلع الأقصر إلى job.resolution بنفس عملية الترميز (يعمل للفيديو الأفقي والعمودي)."""
+    if not job.resolution:
+        return []
+    side = int(job.resolution)
+    return ["-vf", f"scale='if(gte(iw,ih),-2,{side})':'if(gte(iw,ih),{side},-2)'"]
+
+
+def scaled_size(width, height, resolution):
+    """أبعاد الناتج بعد build_scale_args (الضلع الآخر زوجي مثل -2 في FFmpeg)."""
+    if not resolution or not width or not height:
+        return width, height
+
+    def even(value):
+        return max(2, int(round(value / 2)) * 2)
+
+    if width >= height:
+        return even(width * resolution / height), int(resolution)
+    return int(resolution), even(height * resolution / width)
+
+
+def build_movflags_args(job):
+    """
+    ترتيب صناديق MP4: faststart ينقل moov للبداية بعد انتهاء الترميز (يعيد كتابة الملف)،
+    أما fragmented فيكتب moov فارغاً ثم أجزاء moof/mdat متتالية، فالملف صالح للتشغيل
+    المتدفق ولا يُعاد فتح أي جزء منه بعد كتابته.
+    """
+    if job.fragmented:
+        return ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+    if job.faststart:
+        return ["-movflags", "+faststart"]
+    return []
+
+
+def build_ffmpeg_command(job, pass_number=None, passlog=None):
+    """
+    إنشاء أمر FFmpeg الكامل لمهمة ضغط كقائمة وسائط (argv) تُمرر مباشرة بدون shell.
+    pass_number=1 ينتج تمريرة التحليل فقط (بدون صوت وبدون ملف ناتج)، و2 للترميز النهائي.
+    """
+    args = ["ffmpeg", "-y", "-i", job.input_path, "-c:v", job.encoder, "-pix_fmt", job.pixel_format]
+    threads_args = ["-threads", str(job.threads)] if job.threads else []
+
+    if pass_number == 1:
+        return (
+            args + build_scale_args(job) + build_quality_args(job) + build_pass_args(job, 1, passlog)
+            + threads_args + ["-an", "-f", "null", os.devnull]
+        )
+
+    if job.include_audio:
+        args += [
+            "-c:a", job.audio_codec, "-b:a", job.audio_bitrate,
+            "-ac", str(job.audio_channels), "-ar", str(job.audio_sample_rate),
+        ]
+    else:
+        args.append("-an")
+    args += threads_args
+    if job.profile:
+        args += ["-profile:v", job.profile]
+    args += ["-map_metadata", "-1"]
+
+    args += build_scale_args(job) + build_quality_args(job)
+    if pass_number == 2:
+        args += build_pass_args(job, 2, passlog)
+    args += build_movflags_args(job) + [job.output_path]
+    if job.thumbnail_count:
+        args += build_thumbnail_args(job)
+    return args
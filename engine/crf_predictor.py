@@ -0,0 +1,128 @@
+import os
+import math
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from config import VIDEO_CRF
+
+from .commands import audio_stream_bytes, parse_audio_bitrate_k, select_preset
+from .runner import run_ffmpeg
+
+# -------------------------- توقع قيمة CRF للحجم المستهدف --------------------------
+# نرمّز مقاطع قصيرة موزعة على طول الملف بعدة قيم CRF، ثم نطابق منحنى
+# ln(حجم الثانية) = a * CRF + b ونحل المعادلة عند الحجم المطلوب.
+
+SAMPLE_CRF_VALUES = (20, 26, 32)
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 2.0
+CURVE_CACHE_MAX_ENTRIES = 256  # المنحنيات الأقدم استخداماً تُحذف بعد هذا العدد
+
+_curve_cache = OrderedDict()  # (path, mtime, size, encoder) -> (a, b)، بترتيب آخر استخدام
+_curve_lock = threading.Lock()
+
+
+def _cache_key(file_path, encoder):
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime, stat.st_size, encoder)
+
+
+def sample_positions(duration, count, seconds):
+    """مواضع بداية المقاطع موزعة بالتساوي؛ الملف القصير يُرمّز كاملاً كمقطع واحد."""
+    if duration <= count * seconds * 2:
+        return [(0, duration)]
+    step = duration / (count + 1)
+    return [(step * (i + 1) - seconds / 2, seconds) for i in range(count)]
+
+
+def _encode_sample_bytes_per_sec(file_path, encoder, crf, positions, work_dir):
+    """ترميز المقاطع بقيمة CRF واحدة وإرجاع متوسط حجم ثانية الفيديو بالبايت."""
+    quality_param = "-cq" if "nvenc" in encoder else "-crf"
+    preset = select_preset(crf, encoder)
+    total_bytes, total_seconds = 0, 0
+    for index, (start, seconds) in enumerate(positions):
+        sample_path = os.path.join(work_dir, f"sample_{crf}_{index}.mp4")
+        run_ffmpeg([
+            "ffmpeg", "-y", "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", file_path,
+            "-c:v", encoder, quality_param, str(crf), "-preset", preset, "-an", "-map_metadata", "-1", sample_path,
+        ])
+        total_bytes += os.path.getsize(sample_path)
+        total_seconds += seconds
+        os.remove(sample_path)
+    return total_bytes / total_seconds if total_seconds > 0 else 0
+
+
+def _fit_curve(points):
+    """ملاءمة خطية بالمربعات الصغرى بين CRF ولوغاريتم الحجم؛ a = 0 إذا تساوت قيم CRF كلها."""
+    xs = [crf for crf, _ in points]
+    ys = [math.log(size) for _, size in points]
+    n = len(points)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return 0.0, mean_y
+    a = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+    return a, mean_y - a * mean_x
+
+
+def fit_size_curve(file_path, encoder, duration):
+    """إرجاع منحنى (a, b) للملف، من الذاكرة المؤقتة إن وُجد لتجنب إعادة أخذ العينات."""
+    key = _cache_key(file_path, encoder)
+    with _curve_lock:
+        if key in _curve_cache:
+            _curve_cache.move_to_end(key)
+            return _curve_cache[key]
+
+    thread_name = threading.current_thread().name
+    positions = sample_positions(duration, SAMPLE_COUNT, SAMPLE_SECONDS)
+    work_dir = tempfile.mkdtemp(prefix="crf_samples_", dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        points = []
+        for crf in SAMPLE_CRF_VALUES:
+            bytes_per_sec = _encode_sample_bytes_per_sec(file_path, encoder, crf, positions, work_dir)
+            if bytes_per_sec > 0:
+                points.append((crf, bytes_per_sec))
+            print(f"[{thread_name}][CRF-Predictor] CRF {crf}: {bytes_per_sec / 1024:.1f} KB/s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if len(points) < 2:
+        raise ValueError("Not enough samples to fit a size curve.")
+    curve = _fit_curve(points)
+    with _curve_lock:
+        _curve_cache[key] = curve
+        while len(_curve_cache) > CURVE_CACHE_MAX_ENTRIES:
+            _curve_cache.popitem(last=False)
+    return curve
+
+
+def predict_crf(file_path, target_size_mb, encoder, duration, audio_bitrate="128k", default_crf=VIDEO_CRF):
+    """
+    توقع قيمة CRF/CQ التي تعطي الحجم المطلوب (بالميجابايت) للملف كاملاً.
+    إذا لم يتناقص حجم العينات مع زيادة CRF (مثل عينات متساوية الحجم) يرجع default_crf.
+    """
+    if duration <= 0:
+        raise ValueError("Video duration is required to predict CRF.")
+    a, b = fit_size_curve(file_path, encoder, duration)
+    if a >= 0:
+        print(f"[{threading.current_thread().name}][CRF-Predictor] Flat size curve, using default CRF {default_crf}")
+        return default_crf
+
+    audio_bytes_per_sec = audio_stream_bytes(parse_audio_bitrate_k(audio_bitrate), 1)
+    video_bytes_per_sec = (target_size_mb * 1024 * 1024) / duration - audio_bytes_per_sec
+    if video_bytes_per_sec <= 0:
+        return 51
+    crf = (math.log(video_bytes_per_sec) - b) / a
+    return int(min(51, max(0, round(crf))))
+
+
+def clear_curve_cache(file_path=None):
+    """حذف المنحنيات المحفوظة لملف معين (عند حذفه) أو لجميع الملفات."""
+    with _curve_lock:
+        if file_path is None:
+            _curve_cache.clear()
+            return
+        path = os.path.abspath(file_path)
+        for key in [k for k in _curve_cache if k[0] == path]:
+            del _curve_cache[key]
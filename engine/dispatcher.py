@@ -0,0 +1,134 @@
+import time
+import threading
+from collections import OrderedDict
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import PROGRESS_UPDATE_INTERVAL, PROGRESS_EDITS_PER_SECOND, PROGRESS_STATE_TTL
+
+# -------------------------- خدمة تحديث رسائل التقدم --------------------------
+# عمال التنزيل والضغط لا يعدّلون رسائل التقدم بأنفسهم: push() يسجل آخر نص للرسالة ويعود فوراً،
+# وخيط واحد يرسل التعديلات. التحديثات المتتالية لنفس الرسالة تُدمج (يُرسل الأحدث فقط)،
+# وعدد التعديلات محدود بـ PROGRESS_EDITS_PER_SECOND لكل البوت، وFloodWait يوقف محادثته فقط
+# حتى انتهاء المدة بدل تجميد خيط عامل.
+
+PRUNE_INTERVAL = 60
+
+
+class ProgressDispatcher:
+    """موزع تعديلات رسائل التقدم المشترك بين كل المهام."""
+
+    def __init__(self, edits_per_second=PROGRESS_EDITS_PER_SECOND, update_interval=PROGRESS_UPDATE_INTERVAL,
+                 state_ttl=PROGRESS_STATE_TTL):
+        self.min_gap = 1.0 / edits_per_second
+        self.update_interval = update_interval
+        self.state_ttl = state_ttl
+        self.sent = 0
+        self.coalesced = 0
+        self._pending = OrderedDict()  # (chat_id, message_id) -> (client, text, final)، الأقدم أولاً
+        self._last_update = {}         # (chat_id, message_id) -> آخر وقت قُبل فيه تحديث
+        self._blocked_until = {}       # chat_id -> نهاية FloodWait
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="ProgressDispatcher", daemon=True)
+        self._thread.start()
+
+    def due(self, chat_id, message_id, final=False):
+        """
+        هل حان وقت تحديث جديد لهذه الرسالة؟ (مرة كل update_interval، والتحديث الأخير دائماً).
+        يسمح للمستدعي بتخطي بناء النص والطباعة بين التحديثات.
+        """
+        key = (chat_id, message_id)
+        now = time.time()
+        with self._cond:
+            last = self._last_update.get(key)
+            if not final and last is not None and now - last < self.update_interval:
+                return False
+            self._last_update[key] = now
+            return True
+
+    def push(self, client, chat_id, message_id, text, final=False):
+        """تسجيل النص الجديد للرسالة وإرجاع التحكم فوراً؛ يحل محل أي نص لم يُرسل بعد."""
+        key = (chat_id, message_id)
+        with self._cond:
+            if key in self._pending:
+                self.coalesced += 1
+                final = final or self._pending[key][2]
+            self._pending[key] = (client, text, final)  # يحتفظ بموقعه في الدور إن كان موجوداً
+            self._cond.notify()
+
+    def forget(self, chat_id, message_id):
+        """إلغاء أي تعديل معلق وحذف حالة الرسالة (مثلاً قبل حذفها)."""
+        key = (chat_id, message_id)
+        with self._cond:
+            self._pending.pop(key, None)
+            self._last_update.pop(key, None)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'tracked': len(self._last_update),
+                'blocked_chats': len(self._blocked_until),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+            }
+
+    # ------ خيط الإرسال ------
+
+    def _next_ready(self, now):
+        for key in self._pending:
+            if self._blocked_until.get(key[0], 0) <= now:
+                return key
+        return None
+
+    def _prune(self, now):
+        for key in [key for key, last in self._last_update.items() if now - last > self.state_ttl]:
+            if key not in self._pending:
+                del self._last_update[key]
+        for chat_id in [chat_id for chat_id, until in self._blocked_until.items() if until <= now]:
+            del self._blocked_until[chat_id]
+
+    def _wait_timeout(self, now, next_slot):
+        if self._next_ready(now) is not None:
+            return max(0.0, next_slot - now)
+        unblock = [until - now for until in self._blocked_until.values() if until > now]
+        return min(unblock + [PRUNE_INTERVAL])
+
+    def _run(self):
+        next_slot = 0.0
+        last_prune = time.time()
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if now - last_prune >= PRUNE_INTERVAL:
+                        self._prune(now)
+                        last_prune = now
+                    key = self._next_ready(now)
+                    if key is not None and now >= next_slot:
+                        break
+                    self._cond.wait(timeout=self._wait_timeout(now, next_slot))
+                client, text, final = self._pending.pop(key)
+
+            next_slot = time.time() + self.min_gap
+            self._edit(key, client, text, final)
+
+    def _edit(self, key, client, text, final):
+        chat_id, message_id = key
+        try:
+            client.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except FloodWait as e:
+            with self._cond:
+                self._blocked_until[chat_id] = time.time() + int(e.value or 0) + 1
+                # إعادة النص للدور إلا إذا وصل نص أحدث أثناء المحاولة
+                self._pending.setdefault(key, (client, text, final))
+            print(f"[ProgressDispatcher] FloodWait {e.value}s for chat {chat_id}; its progress edits are paused.")
+            return
+        except MessageNotModified:
+            pass
+        except Exception:
+            pass  # الرسالة حُذفت أو لم تعد قابلة للتعديل
+        with self._cond:
+            self.sent += 1
+            if final and key not in self._pending:
+                self._last_update.pop(key, None)
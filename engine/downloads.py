@@ -0,0 +1,88 @@
+import os
+import threading
+
+from .result_cache import media_unique_id
+
+# -------------------------- مشاركة التنزيلات المتزامنة --------------------------
+# عدة رسائل لنفس الملف (نفس file_unique_id) تشترك في تنزيل واحد وملف واحد على القرص.
+# كل مهمة تحجز الملف بـ acquire وتتركه بـ release، ويُحذف الملف عند ترك آخر مهمة له.
+
+
+class DownloadRegistry:
+    """سجل التنزيلات الجارية والملفات المشتركة مع عداد مراجع لكل تنزيل."""
+
+    def __init__(self):
+        self._by_key = {}  # file_unique_id -> Future التنزيل الحالي لهذا الملف
+        self._refs = {}    # Future -> [file_unique_id, عدد المهام التي تستخدمه]
+        self._lock = threading.Lock()
+
+    def acquire(self, key, start_download):
+        """
+        حجز الملف: يرجع (future, shared) حيث future.result() مسار الملف، وshared=True إذا كان
+        التنزيل قائماً مسبقاً لطلب آخر. start_download() تُستدعى فقط عند عدم وجوده.
+        key=None (ملف بدون معرف) يبدأ تنزيلاً مستقلاً لا يُشارك.
+        """
+        with self._lock:
+            future = self._by_key.get(key) if key is not None else None
+            if future is not None and not _failed(future):
+                self._refs[future][1] += 1
+                return future, True
+            future = start_download()
+            self._refs[future] = [key, 1]
+            if key is not None:
+                self._by_key[key] = future
+            return future, False
+
+    def release(self, future):
+        """ترك الملف بعد انتهاء المهمة؛ يُحذف عند ترك آخر مرجع (بعد اكتمال التنزيل إذا كان ما يزال جارياً)."""
+        with self._lock:
+            ref = self._refs.get(future)
+            if ref is None:
+                return
+            ref[1] -= 1
+            if ref[1] > 0:
+                return
+            del self._refs[future]
+            if self._by_key.get(ref[0]) is future:
+                del self._by_key[ref[0]]
+        future.add_done_callback(_remove_downloaded)
+
+    def download(self, message, start_download):
+        """acquire بمفتاح file_unique_id لفيديو الرسالة؛ يرجع (future, shared)."""
+        return self.acquire(media_unique_id(message), start_download)
+
+    def release_source(self, video_data):
+        """
+        ترك الملف الأصلي لمهمة من البوت (قاموس video_data بمفتاحي download_future وfile).
+        الملف المشترك لا يُحذف إلا عند ترك آخر مهمة له، والملف غير المسجل (تنزيل متدفق)
+        يُحذف مباشرة. الاستدعاء المتكرر لنفس المهمة لا يؤثر على مراجع المهام الأخرى.
+        """
+        if video_data.get('source_released'):
+            return
+        video_data['source_released'] = True
+        future = video_data.get('download_future')
+        with self._lock:
+            registered = future is not None and future in self._refs
+        if registered:
+            self.release(future)
+        elif video_data.get('file') and os.path.exists(video_data['file']):
+            os.remove(video_data['file'])
+
+    def active_count(self):
+        with self._lock:
+            return len(self._refs)
+
+
+def _failed(future):
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+
+def _remove_downloaded(future):
+    if _failed(future):
+        return
+    path = future.result()
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        print(f"[DownloadRegistry] Could not delete shared file {path}: {e}")
@@ -0,0 +1,23 @@
+import time
+import threading
+
+from pyrogram.errors import FloodWait
+
+from config import FLOOD_WAIT_MAX_RETRIES
+
+# -------------------------- احترام حدود تيليجرام (FloodWait) --------------------------
+# عند تجاوز الحد يرد تيليجرام بـ FloodWait ومدة الانتظار المطلوبة بالثواني؛ ننتظرها
+# (مع ثانية إضافية) ثم نعيد نفس الطلب بدل إسقاطه.
+
+
+def call_with_flood_wait(fn, *args, max_retries=FLOOD_WAIT_MAX_RETRIES, **kwargs):
+    """تنفيذ طلب تيليجرام مع إعادة المحاولة بعد FloodWait حتى max_retries مرة."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except FloodWait as e:
+            if attempt == max_retries:
+                raise
+            wait = int(e.value or 0) + 1
+            print(f"[{threading.current_thread().name}] FloodWait: sleeping {wait}s before retry {attempt + 1}/{max_retries}.")
+            time.sleep(wait)
@@ -0,0 +1,84 @@
+import os
+from dataclasses import dataclass
+
+from config import (
+    VIDEO_PIXEL_FORMAT, VIDEO_AUDIO_CODEC, VIDEO_AUDIO_BITRATE,
+    VIDEO_AUDIO_CHANNELS, VIDEO_AUDIO_SAMPLE_RATE,
+)
+
+# -------------------------- نموذج المهمة والنتيجة --------------------------
+
+@dataclass
+class CompressionJob:
+    """
+    وصف مهمة ضغط واحدة: الملف المصدر، مسار الناتج، الترميز ونمط الجودة.
+    يُحدد النمط تلقائياً حسب الحقل المضبوط: target_size_mb ثم video_bitrate_k ثم quality_value.
+    """
+    input_path: str
+    output_path: str
+    encoder: str = 'h264_nvenc'
+    quality_value: int = None      # قيمة CRF/CQ لنمط الجودة
+    target_size_mb: float = None   # الحجم المستهدف بالميجابايت
+    video_bitrate_k: int = None    # معدل بت ثابت للفيديو (كيلوبت)
+    preset: str = None             # إذا تُرك فارغاً يُختار من سلم الجودة
+    duration: float = 0            # المدة بالثواني (لحساب البتريت وشريط التقدم)
+    profile: str = None            # مثل "high"
+    faststart: bool = False        # نقل moov لبداية الملف (للتشغيل المتدفق)
+    fragmented: bool = False       # MP4 مجزأ يُكتب بالتتابع فقط (للرفع أثناء الترميز)
+    two_pass: bool = False         # تمريرتان + فحص الحجم في نمط الحجم المستهدف
+    segments: int = 1              # عدد الأجزاء للترميز المتوازي (1 = عملية واحدة)
+    include_audio: bool = True     # False لترميز الفيديو فقط (أجزاء الترميز المتوازي)
+    threads: int = None            # حد خيوط المرمز لكل عملية FFmpeg
+    thumbnail_count: int = 0       # صور مصغرة مرشحة تُستخرج أثناء الترميز (0 = بدون)
+    resolution: int = None         # الضلع الأقصر للناتج بالبكسل (مثل 720) للتصغير؛ None = أبعاد المصدر
+    auto_resolution: bool = False  # نمط الحجم المستهدف: اختيار الدقة الأفضل جودة بالعينات قبل الترميز
+    pixel_format: str = VIDEO_PIXEL_FORMAT
+    audio_codec: str = VIDEO_AUDIO_CODEC
+    audio_bitrate: str = VIDEO_AUDIO_BITRATE
+    audio_channels: int = VIDEO_AUDIO_CHANNELS
+    audio_sample_rate: int = VIDEO_AUDIO_SAMPLE_RATE
+
+    @property
+    def mode(self):
+        if self.target_size_mb is not None:
+            return 'target_size'
+        if self.video_bitrate_k is not None:
+            return 'bitrate'
+        return 'crf'
+
+
+@dataclass
+class CompressionResult:
+    """نتيجة الضغط التي تُمرر لوجهة الإخراج (Sink)."""
+    job: CompressionJob
+    output_path: str
+    input_size: int
+    output_size: int
+    elapsed: float
+    command: str
+    passes: int = 1                # عدد مرات تشغيل FFmpeg على الملف (تحليل + ترميز + إعادة)
+    thumbnail_path: str = None     # الصورة المصغرة المستخرجة أثناء الترميز (إن طُلبت)
+
+    @property
+    def input_size_mb(self):
+        return self.input_size / (1024 * 1024)
+
+    @property
+    def output_size_mb(self):
+        return self.output_size / (1024 * 1024)
+
+    @property
+    def compression_ratio(self):
+        return (self.input_size / self.output_size) if self.output_size > 0 else 0
+
+    @classmethod
+    def from_files(cls, job, command, elapsed, passes=1):
+        return cls(
+            job=job,
+            output_path=job.output_path,
+            input_size=os.path.getsize(job.input_path) if os.path.exists(job.input_path) else 0,
+            output_size=os.path.getsize(job.output_path),
+            elapsed=elapsed,
+            command=command,
+            passes=passes,
+        )
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+# -------------------------- سجل المهام الدائم --------------------------
+# يحفظ مرحلة كل مهمة في SQLite (وضع WAL) ليستأنف البوت المهام بعد إعادة التشغيل.
+# الكتابة تمر عبر طابور وخيط كاتب واحد يجمع التحديثات في معاملة واحدة، فلا ينتظر
+# خيط التنزيل أو الضغط القرص أبداً.
+
+PHASE_DOWNLOADING = 'downloading'
+PHASE_DOWNLOADED = 'downloaded'    # الملف جاهز وبانتظار اختيار الجودة
+PHASE_QUEUED = 'queued'            # الجودة مختارة وبانتظار عامل ضغط
+PHASE_COMPRESSING = 'compressing'
+PHASE_UPLOADING = 'uploading'
+
+RECOVERABLE_PHASES = (PHASE_DOWNLOADING, PHASE_DOWNLOADED, PHASE_QUEUED, PHASE_COMPRESSING, PHASE_UPLOADING)
+
+JOB_FIELDS = ('user_id', 'chat_id', 'message_id', 'phase', 'input_path', 'quality', 'output_path', 'encoder', 'error')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_key     TEXT PRIMARY KEY,
+    user_id     INTEGER,
+    chat_id     INTEGER,
+    message_id  INTEGER,
+    phase       TEXT,
+    input_path  TEXT,
+    quality     TEXT,
+    output_path TEXT,
+    encoder     TEXT,
+    error       TEXT,
+    created_at  REAL,
+    updated_at  REAL
+)
+"""
+
+_WRITE_BATCH = 256
+
+
+def make_job_key(chat_id, message_id):
+    """مفتاح ثابت للمهمة مبني على رسالة الفيديو الأصلية (لا يتغير عند نقلها لرسالة الأزرار)."""
+    return f"{chat_id}:{message_id}"
+
+
+class JobStore:
+    """واجهة السجل: record/finish غير حاجبتين، والقراءة عند بدء التشغيل فقط."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        conn = self._connect()
+        conn.execute(_SCHEMA)
+        conn.commit()
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="JobStoreWriter", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ------ الكتابة (خيط واحد) ------
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            stop = False
+            try:
+                with conn:
+                    for item in batch:
+                        if item is None:
+                            stop = True
+                        elif isinstance(item, threading.Event):
+                            waiters.append(item)
+                        else:
+                            conn.execute(*item)
+            except sqlite3.Error as e:
+                print(f"[JobStore] Write error: {e}")
+            for event in waiters:
+                event.set()
+            if stop:
+                conn.close()
+                return
+
+    def record(self, job_key, **fields):
+        """إنشاء المهمة أو تحديث حقولها (مثل phase وinput_path) بدون انتظار القرص."""
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        if 'quality' in fields:
+            fields['quality'] = json.dumps(fields['quality'])
+
+        now = time.time()
+        columns = list(fields)
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{column}=excluded.{column}" for column in columns + ['updated_at'])
+        sql = (
+            f"INSERT INTO jobs (job_key, {', '.join(columns)}, created_at, updated_at) "
+            f"VALUES (?, {placeholders}, ?, ?) ON CONFLICT(job_key) DO UPDATE SET {updates}"
+        )
+        self._queue.put((sql, [job_key] + [fields[c] for c in columns] + [now, now]))
+
+    def finish(self, job_key):
+        """حذف المهمة من السجل بعد اكتمالها أو إلغائها."""
+        self._queue.put(("DELETE FROM jobs WHERE job_key = ?", (job_key,)))
+
+    def flush(self, timeout=None):
+        """انتظار كتابة كل التحديثات المعلقة."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+
+    # ------ القراءة (عند بدء التشغيل) ------
+
+    def recoverable(self):
+        """المهام غير المكتملة من التشغيل السابق، الأقدم أولاً."""
+        self.flush()
+        conn = self._connect()
+        try:
+            placeholders = ", ".join("?" for _ in RECOVERABLE_PHASES)
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE phase IN ({placeholders}) ORDER BY created_at",
+                RECOVERABLE_PHASES,
+            ).fetchall()
+        finally:
+            conn.close()
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job['quality'] = json.loads(job['quality']) if job['quality'] else None
+            jobs.append(job)
+        return jobs
+
+    def active_paths(self):
+        """
+        الملفات الأصلية لمهام قابلة للاستئناف (لا يجوز حذفها عند التنظيف).
+        مخرجات الضغط الجزئية لا تُحمى لأن المهمة المستأنفة تبدأ الترميز من جديد.
+        """
+        return {os.path.abspath(job['input_path']) for job in self.recoverable() if job.get('input_path')}
@@ -0,0 +1,48 @@
+# -------------------------- مهام مؤجلة على حلقة Pyrogram --------------------------
+# المؤقتات والمتابعات بعد التنزيل لا تحجز خيطاً لكل رسالة: المؤقت callback على حلقة asyncio
+# الخاصة بالعميل، وعند حلول الوقت (أو انتهاء التنزيل) تُنفذ الدالة على مجمع خيوط العميل
+# (client.executor، محدود بعدد workers) لأن دوال البوت تستدعي واجهة Pyrogram المتزامنة.
+
+
+class LoopTimer:
+    """
+    بديل لـ threading.Timer بنفس الواجهة (start/cancel/is_alive) لكنه لا ينشئ خيطاً:
+    ينتظر على حلقة العميل ثم يُنفذ function(*args) على client.executor.
+    """
+
+    def __init__(self, client, interval, function, args=None):
+        self.client = client
+        self.interval = interval
+        self.function = function
+        self.args = args or []
+        self._handle = None
+        self._started = False
+        self._cancelled = False
+        self._fired = False
+
+    def start(self):
+        self._started = True
+        self.client.loop.call_soon_threadsafe(self._arm)
+
+    def _arm(self):
+        if not self._cancelled:
+            self._handle = self.client.loop.call_later(self.interval, self._fire)
+
+    def _fire(self):
+        if self._cancelled:
+            return
+        self._fired = True
+        self.client.loop.run_in_executor(self.client.executor, self.function, *self.args)
+
+    def cancel(self):
+        self._cancelled = True
+        if self._handle is not None:
+            self.client.loop.call_soon_threadsafe(self._handle.cancel)
+
+    def is_alive(self):
+        return self._started and not (self._cancelled or self._fired)
+
+
+def run_when_done(client, future, function, *args):
+    """تنفيذ function(*args) على client.executor بعد انتهاء future (نجاحاً أو فشلاً) بدل خيط ينتظره."""
+    future.add_done_callback(lambda _: client.executor.submit(function, *args))
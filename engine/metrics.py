@@ -0,0 +1,261 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------------- مقاييس الأداء (بصيغة Prometheus) --------------------------
+# عدادات ومقاييس لحظية وتوزيعات (Histogram) في الذاكرة، تُعرض كنص Prometheus على /metrics
+# عبر start_metrics_server. كل مهمة تسجل أوقات مراحلها في JobTimeline فيظهر أي مرحلة
+# (الانتظار، التنزيل، الضغط، الرفع...) تستهلك الوقت تحت الحمل الفعلي.
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.5)
+SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """قيمة لحظية؛ set_function تجعل القيمة تُقرأ عند العرض (مثل طول الطابور)."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """function() ترجع رقماً، أو قاموساً {قيم الوسوم (tuple): رقم} للمقاييس ذات الوسوم."""
+        self._function = function
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            try:
+                current = self._function()
+            except Exception:
+                current = {}
+            values.update(current if isinstance(current, dict) else {(): current})
+        return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # قيم الوسوم -> [عدد كل فئة..., المجموع, العدد]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+def render_metrics():
+    """كل المقاييس المسجلة بصيغة Prometheus النصية."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ------ المقاييس المشتركة ------
+
+JOB_PHASE_SECONDS = Histogram(
+    "compress_job_phase_seconds", "Time spent by jobs in each phase.", labels=("phase",))
+JOBS_TOTAL = Counter("compress_jobs_total", "Finished jobs by outcome.", labels=("outcome",))
+QUEUE_DEPTH = Gauge("compress_queue_depth", "Jobs waiting in each worker pool.", labels=("pool",))
+POOL_WAIT_SECONDS = Histogram(
+    "compress_pool_wait_seconds", "Time tasks waited in each worker pool before starting.", labels=("pool",))
+POOL_RUN_SECONDS = Histogram(
+    "compress_pool_run_seconds", "Time tasks ran inside each worker pool.", labels=("pool",))
+ACTIVE_ENCODES = Gauge("compress_active_encodes", "FFmpeg encodes currently running.")
+BYTES_IN = Counter("compress_input_bytes_total", "Bytes of source video fed to the encoder.")
+BYTES_OUT = Counter("compress_output_bytes_total", "Bytes of compressed video produced.")
+COMPRESSION_RATIO = Histogram(
+    "compress_ratio", "Output size divided by input size per encode.", buckets=RATIO_BUCKETS)
+ENCODE_SPEED = Histogram(
+    "compress_encode_speed", "Media seconds encoded per wall-clock second.", buckets=SPEED_BUCKETS)
+
+
+def record_encode(result, duration):
+    """تسجيل ناتج ترميز مكتمل: البايتات ونسبة الضغط ومضاعف السرعة."""
+    BYTES_IN.inc(result.input_size)
+    BYTES_OUT.inc(result.output_size)
+    if result.input_size:
+        COMPRESSION_RATIO.observe(result.output_size / result.input_size)
+    if duration and result.elapsed > 0:
+        ENCODE_SPEED.observe(duration / result.elapsed)
+
+
+class JobTimeline:
+    """
+    أوقات مراحل مهمة واحدة (queued، download، probe، encode، upload، cleanup...).
+    begin/end لكل مرحلة، ومدة المرحلة تُسجل في compress_job_phase_seconds عند انتهائها.
+    """
+
+    def __init__(self, job_key):
+        self.job_key = job_key
+        self.created = time.time()
+        self.events = {}  # اسم الحدث -> الوقت (مثل download_start، encode_end)
+
+    def mark(self, event):
+        self.events[event] = time.time()
+
+    def begin(self, phase):
+        self.mark(f"{phase}_start")
+
+    def end(self, phase):
+        start = self.events.get(f"{phase}_start")
+        self.mark(f"{phase}_end")
+        if start is not None:
+            JOB_PHASE_SECONDS.observe(self.events[f"{phase}_end"] - start, phase=phase)
+
+    @contextmanager
+    def phase(self, phase):
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+
+    def timed(self, phase, fn):
+        """تغليف fn لتُسجل مدة تنفيذها كمرحلة (مثل التنزيل في مجمع التنزيل)."""
+        def run(*args, **kwargs):
+            with self.phase(phase):
+                return fn(*args, **kwargs)
+        return run
+
+    def finish(self, outcome):
+        """إنهاء المهمة: تسجيل الزمن الكلي والنتيجة (done/failed/cached/cancelled)."""
+        self.mark("finished")
+        JOB_PHASE_SECONDS.observe(self.events["finished"] - self.created, phase="total")
+        JOBS_TOTAL.inc(outcome=outcome)
+
+    def summary(self):
+        """نص مختصر بمدد المراحل المكتملة للطباعة في السجل."""
+        parts = []
+        for event, end in self.events.items():
+            if event.endswith("_end") and f"{event[:-4]}_start" in self.events:
+                parts.append(f"{event[:-4]} {end - self.events[event[:-4] + '_start']:.1f}s")
+        return " | ".join(parts)
+
+
+# ------ خادم /metrics ------
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # لا نملأ السجل بطلبات الجمع الدورية
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """تشغيل خادم HTTP محلي للمقاييس في خيط خلفي؛ port=0 أو None يعطله."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        # نسخة أخرى من البوت تستخدم نفس المنفذ؛ المقاييس اختيارية فلا توقف تشغيل البوت
+        print(f"⚠️ Metrics server not started on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
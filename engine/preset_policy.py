@@ -0,0 +1,69 @@
+import os
+import json
+import threading
+
+from config import PRESET_TABLE_PATH, ENCODE_LATENCY_SLO_SECONDS
+
+from .commands import select_preset
+
+# -------------------------- اختيار الـ preset من نتائج القياس --------------------------
+# جدول السرعات (من benchmarks/encode_matrix.py --table-out) يعطي لكل مرمز وpreset سرعة الترميز
+# (ثواني وسائط لكل ثانية فعلية) عند دقة مرجعية. لكل مهمة يُختار أبطأ preset (أصغر ملف) يبقى زمن
+# ترميزه المتوقع ضمن المهلة المتبقية من هدف الاستجابة، والمهلة تُقسم على المهام المنتظرة خلفها،
+# فعند امتلاء الطابور يُضحى بقليل من الحجم مقابل سرعة الإنجاز. قيمة الجودة (CRF/CQ) لا تتغير.
+# بدون جدول يُستخدم السلم الثابت (select_preset).
+
+
+def load_preset_table(path):
+    """قراءة جدول القياس؛ يرجع None إذا لم يوجد الملف أو كان غير صالح."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as handle:
+            table = json.load(handle)
+        table['reference_pixels'] = float(table['reference_pixels'])
+        table['encoders'] = {
+            encoder: {preset: float(entry['speed']) for preset, entry in presets.items() if float(entry['speed']) > 0}
+            for encoder, presets in table['encoders'].items()
+        }
+        return table
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[PresetPolicy] Ignoring invalid preset table {path}: {e}")
+        return None
+
+
+class PresetPolicy:
+    """اختيار preset لكل مهمة حسب هدف زمن الاستجابة وحالة الطابور ومدة ودقة المقطع."""
+
+    def __init__(self, table_path=PRESET_TABLE_PATH, slo_seconds=ENCODE_LATENCY_SLO_SECONDS):
+        self.slo_seconds = slo_seconds
+        self.table = load_preset_table(table_path)
+        self._lock = threading.Lock()
+        self.choices = {}  # preset -> عدد مرات اختياره
+
+    def estimate_seconds(self, encoder, preset, duration, pixels):
+        """زمن الترميز المتوقع من سرعة الجدول بعد تعديلها بنسبة البكسلات إلى الدقة المرجعية."""
+        speed = self.table['encoders'][encoder][preset]
+        scale = pixels / self.table['reference_pixels'] if pixels else 1.0
+        return duration * scale / speed
+
+    def choose(self, encoder, quality_value, duration, pixels=0, waited=0.0, queued=0, workers=1):
+        """
+        يرجع (preset، الزمن المتوقع أو None). المهلة = (الهدف − زمن الانتظار) ÷ (1 + المنتظرين لكل عامل).
+        بدون جدول للمرمز، أو بدون مدة معروفة، يرجع اختيار السلم الثابت.
+        """
+        presets = (self.table or {}).get('encoders', {}).get(encoder)
+        if not presets or duration <= 0:
+            return select_preset(quality_value, encoder), None
+
+        budget = (self.slo_seconds - waited) / (1 + queued / max(1, workers))
+        # من الأبطأ (أصغر ملف) إلى الأسرع
+        candidates = sorted(presets, key=presets.get)
+        preset = candidates[-1]
+        for candidate in candidates:
+            if self.estimate_seconds(encoder, candidate, duration, pixels) <= budget:
+                preset = candidate
+                break
+        with self._lock:
+            self.choices[preset] = self.choices.get(preset, 0) + 1
+        return preset, self.estimate_seconds(encoder, preset, duration, pixels)
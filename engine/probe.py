@@ -0,0 +1,198 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from .runner import run_ffmpeg, run_ffprobe
+from .thumbnails import thumbnail_path as thumbnail_sidecar
+
+# -------------------------- استخراج معلومات الفيديو --------------------------
+# فحص واحد بـ ffprobe (JSON) لكل ملف يُحفظ في ذاكرة مؤقتة بمفتاح (المسار، وقت التعديل، الحجم)،
+# فالمدة والأبعاد والترميز وغيرها تُقرأ منه دون تشغيل عمليات إضافية.
+
+MEDIA_INFO_CACHE_MAX = 256
+KEYFRAME_SCAN_SECONDS = 30  # حزم أول 30 ثانية تكفي لتقدير المسافة بين الإطارات المفتاحية
+
+_media_cache = OrderedDict()  # (path, mtime, size) -> MediaInfo
+_media_lock = threading.Lock()
+
+
+@dataclass
+class MediaInfo:
+    """خصائص ملف الوسائط كما يبلغ عنها ffprobe."""
+    path: str
+    duration: float = 0.0
+    width: int = 0                 # الأبعاد المخزنة في الترميز (قبل الدوران)
+    height: int = 0
+    rotation: int = 0              # زاوية العرض بالدرجات (0/90/180/270)
+    video_codec: str = None
+    audio_codec: str = None
+    bit_rate: int = 0              # معدل البت الكلي (bit/s)
+    video_bit_rate: int = 0
+    audio_bit_rate: int = 0
+    frame_rate: float = 0.0
+    keyframe_interval: float = 0.0  # متوسط الثواني بين الإطارات المفتاحية (0 إذا كان غير معروف)
+
+    @property
+    def has_audio(self):
+        return self.audio_codec is not None
+
+    @property
+    def display_size(self):
+        """الأبعاد كما تظهر عند التشغيل؛ FFmpeg يطبق الدوران عند إعادة الترميز فهذه أبعاد الناتج."""
+        if self.rotation % 180 == 90:
+            return self.height, self.width
+        return self.width, self.height
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _frame_rate(value):
+    num, _, den = (value or "0/1").partition('/')
+    return _to_float(num) / _to_float(den) if _to_float(den) else _to_float(num)
+
+
+def _rotation(stream):
+    rotation = _to_int(stream.get('tags', {}).get('rotate'))
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = _to_int(side_data['rotation'])
+    return rotation % 360
+
+
+def parse_media_info(path, data):
+    """بناء MediaInfo من مخرجات ffprobe بصيغة JSON."""
+    info = MediaInfo(path=path)
+    fmt = data.get('format', {})
+    info.duration = _to_float(fmt.get('duration'))
+    info.bit_rate = _to_int(fmt.get('bit_rate'))
+
+    video_index = None
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and video_index is None:
+            video_index = stream.get('index')
+            info.video_codec = stream.get('codec_name')
+            info.width = _to_int(stream.get('width'))
+            info.height = _to_int(stream.get('height'))
+            info.rotation = _rotation(stream)
+            info.video_bit_rate = _to_int(stream.get('bit_rate'))
+            info.frame_rate = _frame_rate(stream.get('avg_frame_rate')) or _frame_rate(stream.get('r_frame_rate'))
+            if not info.duration:
+                info.duration = _to_float(stream.get('duration'))
+        elif stream.get('codec_type') == 'audio' and info.audio_codec is None:
+            info.audio_codec = stream.get('codec_name')
+            info.audio_bit_rate = _to_int(stream.get('bit_rate'))
+
+    keyframes = [
+        _to_float(packet.get('pts_time')) for packet in data.get('packets', [])
+        if packet.get('stream_index') == video_index and 'K' in packet.get('flags', '')
+    ]
+    if len(keyframes) >= 2:
+        info.keyframe_interval = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+    return info
+
+
+def probe_media(file_path):
+    """
+    معلومات الملف من ffprobe واحد، من الذاكرة المؤقتة إذا لم يتغير الملف منذ آخر فحص.
+    ترفع FFmpegError أو ValueError إذا تعذر الفحص (ولا يُحفظ الفشل).
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime, stat.st_size)
+    with _media_lock:
+        if key in _media_cache:
+            _media_cache.move_to_end(key)
+            return _media_cache[key]
+
+    result = run_ffprobe([
+        "ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams",
+        "-read_intervals", f"%+{KEYFRAME_SCAN_SECONDS}", "-show_entries", "packet=stream_index,pts_time,flags",
+        file_path,
+    ])
+    info = parse_media_info(file_path, json.loads(result.stdout))
+
+    with _media_lock:
+        _media_cache[key] = info
+        while len(_media_cache) > MEDIA_INFO_CACHE_MAX:
+            _media_cache.popitem(last=False)
+    return info
+
+
+def remember_media_info(file_path, info):
+    """تسجيل معلومات معروفة مسبقاً لملف (مثل ناتج ضغط من فحص مصدره) فلا يُفحص لاحقاً."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime, stat.st_size)
+    with _media_lock:
+        _media_cache[key] = replace(info, path=file_path)
+        while len(_media_cache) > MEDIA_INFO_CACHE_MAX:
+            _media_cache.popitem(last=False)
+
+
+def clear_media_info_cache(file_path=None):
+    """حذف معلومات ملف من الذاكرة (مثلاً بعد حذفه)، أو مسح الذاكرة كلها."""
+    with _media_lock:
+        if file_path is None:
+            _media_cache.clear()
+            return
+        path = os.path.abspath(file_path)
+        for key in [key for key in _media_cache if key[0] == path]:
+            del _media_cache[key]
+
+
+def get_telegram_duration(message):
+    """جلب مدة الفيديو بسرعة من بيانات رسالة تيليجرام لضمان الدقة العالية"""
+    if message.video and message.video.duration:
+        return float(message.video.duration)
+    elif message.animation and message.animation.duration:
+        return float(message.animation.duration)
+    return 0
+
+
+def get_video_duration(file_path):
+    """جلب المدة الإجمالية كخيار بديل إذا فشل جلبها من تيليجرام"""
+    try:
+        return probe_media(file_path).duration
+    except Exception:
+        return 0
+
+
+def get_video_info_and_thumb(file_path, info=None):
+    """
+    تستخرج المدة والأبعاد من الفيديو وتلتقط صورة مصغرة (Thumbnail) لتستخدمها تيليجرام.
+    info: MediaInfo معروف مسبقاً (مثل معلومات المصدر لناتج الضغط) لتجنب فحص جديد.
+    إذا استُخرجت الصورة أثناء الترميز (بجانب الملف) تُستخدم مباشرة بدون تشغيل FFmpeg.
+    """
+    duration, width, height, thumb_path = 0.0, 0, 0, None
+    try:
+        if info is None:
+            info = probe_media(file_path)
+        duration = info.duration
+        width, height = info.display_size
+
+        thumb_path = thumbnail_sidecar(file_path)
+        if os.path.exists(thumb_path):
+            return thumb_path, duration, width, height
+
+        thumb_time = min(1.0, duration * 0.1) if duration > 0 else 1.0
+        run_ffmpeg([
+            "ffmpeg", "-y", "-ss", str(thumb_time), "-i", file_path,
+            "-vframes", "1", "-vf", "scale=320:-1", "-q:v", "5", thumb_path, "-loglevel", "quiet",
+        ])
+        if not os.path.exists(thumb_path):
+            thumb_path = None
+    except Exception as e:
+        print(f"Error getting video info & thumb: {e}")
+    return thumb_path, duration, width, height
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+
+# -------------------------- تحليل تقدم FFmpeg --------------------------
+# نطلب من FFmpeg كتابة التقدم بصيغة key=value عبر (-progress pipe:1)، وكل كتلة تنتهي
+# بسطر progress=continue أو progress=end، فنحوّلها إلى ProgressEvent بدون تعابير نمطية.
+
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+
+@dataclass
+class ProgressEvent:
+    """لقطة من تقدم الترميز كما يبلغ عنها FFmpeg."""
+    out_time: float = 0.0      # الزمن المُعالج من الفيديو بالثواني
+    duration: float = 0.0      # المدة الكلية (0 إذا كانت غير معروفة)
+    fps: float = 0.0           # سرعة الترميز بالإطارات في الثانية
+    speed: float = 0.0         # مضاعف السرعة مقارنة بزمن التشغيل الحقيقي
+    total_size: int = 0        # حجم الناتج المكتوب حتى الآن بالبايت
+    frame: int = 0
+    done: bool = False         # True عند آخر كتلة (progress=end)
+    attempt: int = 1           # رقم محاولة الترميز (أكبر من 1 عند إعادة الترميز لضبط الحجم)
+    stage: str = 'encode'      # 'resolution' أثناء ترميز عينات اختيار الدقة قبل الترميز الفعلي
+
+    @property
+    def percent(self):
+        return min(100.0, self.out_time * 100 / self.duration) if self.duration > 0 else 0.0
+
+    @property
+    def eta(self):
+        """الوقت المتبقي بالثواني حسب مضاعف السرعة، أو None إذا كان غير معروف."""
+        if self.duration <= 0 or self.speed <= 0:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+    @property
+    def projected_size(self):
+        """الحجم المتوقع للملف الناتج بالبايت عند نهاية الترميز."""
+        if self.duration <= 0 or self.out_time <= 0:
+            return 0
+        return int(self.total_size * self.duration / self.out_time)
+
+
+def _to_float(value, default=0.0):
+    """تحويل قيمة حقل إلى رقم؛ القيم الغائبة أو N/A (قبل أول إطار وأثناء تفريغ المرمز) ترجع default."""
+    try:
+        return float(value.rstrip('x'))
+    except (ValueError, AttributeError):
+        return default
+
+
+class ProgressParser:
+    """تجميع أسطر key=value من مخرجات -progress وإرجاع حدث عند اكتمال كل كتلة."""
+
+    def __init__(self, duration=0):
+        self.duration = duration
+        self._fields = {}
+        self._out_time = 0.0     # آخر قيم معروفة، تُستخدم عندما يرسل FFmpeg الحقل بقيمة N/A
+        self._total_size = 0
+        self._fps = 0.0
+        self._speed = 0.0
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        if key != 'progress':
+            self._fields[key] = value
+            return None
+
+        fields, self._fields = self._fields, {}
+        done = value == 'end'
+        out_time_us = _to_float(fields.get('out_time_us', fields.get('out_time_ms')), None)
+        if out_time_us is not None:
+            # التقدم لا يرجع للخلف: مع مخرجات إضافية (مثل الصور المصغرة) قد يبلغ FFmpeg زمن المخرج
+            # الأقصر، خاصة في الكتلة الأخيرة
+            self._out_time = max(self._out_time, out_time_us / 1_000_000)
+        if done and self.duration > 0:
+            self._out_time = self.duration  # progress=end يعني أن كل المدخل عولج
+        self._total_size = int(_to_float(fields.get('total_size'), self._total_size))
+        if not done or not self._speed:
+            # سرعة الكتلة الأخيرة قد تخص المخرج الأقصر أيضاً، فتبقى آخر سرعة للترميز نفسه
+            self._fps = _to_float(fields.get('fps'))
+            self._speed = _to_float(fields.get('speed'))
+        return ProgressEvent(
+            out_time=self._out_time,
+            duration=self.duration,
+            fps=self._fps,
+            speed=self._speed,
+            total_size=self._total_size,
+            frame=int(_to_float(fields.get('frame'))),
+            done=done,
+        )
@@ -0,0 +1,29 @@
+import re
+
+from .runner import run_capture
+
+# -------------------------- قياس جودة الناتج --------------------------
+# مقارنة ملف مضغوط بمصدره بمقياس SSIM (0-1) أو VMAF (0-100) عبر فلاتر FFmpeg، والدرجة تُقرأ
+# من سطر الملخص الذي يكتبه الفلتر في stderr. يستخدمها سلم الدقة وأداة القياس benchmarks.
+
+METRIC_FILTERS = {'ssim': "ssim", 'vmaf': "libvmaf=n_threads=4"}
+METRIC_PATTERNS = {'ssim': r"SSIM .*All:([\d.]+)", 'vmaf': r"VMAF score:\s*([\d.]+)"}
+
+
+def quality_score(distorted_path, reference_path, metric='ssim', start=None, seconds=None, size=None):
+    """
+    درجة جودة distorted_path مقابل reference_path. start/seconds يقصّان نفس المقطع من المرجع
+    (لقياس عينة)، وsize=(العرض، الارتفاع) يعيد تحجيم الملف المقاس لأبعاد المرجع قبل المقارنة.
+    يرفع FFmpegError إذا فشل الأمر (مثل libvmaf غير متوفر)، وValueError إذا لم تظهر الدرجة.
+    """
+    reference_input = ["-ss", f"{start:.3f}", "-t", f"{seconds:.3f}"] if start is not None else []
+    scale = f"scale={size[0]}:{size[1]}:flags=bicubic," if size else ""
+    run = run_capture([
+        "ffmpeg", "-hide_banner", "-i", distorted_path, *reference_input, "-i", reference_path,
+        "-lavfi", f"[0:v]{scale}setsar=1[d];[1:v]setsar=1[r];[d][r]{METRIC_FILTERS[metric]}",
+        "-f", "null", "-",
+    ])
+    match = re.search(METRIC_PATTERNS[metric], run.stderr_tail)
+    if not match:
+        raise ValueError(f"{metric} score not found in FFmpeg output")
+    return float(match.group(1))
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import replace
+
+from config import RESOLUTION_LADDER, RESOLUTION_LADDER_METRIC
+
+from .commands import build_scale_args, target_video_bitrate
+from .crf_predictor import SAMPLE_COUNT, SAMPLE_SECONDS, sample_positions
+from .probe import probe_media
+from .progress import ProgressEvent
+from .quality import quality_score
+from .runner import run_ffmpeg
+
+# -------------------------- اختيار الدقة حسب المحتوى للحجم المستهدف --------------------------
+# الحجم المستهدف يحدد معدل البت، لكن أفضل دقة لهذا المعدل تختلف من مقطع لآخر: 1080p بمعدل منخفض
+# يصبح مربعات، بينما 540p بنفس المعدل أنظف. نرمّز عينات قصيرة من الملف بمعدل البت المطلوب لكل دقة
+# مرشحة، ونقيس جودتها بعد إعادة تكبيرها لأبعاد المصدر (SSIM أو VMAF)، ونختار الأعلى جودة.
+# التصغير يتم في نفس عملية الترميز، فيصبح الترميز أسرع أيضاً عند الأحجام الصغيرة.
+
+SAMPLE_PRESETS = {'libx264': "veryfast", 'libx265': "veryfast"}  # العينات للمقارنة فقط، فالأسرع يكفي
+
+
+def candidate_resolutions(width, height, ladder=RESOLUTION_LADDER):
+    """درجات السلم التي لا تكبّر المصدر، مع دقة المصدر نفسها (None) كمرشح دائماً."""
+    short_side = min(width, height)
+    return [None] + [side for side in sorted(ladder, reverse=True) if side < short_side]
+
+
+def _sample_score(job, resolution, start, seconds, size, metric, work_dir):
+    """ترميز عينة بمعدل البت المستهدف ودقة معينة، ثم قياس جودتها مقابل نفس المقطع من المصدر."""
+    bitrate_k = target_video_bitrate(job)
+    sample_path = os.path.join(work_dir, f"sample_{resolution or 'src'}_{int(start * 1000)}.mp4")
+    scaled = replace(job, resolution=resolution)
+    run_ffmpeg([
+        "ffmpeg", "-y", "-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", job.input_path,
+        "-c:v", job.encoder, "-pix_fmt", job.pixel_format, *build_scale_args(scaled),
+        "-b:v", f"{bitrate_k}k", "-maxrate", f"{bitrate_k}k", "-bufsize", f"{bitrate_k * 2}k",
+        "-preset", SAMPLE_PRESETS.get(job.encoder, job.preset or "fast"), "-an", "-map_metadata", "-1", sample_path,
+    ])
+    try:
+        return quality_score(sample_path, job.input_path, metric, start=start, seconds=seconds, size=size)
+    except ValueError:
+        return None
+    finally:
+        os.remove(sample_path)
+
+
+def choose_resolution(job, on_progress=None, ladder=RESOLUTION_LADDER, metric=RESOLUTION_LADDER_METRIC):
+    """
+    الضلع الأقصر الأفضل للناتج عند معدل البت المستهدف، أو None للإبقاء على أبعاد المصدر.
+    عند تساوي الجودة تُفضل الدقة الأصغر (ترميز أسرع). أي فشل يبقي أبعاد المصدر.
+    on_progress يستقبل ProgressEvent بمرحلة 'resolution' بعد كل عينة (out_time/duration = العينات المنجزة/الكلية).
+    """
+    thread_name = threading.current_thread().name
+    try:
+        info = probe_media(job.input_path)
+    except Exception as e:
+        print(f"[{thread_name}][Ladder] Probe failed, keeping source resolution: {e}")
+        return None
+    width, height = info.display_size
+    duration = job.duration or info.duration
+    candidates = candidate_resolutions(width, height, ladder)
+    if len(candidates) == 1 or duration <= 0:
+        return None
+
+    positions = sample_positions(duration, SAMPLE_COUNT, SAMPLE_SECONDS)
+    total_samples = len(candidates) * len(positions)
+    if on_progress:
+        on_progress(ProgressEvent(duration=total_samples, stage='resolution'))
+    work_dir = tempfile.mkdtemp(prefix="ladder_samples_", dir=os.path.dirname(os.path.abspath(job.output_path)))
+    best, best_score = None, None
+    try:
+        for index, resolution in enumerate(candidates):
+            scores = []
+            for start, seconds in positions:
+                scores.append(_sample_score(job, resolution, start, seconds, (width, height), metric, work_dir))
+                if on_progress:
+                    done_samples = index * len(positions) + len(scores)
+                    on_progress(ProgressEvent(out_time=done_samples, duration=total_samples, stage='resolution'))
+            if None in scores:
+                continue
+            score = sum(scores) / len(scores)
+            print(f"[{thread_name}][Ladder] {resolution or min(width, height)}p @ {target_video_bitrate(job)}k: {metric} {score:.4f}")
+            # المرشحون من الأكبر للأصغر، فـ >= يختار الأصغر عند التعادل
+            if best_score is None or score >= best_score:
+                best, best_score = resolution, score
+    except Exception as e:
+        print(f"[{thread_name}][Ladder] Sampling failed, keeping source resolution: {e}")
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"[{thread_name}][Ladder] Selected {best or min(width, height)}p for '{os.path.basename(job.input_path)}'")
+    return best
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+from config import RESULT_CACHE_MAX_ENTRIES
+
+# -------------------------- ذاكرة نتائج الضغط --------------------------
+# نفس المقطع المنتشر يُعاد توجيهه للبوت عشرات المرات. file_unique_id ثابت لنفس الملف على
+# تيليجرام مهما تغيرت الرسالة، فمع نفس إعدادات الترميز يكفي إعادة إرسال file_id الناتج
+# المرفوع سابقاً بدون تنزيل أو ترميز.
+# مربوطة حالياً في googlepro3 فقط: هو البوت الوحيد الذي يعرف إعدادات الترميز قبل التنزيل
+# ويرد بالناتج في نفس المحادثة. بقية البوتات تختار الجودة بعد التنزيل (فلا يوفر التطابق
+# التنزيل) أو تسلّم إلى قناة/ألبوم حيث لا يكفي إعادة إرسال file_id واحد.
+
+
+def media_unique_id(message):
+    """المعرف الثابت لملف الفيديو في الرسالة، أو None إذا لم تحتوِ على فيديو."""
+    media = message.video or message.animation or message.document
+    return media.file_unique_id if media else None
+
+
+def result_cache_key(file_unique_id, job):
+    """
+    مفتاح الذاكرة: معرف الملف + إعدادات الترميز المؤثرة في الناتج فقط
+    (بدون المسارات أو عدد الأجزاء أو الخيوط).
+    """
+    if job.mode == 'target_size':
+        quality = ('target_size', round(float(job.target_size_mb), 2))
+    elif job.mode == 'bitrate':
+        quality = ('bitrate', int(job.video_bitrate_k))
+    else:
+        quality = ('crf', int(job.quality_value))
+    return (
+        file_unique_id, job.encoder, quality, job.preset, job.profile, job.pixel_format, job.resolution, job.auto_resolution,
+        job.include_audio, job.audio_codec, job.audio_bitrate, job.audio_channels, job.audio_sample_rate,
+    )
+
+
+class ResultCache:
+    """ذاكرة LRU محدودة الحجم: مفتاح result_cache_key -> بيانات الناتج المرفوع (file_id والأحجام)."""
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, file_id, **info):
+        """تسجيل الناتج المرفوع؛ info بيانات إضافية للعرض مثل input_size/output_size."""
+        with self._lock:
+            self._entries[key] = dict(info, file_id=file_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """إزالة مدخل لم يعد صالحاً (مثلاً فشل إعادة إرسال file_id)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,293 @@
+import os
+import time
+import shlex
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass, replace
+
+from config import TARGET_SIZE_TOLERANCE, TARGET_SIZE_MAX_RETRIES
+
+from .commands import (
+    audio_stream_bytes, build_ffmpeg_command, parse_audio_bitrate_k, supports_analysis_pass, target_video_bitrate,
+)
+from .job import CompressionResult
+from .metrics import ACTIVE_ENCODES, record_encode
+from .progress import PROGRESS_ARGS, ProgressParser
+from .thumbnails import discard_thumbnails, finalize_thumbnail
+
+# -------------------------- تشغيل FFmpeg --------------------------
+# الأوامر قوائم وسائط (argv) تُشغّل مباشرة بدون /bin/sh، فلا حاجة لاقتباس أسماء الملفات.
+
+STDERR_TAIL_LINES = 30
+
+
+def format_command(args):
+    """تمثيل نصي للأمر صالح للنسخ إلى الطرفية (للسجلات ورسائل الخطأ فقط)."""
+    return shlex.join(args)
+
+
+@dataclass
+class ProcessRun:
+    """نتيجة تشغيل FFmpeg/FFprobe: رمز الخروج وآخر أسطر stderr والزمن المستغرق."""
+    args: list
+    returncode: int
+    stderr_tail: str
+    elapsed: float
+    stdout: str = ""
+
+    @property
+    def command(self):
+        return format_command(self.args)
+
+
+class FFmpegError(Exception):
+    """فشل عملية FFmpeg، مع آخر أسطر stderr لعرضها للمستخدم."""
+
+    def __init__(self, returncode, stderr_tail, command, elapsed=0):
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        self.command = command
+        self.elapsed = elapsed
+        super().__init__(f"FFmpeg exited with code {returncode}")
+
+
+def _drain_stderr(stream, tail):
+    for line in stream:
+        tail.append(line.rstrip())
+
+
+def _feed_stdin(stdin, chunks, errors):
+    """
+    كتابة chunks إلى stdin. هذا الخيط وحده يستهلك المُكرر، وحتى نهايته دائماً: إذا أغلق FFmpeg
+    الأنبوب مبكراً (أو قُتل) تُستهلك بقية الأجزاء بدون كتابة، فيكتمل ما يفعله المُكرر (مثل حفظ المصدر).
+    خطأ المُكرر نفسه (مثل انقطاع التنزيل) يُضاف إلى errors ليُرفع في خيط run_ffmpeg.
+    """
+    writable = True
+    try:
+        for chunk in chunks:
+            if not writable:
+                continue
+            try:
+                stdin.buffer.write(chunk)
+            except OSError:
+                writable = False  # سبب توقف FFmpeg (إن وجد) يظهر في رمز الخروج
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def run_ffmpeg(args, duration=0, on_progress=None, stdin_chunks=None):
+    """
+    تشغيل FFmpeg وتمرير ProgressEvent إلى on_progress(event) من مخرجات -progress.
+    stdin_chunks: مُكرر بايتات يُكتب إلى stdin (للإدخال "pipe:0") من خيط منفصل، ويُستهلك كاملاً
+    قبل أن ترجع الدالة أو ترفع خطأ، فلا يلمسه المستدعي بعدها.
+    ترجع ProcessRun، وترفع FFmpegError إذا انتهت العملية بخطأ.
+    """
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    start_time = time.time()
+    if on_progress:
+        args = args[:1] + PROGRESS_ARGS + args[1:]
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE if on_progress else None, stderr=subprocess.PIPE,
+        stdin=subprocess.PIPE if stdin_chunks is not None else None,
+        universal_newlines=True, encoding='utf-8', errors='replace',
+    )
+
+    stdin_writer = None
+    stdin_errors = []
+    if stdin_chunks is not None:
+        stdin_writer = threading.Thread(target=_feed_stdin, args=(process.stdin, stdin_chunks, stdin_errors), daemon=True)
+        stdin_writer.start()
+
+    try:
+        if on_progress:
+            # stderr يُقرأ في خيط منفصل حتى لا تمتلئ أنبوبته أثناء قراءة التقدم من stdout
+            stderr_reader = threading.Thread(target=_drain_stderr, args=(process.stderr, tail), daemon=True)
+            stderr_reader.start()
+            parser = ProgressParser(duration)
+            for line in process.stdout:
+                event = parser.feed(line)
+                if event is not None:
+                    on_progress(event)
+            stderr_reader.join()
+        else:
+            _drain_stderr(process.stderr, tail)
+    except BaseException:
+        # خطأ في on_progress (أو مقاطعة) لا يترك FFmpeg يعمل بلا أب ينتظره، ولا خيط كتابة
+        # ما زال يستهلك المدخل بعد أن يرجع الخطأ للمستدعي
+        process.kill()
+        process.wait()
+        if stdin_writer is not None:
+            stdin_writer.join()
+        raise
+
+    process.wait()
+    if stdin_writer is not None:
+        stdin_writer.join()
+    if stdin_errors:
+        # المدخل انقطع قبل نهايته؛ FFmpeg قد ينهي بنجاح على ملف ناقص فلا نعتبره ناتجاً صالحاً
+        raise stdin_errors[0]
+    run = ProcessRun(args, process.returncode, "\n".join(tail), time.time() - start_time)
+    if run.returncode != 0:
+        raise FFmpegError(run.returncode, run.stderr_tail, run.command, run.elapsed)
+    return run
+
+
+def run_capture(args):
+    """
+    تشغيل أمر بدون تقدم وانتظاره وجمع stdout كاملاً وآخر أسطر stderr في ProcessRun
+    (مثل مقارنة الجودة بـ FFmpeg). ترفع FFmpegError إذا انتهى الأمر بخطأ.
+    """
+    start_time = time.time()
+    result = subprocess.run(args, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    tail = "\n".join(result.stderr.splitlines()[-STDERR_TAIL_LINES:])
+    run = ProcessRun(args, result.returncode, tail, time.time() - start_time, result.stdout)
+    if run.returncode != 0:
+        raise FFmpegError(run.returncode, run.stderr_tail, run.command, run.elapsed)
+    return run
+
+
+def run_ffprobe(args):
+    """تشغيل FFprobe وجمع مخرجاته (JSON في stdout)."""
+    return run_capture(args)
+
+
+def compress(job, on_progress=None):
+    """تنفيذ مهمة الضغط وإرجاع CompressionResult (مع الصورة المصغرة إذا طُلبت)."""
+    if job.mode == 'target_size' and job.auto_resolution and not job.resolution:
+        from .resolution_ladder import choose_resolution
+        job.resolution = choose_resolution(job, on_progress)
+    ACTIVE_ENCODES.inc()
+    try:
+        result = _compress_job(job, on_progress)
+    finally:
+        ACTIVE_ENCODES.dec()
+    record_encode(result, job.duration)
+    return result
+
+
+def _compress_job(job, on_progress=None):
+    """compress بدون تسجيل المقاييس؛ أجزاء الترميز المتوازي تمر من هنا فلا تُحسب بايتاتها مرتين."""
+    try:
+        if job.segments > 1:
+            from .segments import compress_segmented
+            result = compress_segmented(job, on_progress)
+        elif job.mode == 'target_size' and job.two_pass:
+            result = compress_two_pass(job, on_progress)
+        else:
+            result = _compress_single(job, on_progress)
+    except BaseException:
+        discard_thumbnails(job.output_path)
+        raise
+    if job.thumbnail_count:
+        result.thumbnail_path = finalize_thumbnail(job)
+    return result
+
+
+def _compress_single(job, on_progress=None):
+    thread_name = threading.current_thread().name
+    command = build_ffmpeg_command(job)
+    print(f"[{thread_name}][FFmpeg] Executing command for '{os.path.basename(job.input_path)}':\n{format_command(command)}")
+
+    start_time = time.time()
+    run_ffmpeg(command, job.duration, on_progress)
+    if not os.path.exists(job.output_path):
+        raise FileNotFoundError(f"Compressed file {job.output_path} not found after FFmpeg completion.")
+
+    result = CompressionResult.from_files(job, format_command(command), time.time() - start_time)
+    print(f"[{thread_name}] Compression Done! New Size: {result.output_size_mb:.2f} MB ({result.elapsed:.1f}s)")
+    return result
+
+
+def _scaled_progress(on_progress, offset, scale):
+    """تحويل تقدم تمريرة واحدة إلى جزء من شريط التقدم الكلي للمهمة."""
+    if not on_progress:
+        return None
+    return lambda event: on_progress(replace(
+        event, out_time=offset * event.duration + event.out_time * scale, done=False,
+    ))
+
+
+def _corrected_bitrate(job, bitrate_k, output_size):
+    """تصحيح معدل بت الفيديو بنسبة الخطأ بين الحجم الفعلي والمستهدف (بعد طرح حصة الصوت)."""
+    audio_bytes = audio_stream_bytes(parse_audio_bitrate_k(job.audio_bitrate), job.duration) if job.include_audio else 0
+    target_bytes = job.target_size_mb * 1024 * 1024
+    video_target = max(1, target_bytes - audio_bytes)
+    video_actual = max(1, output_size - audio_bytes)
+    return max(50, int(bitrate_k * video_target / video_actual))
+
+
+def compress_two_pass(job, on_progress=None, tolerance=TARGET_SIZE_TOLERANCE, max_retries=TARGET_SIZE_MAX_RETRIES):
+    """
+    نمط الحجم المستهدف بتمريرتين: تحليل ثم ترميز، ثم فحص الحجم الناتج.
+    يُعاد الترميز (التمريرة الثانية فقط) بمعدل بت مصحح إذا تجاوز الخطأ نسبة tolerance.
+    """
+    thread_name = threading.current_thread().name
+    passlog = job.output_path + "_2pass"
+    target_bytes = job.target_size_mb * 1024 * 1024
+    bitrate_k = target_video_bitrate(job)
+    passes = 0
+    start_time = time.time()
+
+    try:
+        analysis = supports_analysis_pass(job.encoder)
+        if analysis:
+            command = build_ffmpeg_command(job, pass_number=1, passlog=passlog)
+            print(f"[{thread_name}][FFmpeg] Analysis pass for '{os.path.basename(job.input_path)}':\n{format_command(command)}")
+            run_ffmpeg(command, job.duration, _scaled_progress(on_progress, 0, 0.5))
+            passes += 1
+
+        for attempt in range(max_retries + 1):
+            job.video_bitrate_k = bitrate_k
+            command = build_ffmpeg_command(job, pass_number=2, passlog=passlog)
+            print(f"[{thread_name}][FFmpeg] Encode pass (attempt {attempt + 1}, {bitrate_k}k):\n{format_command(command)}")
+            if analysis and attempt == 0:
+                encode_progress = _scaled_progress(on_progress, 0.5, 0.5)
+            elif attempt > 0 and on_progress:
+                # إعادة الترميز تبدأ الشريط من جديد، فرقم المحاولة يوضح للمستخدم أنها ليست نفس التمريرة
+                encode_progress = lambda event, number=attempt + 1: on_progress(replace(event, attempt=number))
+            else:
+                encode_progress = on_progress
+            run_ffmpeg(command, job.duration, encode_progress)
+            passes += 1
+
+            if not os.path.exists(job.output_path):
+                raise FileNotFoundError(f"Compressed file {job.output_path} not found after FFmpeg completion.")
+            output_size = os.path.getsize(job.output_path)
+            error = (output_size / target_bytes) - 1
+            print(f"[{thread_name}] Size check: {output_size/(1024*1024):.2f} MB vs target {job.target_size_mb:.2f} MB ({error*100:+.1f}%)")
+            if abs(error) <= tolerance:
+                break
+            corrected_k = _corrected_bitrate(job, bitrate_k, output_size)
+            if corrected_k == bitrate_k:
+                # التصحيح وصل للحد الأدنى لمعدل البت؛ إعادة الترميز ستنتج نفس الملف
+                print(f"[{thread_name}] Target size unreachable: bitrate already at {bitrate_k}k, keeping this output.")
+                break
+            bitrate_k = corrected_k
+    finally:
+        for suffix in ("-0.log", "-0.log.mbtree", ".log", ".log.cutree", ".log.temp", ".log.cutree.temp"):
+            if os.path.exists(passlog + suffix):
+                os.remove(passlog + suffix)
+
+    result = CompressionResult.from_files(job, format_command(command), time.time() - start_time, passes)
+    print(f"[{thread_name}] Compression Done! New Size: {result.output_size_mb:.2f} MB ({result.elapsed:.1f}s, {passes} passes)")
+    return result
+
+
+def process_job(job, sink, on_progress=None):
+    """المسار الكامل: ضغط ثم تسليم الناتج إلى وجهة الإخراج (Sink)."""
+    if sink is None:
+        return compress(job, on_progress)
+    sink.prepare(job)
+    try:
+        result = compress(job, on_progress)
+    except BaseException:
+        sink.cancel()
+        raise
+    sink.deliver(result)
+    return result
@@ -0,0 +1,373 @@
+import os
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import (
+    CPU_ENCODER_MAX_JOBS, NVENC_MAX_SESSIONS, CPU_LOAD_HIGH_WATERMARK, LOAD_RECHECK_SECONDS,
+    USER_MAX_CONCURRENT_JOBS, SHORT_CLIP_PRIORITY_SECONDS,
+    SCHEDULING_POLICY, SJF_AGING_FACTOR, ENCODER_COST_FACTORS, DOWNLOAD_BYTES_PER_SECOND,
+)
+
+from .metrics import QUEUE_DEPTH, POOL_WAIT_SECONDS, POOL_RUN_SECONDS
+from .preset_policy import PresetPolicy
+from .probe import get_telegram_duration
+
+# -------------------------- جدولة مهام الضغط --------------------------
+# طابور وسعة منفصلان لكل فئة مرمز: مرمزات المعالج (libx264/libx265) محدودة بعدد الأنوية
+# والحمل الفعلي للجهاز، ومرمزات NVENC محدودة بعدد جلسات الترميز التي تسمح بها كرت الشاشة.
+# داخل كل مجمع يتناوب المستخدمون على الدور، فمن يرسل 50 فيديو لا يحجز الطابور عن الآخرين.
+# مع SCHEDULING_POLICY = "sjf" تُقدم المهام الأقل عملاً مقدراً، مع تقادم يمنع تجويع الطويلة.
+
+WAIT_SAMPLES = 100
+DEFAULT_RUN_SECONDS = 120  # تقدير مدة المهمة قبل توفر قياسات فعلية
+
+
+def encoder_class(encoder):
+    """فئة المرمز التي تحدد أي مجمع عمال يُنفذ المهمة."""
+    return 'nvenc' if "nvenc" in encoder else 'cpu'
+
+
+def estimate_work(duration, width=0, height=0, encoder='h264_nvenc'):
+    """
+    تقدير زمن الترميز بالثواني: المدة × نسبة البكسلات إلى 1080p × معامل كلفة المرمز.
+    الأبعاد المجهولة تُعامل كـ 1080p.
+    """
+    pixels_ratio = (width * height) / (1920 * 1080) if width and height else 1.0
+    return max(0.0, duration) * pixels_ratio * ENCODER_COST_FACTORS.get(encoder, 1.0)
+
+
+def estimate_message_work(message, encoder):
+    """تقدير عمل الضغط من بيانات رسالة تيليجرام قبل تنزيل الملف."""
+    media = message.video or message.animation
+    if media is None:
+        return None
+    return estimate_work(media.duration or 0, media.width or 0, media.height or 0, encoder)
+
+
+def estimate_download_work(message):
+    """تقدير زمن التنزيل بالثواني من حجم الملف المعلن في الرسالة."""
+    media = message.video or message.animation or message.document
+    if media is None or not media.file_size:
+        return None
+    return media.file_size / DOWNLOAD_BYTES_PER_SECOND
+
+
+def stream_keeps_encoder_busy(message, encoder):
+    """
+    الترميز أثناء التنزيل يحجز خانة الضغط طوال مدة التنزيل، فيستحق ذلك فقط إذا كان التنزيل المقدر
+    لا يتجاوز زمن الترميز المقدر: عندها تنشغل الخانة بالترميز لا بانتظار الشبكة.
+    """
+    download = estimate_download_work(message)
+    encode = estimate_message_work(message, encoder)
+    return download is not None and encode is not None and download <= encode
+
+
+_pools = []  # كل المجمعات المنشأة في العملية، لمقياس طول الطابور
+_current_task = threading.local()
+
+
+def current_task_wait():
+    """زمن انتظار المهمة التي ينفذها الخيط الحالي في طابور مجمعها (0 خارج عمال المجمعات)."""
+    return getattr(_current_task, 'wait', 0.0)
+
+
+def _queue_depths():
+    return {(pool.name,): pool.stats()['queued'] for pool in list(_pools)}
+
+
+QUEUE_DEPTH.set_function(_queue_depths)
+
+
+def _load_average():
+    try:
+        return os.getloadavg()[0]
+    except (OSError, AttributeError):  # غير متوفر على ويندوز
+        return 0.0
+
+
+class _QueuedTask:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'enqueued_at', 'user_id', 'duration', 'cost')
+
+    def __init__(self, fn, args, kwargs, user_id, duration, cost):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.time()
+        self.user_id = user_id
+        self.duration = duration
+        self.cost = cost if cost is not None else (duration if duration > 0 else DEFAULT_RUN_SECONDS)
+
+    @property
+    def is_short(self):
+        return 0 < self.duration <= SHORT_CLIP_PRIORITY_SECONDS
+
+    def score(self, now):
+        """أولوية SJF: العمل المقدر ناقص تعويض الانتظار (الأصغر يُنفذ أولاً)."""
+        return self.cost - SJF_AGING_FACTOR * (now - self.enqueued_at)
+
+
+def _pick_shortest(user_queues, eligible, now):
+    """اختيار المهمة ذات أقل عمل مقدر (بعد التقادم) من بين كل مهام المستخدمين المسموح لهم."""
+    user_id, task = min(
+        ((user_id, task) for user_id in eligible for task in user_queues[user_id]),
+        key=lambda item: item[1].score(now),
+    )
+    tasks = user_queues[user_id]
+    tasks.remove(task)
+    if not tasks:
+        del user_queues[user_id]
+    return task
+
+
+def _pick(user_queues, user_running=None, now=None, user_limit=USER_MAX_CONCURRENT_JOBS):
+    """
+    اختيار المهمة التالية بالتناوب بين المستخدمين (round-robin)، مع تقديم المستخدمين الذين
+    مهمتهم التالية مقطع قصير، أو حسب أقل عمل مقدر إذا كانت السياسة "sjf".
+    حد التوازي لكل مستخدم يُطبق فقط إذا انتظر مستخدمون آخرون دون الحد؛ إذا لم ينتظر غير من بلغوا
+    حدهم تُستخدم الخانات الفارغة لمهامهم بدل تركها معطلة.
+    user_running=None أو user_limit=None يتجاهل حد التوازي لكل مستخدم (للمحاكاة أو لمجمع بلا حد).
+    """
+    waiting = [user_id for user_id, tasks in user_queues.items() if tasks]
+    if not waiting:
+        return None
+    eligible = [
+        user_id for user_id in waiting
+        if user_running is None or user_limit is None or user_id is None or user_running.get(user_id, 0) < user_limit
+    ] or waiting
+    if SCHEDULING_POLICY == 'sjf':
+        return _pick_shortest(user_queues, eligible, now if now is not None else time.time())
+
+    short_first = [user_id for user_id in eligible if user_queues[user_id][0].is_short]
+    user_id = (short_first or eligible)[0]
+
+    tasks = user_queues[user_id]
+    task = tasks.popleft()
+    if tasks:
+        user_queues.move_to_end(user_id)  # المستخدم ينتقل لآخر الدور
+    else:
+        del user_queues[user_id]
+    return task
+
+
+class WorkerPool:
+    """
+    مجمع عمال (لفئة مرمز واحدة أو للتنزيل) بطابور عادل بين المستخدمين. load_aware=True يمنع بدء مهمة
+    جديدة إذا تجاوز متوسط حمل الجهاز (عدد الأنوية × CPU_LOAD_HIGH_WATERMARK)، مع السماح
+    دائماً بمهمة واحدة على الأقل. user_max_jobs حد المهام المتوازية لكل مستخدم (None = بلا حد،
+    ويبقى ترتيب الطابور بالتناوب بين المستخدمين).
+    """
+
+    def __init__(self, name, max_workers, load_aware=False, user_max_jobs=USER_MAX_CONCURRENT_JOBS):
+        self.name = name
+        self.max_workers = max_workers
+        self.load_aware = load_aware
+        self.user_max_jobs = user_max_jobs
+        self.running = 0
+        self._user_queues = OrderedDict()  # user_id -> deque من المهام، بترتيب الدور
+        self._user_running = {}
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._run_times = deque(maxlen=WAIT_SAMPLES)
+        _pools.append(self)
+        for index in range(max_workers):
+            threading.Thread(target=self._worker, name=f"{name}-worker-{index}", daemon=True).start()
+
+    def submit(self, fn, *args, user_id=None, duration=0, cost=None, **kwargs):
+        """
+        بديل متوافق مع Executor.submit؛ user_id/duration/cost بيانات جدولة فقط ولا تُمرر لـ fn.
+        cost هو العمل المقدر بالثواني (لسياسة sjf)، وإذا تُرك فارغاً تُستخدم المدة.
+        """
+        task = _QueuedTask(fn, args, kwargs, user_id, duration, cost)
+        with self._cond:
+            tasks = self._user_queues.setdefault(user_id, deque())
+            if task.is_short:
+                # المقاطع القصيرة تتقدم على ملفات نفس المستخدم الطويلة (مع الحفاظ على ترتيبها فيما بينها)
+                index = next((i for i, queued in enumerate(tasks) if not queued.is_short), len(tasks))
+                tasks.insert(index, task)
+            else:
+                tasks.append(task)
+            self._cond.notify()
+        return task.future
+
+    def _may_start(self):
+        if self.running >= self.max_workers:
+            return False
+        if not self.load_aware or self.running == 0:
+            return True
+        return _load_average() < (os.cpu_count() or 1) * CPU_LOAD_HIGH_WATERMARK
+
+    def _queued_count(self):
+        return sum(len(tasks) for tasks in self._user_queues.values())
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = None
+                while task is None:
+                    if self._may_start():
+                        task = _pick(self._user_queues, self._user_running, user_limit=self.user_max_jobs)
+                    if task is None:
+                        # عند الانتظار بسبب الحمل نعيد الفحص دورياً لأن متوسط الحمل لا يرسل إشعاراً
+                        self._cond.wait(timeout=LOAD_RECHECK_SECONDS if self._user_queues else None)
+                self.running += 1
+                self._user_running[task.user_id] = self._user_running.get(task.user_id, 0) + 1
+                wait = time.time() - task.enqueued_at
+                self._waits.append(wait)
+            POOL_WAIT_SECONDS.observe(wait, pool=self.name)
+            _current_task.wait = wait
+
+            start_time = time.time()
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.fn(*task.args, **task.kwargs))
+                    except BaseException as e:
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    self._user_running[task.user_id] -= 1
+                    if not self._user_running[task.user_id]:
+                        del self._user_running[task.user_id]
+                    run_time = time.time() - start_time
+                    self._run_times.append(run_time)
+                    self._cond.notify_all()
+                POOL_RUN_SECONDS.observe(run_time, pool=self.name)
+
+    def position(self, future):
+        """
+        ترتيب المهمة في الطابور (1 = التالية) والوقت المتوقع لبدئها بالثواني،
+        بمحاكاة نفس قاعدة الاختيار على نسخة من الطوابير. (None, None) إذا لم تعد منتظرة.
+        """
+        with self._cond:
+            queues = OrderedDict((user_id, deque(tasks)) for user_id, tasks in self._user_queues.items())
+            run_times = list(self._run_times)
+        now = time.time()
+        position = 0
+        while queues:
+            position += 1
+            if _pick(queues, now=now).future is future:
+                average_run = sum(run_times) / len(run_times) if run_times else DEFAULT_RUN_SECONDS
+                # كل دفعة من max_workers مهام تستغرق متوسط زمن مهمة واحدة
+                eta = ((position - 1) // self.max_workers + (1 if self.running >= self.max_workers else 0)) * average_run
+                return position, eta
+        return None, None
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            waits = list(self._waits)
+            oldest = max(
+                (now - task.enqueued_at for tasks in self._user_queues.values() for task in tasks),
+                default=0.0,
+            )
+            return {
+                'queued': self._queued_count(),
+                'running': self.running,
+                'max_workers': self.max_workers,
+                'users_waiting': len(self._user_queues),
+                'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait': max(waits, default=0.0),
+                'oldest_waiting': oldest,
+            }
+
+
+class CompressionScheduler:
+    """واجهة بديلة لـ compression_executor توزع المهام على المجمع المناسب لنوع المرمز."""
+
+    def __init__(self, cpu_jobs=CPU_ENCODER_MAX_JOBS, nvenc_sessions=NVENC_MAX_SESSIONS, preset_policy=None):
+        if cpu_jobs is None:
+            # ترميز libx264 واحد يستهلك عدة أنوية، فلا فائدة من مهام أكثر من ربع عدد الأنوية
+            cpu_jobs = max(1, (os.cpu_count() or 1) // 4)
+        self.pools = {
+            'cpu': WorkerPool('cpu', cpu_jobs, load_aware=True),
+            'nvenc': WorkerPool('nvenc', nvenc_sessions),
+        }
+        self.preset_policy = preset_policy or PresetPolicy()
+
+    def submit(self, fn, *args, encoder='h264_nvenc', user_id=None, duration=0, cost=None):
+        return self.pools[encoder_class(encoder)].submit(fn, *args, user_id=user_id, duration=duration, cost=cost)
+
+    def submit_video(self, fn, video_data, encoder, client=None):
+        """
+        إرسال مهمة فيديو من رسالة تيليجرام: المستخدم والمدة والعمل المقدر تُؤخذ من video_data.
+        مع client يُعرض ترتيب المهمة والوقت المتوقع لبدئها على رسالة الأزرار أو رسالة الحالة.
+        """
+        message = video_data['message']
+        future = self.submit(
+            fn, video_data,
+            encoder=encoder,
+            user_id=video_data['user_id'],
+            duration=get_telegram_duration(message),
+            cost=estimate_message_work(message, encoder),
+        )
+        if client is not None:
+            self._show_queue_position(client, video_data, future)
+        return future
+
+    def video_submitter(self, fn, settings_getter, client=None):
+        """
+        دالة enqueue(video_data) جاهزة للبوت: ترسل fn بمجمع مرمز المستخدم كما في إعداداته
+        (settings_getter(user_id)['encoder']) وتعرض ترتيب المهمة عبر client.
+        """
+        def enqueue(video_data):
+            encoder = settings_getter(video_data['user_id'])['encoder']
+            return self.submit_video(fn, video_data, encoder, client=client)
+        return enqueue
+
+    def choose_preset(self, job, message=None):
+        """
+        اختيار preset لمهمة CRF حسب هدف زمن الاستجابة، من داخل خيط عامل الضغط: انتظار المهمة
+        الحالية في الطابور وعدد المنتظرين خلفها. الأبعاد تُؤخذ من رسالة تيليجرام إن مُررت.
+        مهام الحجم المستهدف ومعدل البت، والمهام ذات الـ preset المحدد مسبقاً، لا تتغير.
+        """
+        if job.mode != 'crf' or job.preset:
+            return job.preset
+        stats = self.pools[encoder_class(job.encoder)].stats()
+        media = (message.video or message.animation) if message is not None else None
+        job.preset, estimate = self.preset_policy.choose(
+            job.encoder, job.quality_value, job.duration / max(1, job.segments),  # الأجزاء تُرمز بالتوازي
+            pixels=(media.width or 0) * (media.height or 0) if media else 0,
+            waited=current_task_wait(), queued=stats['queued'], workers=stats['max_workers'],
+        )
+        if estimate is not None:
+            print(f"[{threading.current_thread().name}] Preset policy: {job.preset} (~{estimate:.0f}s encode, {stats['queued']} queued)")
+        return job.preset
+
+    def _show_queue_position(self, client, video_data, future):
+        position, eta = self.queue_position(future)
+        if not position:
+            return
+        eta_text = f"~{int(eta // 60)} دقيقة" if eta >= 60 else "أقل من دقيقة"
+        status_text = f"⏳ تم وضعه بطابور المعالجة (الترتيب: {position} | البدء خلال: {eta_text})"
+        chat_id = video_data['message'].chat.id
+        try:
+            if video_data.get('button_message_id'):
+                client.edit_message_reply_markup(
+                    chat_id=chat_id, message_id=video_data['button_message_id'],
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(status_text, callback_data="none")]]))
+            elif video_data.get('auto_compress_status_message_id'):
+                client.edit_message_text(chat_id=chat_id, message_id=video_data['auto_compress_status_message_id'], text=status_text)
+        except Exception:
+            pass  # الرسالة حُذفت أو لم يتغير نصها؛ الترتيب معلومة إضافية فقط
+
+    def queue_position(self, future):
+        """(الترتيب، الوقت المتوقع للبدء بالثواني) لمهمة منتظرة، أو (None, None)."""
+        for pool in self.pools.values():
+            position, eta = pool.position(future)
+            if position is not None:
+                return position, eta
+        return None, None
+
+    def queue_depth(self, encoder=None):
+        if encoder is not None:
+            return self.pools[encoder_class(encoder)].stats()['queued']
+        return sum(pool.stats()['queued'] for pool in self.pools.values())
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
@@ -0,0 +1,157 @@
+import os
+import csv
+import time
+import shutil
+import tempfile
+import threading
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SEGMENT_PARALLEL_MIN_DURATION, SEGMENT_PARALLEL_MAX_CHUNKS
+
+from .commands import audio_stream_bytes, build_movflags_args, parse_audio_bitrate_k
+from .job import CompressionResult
+from .progress import ProgressEvent
+from .runner import FFmpegError, format_command, run_ffmpeg, _compress_job
+from .thumbnails import adopt_thumbnails
+
+# -------------------------- الترميز المتوازي على أجزاء --------------------------
+# يُقسم الفيديو عند الإطارات المفتاحية (بدون إعادة ترميز)، ثم تُرمّز الأجزاء بعمليات FFmpeg
+# متوازية، ويُرمّز الصوت مرة واحدة من المصدر، وتُدمج النتيجة بـ concat demuxer بدون فقد.
+
+
+def plan_segments(duration, encoder):
+    """عدد الأجزاء المناسب للمهمة؛ 1 يعني ترميزاً عادياً بعملية واحدة."""
+    if "nvenc" in encoder or duration < SEGMENT_PARALLEL_MIN_DURATION:
+        return 1
+    return max(1, min(SEGMENT_PARALLEL_MAX_CHUNKS, os.cpu_count() or 1))
+
+
+def split_at_keyframes(input_path, segments, duration, work_dir):
+    """
+    تقسيم مسار الفيديو إلى أجزاء بنسخ مباشر (-c copy)؛ مقسم segment يقطع عند أول إطار مفتاحي
+    بعد كل حد زمني. يرجع قائمة (مسار الجزء، مدته).
+    """
+    segment_list = os.path.join(work_dir, "segments.csv")
+    run_ffmpeg([
+        "ffmpeg", "-y", "-i", input_path, "-map", "0:v:0", "-c", "copy", "-f", "segment",
+        "-segment_time", f"{duration / segments:.3f}", "-reset_timestamps", "1",
+        "-segment_list", segment_list, "-segment_list_type", "csv",
+        os.path.join(work_dir, "chunk_%03d.mkv"),
+    ])
+
+    chunks = []
+    with open(segment_list, newline='') as f:
+        for name, start, end in csv.reader(f):
+            chunks.append((os.path.join(work_dir, name), float(end) - float(start)))
+    return chunks
+
+
+def _chunk_job(job, index, chunk_path, chunk_duration, output_path, video_budget_mb, threads):
+    """
+    مهمة ترميز جزء واحد (فيديو فقط) بنفس إعدادات المهمة الأصلية.
+    أول thumbnail_count جزء يستخرج كل منها صورة مرشحة واحدة، فتتوزع المرشحات على المقطع.
+    """
+    chunk_job = replace(
+        job, input_path=chunk_path, output_path=output_path, duration=chunk_duration,
+        segments=1, include_audio=False, faststart=False, fragmented=False, threads=threads,
+        thumbnail_count=1 if index < job.thumbnail_count else 0,
+    )
+    if job.mode == 'target_size':
+        # حصة الجزء من ميزانية الفيديو تتناسب مع مدته
+        chunk_job.target_size_mb = video_budget_mb * chunk_duration / job.duration
+        chunk_job.video_bitrate_k = None
+    return chunk_job
+
+
+def _encode_audio(job, output_path):
+    """ترميز الصوت مرة واحدة من الملف الأصلي؛ يرجع None إذا لم يكن هناك صوت."""
+    try:
+        run_ffmpeg([
+            "ffmpeg", "-y", "-i", job.input_path, "-vn", "-map", "0:a:0",
+            "-c:a", job.audio_codec, "-b:a", job.audio_bitrate,
+            "-ac", str(job.audio_channels), "-ar", str(job.audio_sample_rate), output_path,
+        ])
+    except FFmpegError as e:
+        print(f"[{threading.current_thread().name}][Segments] No audio track encoded: {e}")
+        return None
+    return output_path
+
+
+def _concat_list_entry(path):
+    escaped = path.replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def compress_segmented(job, on_progress=None):
+    """ترميز المهمة على أجزاء متوازية ثم دمجها في ملف الناتج."""
+    thread_name = threading.current_thread().name
+    start_time = time.time()
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(os.path.abspath(job.output_path)))
+
+    try:
+        chunks = split_at_keyframes(job.input_path, job.segments, job.duration, work_dir)
+        print(f"[{thread_name}][Segments] Split '{os.path.basename(job.input_path)}' into {len(chunks)} chunks.")
+
+        audio_mb = audio_stream_bytes(parse_audio_bitrate_k(job.audio_bitrate), job.duration) / (1024 * 1024)
+        video_budget_mb = max(0.1, (job.target_size_mb or 0) - audio_mb)
+        threads = max(1, (os.cpu_count() or 1) // len(chunks))
+        chunk_jobs = [
+            _chunk_job(job, index, path, seconds, os.path.join(work_dir, f"encoded_{index:03d}.mkv"), video_budget_mb, threads)
+            for index, (path, seconds) in enumerate(chunks)
+        ]
+
+        # تجميع تقدم الأجزاء في شريط تقدم واحد للملف كاملاً
+        chunk_events = [None] * len(chunk_jobs)
+        progress_lock = threading.Lock()
+
+        def chunk_progress_callback(index):
+            def callback(event):
+                with progress_lock:
+                    chunk_events[index] = event
+                    events = [e for e in chunk_events if e is not None]
+                # الزمن والحجم تراكميان، والسرعة مجموع سرعات العمليات المتوازية
+                on_progress(ProgressEvent(
+                    out_time=sum(min(e.out_time, e.duration) for e in events),
+                    duration=job.duration,
+                    fps=sum(e.fps for e in events if not e.done),
+                    speed=sum(e.speed for e in events if not e.done),
+                    total_size=sum(e.total_size for e in events),
+                    frame=sum(e.frame for e in events),
+                ))
+            return callback if on_progress else None
+
+        # كل مهمة في المجمع تشرف على عملية FFmpeg مستقلة، فالترميز الفعلي يتوزع على الأنوية
+        with ThreadPoolExecutor(max_workers=len(chunk_jobs) + 1, thread_name_prefix=f"{thread_name}-seg") as pool:
+            audio_future = None
+            if job.include_audio:
+                audio_future = pool.submit(_encode_audio, job, os.path.join(work_dir, "audio.m4a"))
+            futures = [pool.submit(_compress_job, chunk_job, chunk_progress_callback(i)) for i, chunk_job in enumerate(chunk_jobs)]
+            chunk_results = [future.result() for future in futures]
+            audio_path = audio_future.result() if audio_future else None
+
+        for chunk_result in chunk_results:
+            if chunk_result.thumbnail_path:
+                adopt_thumbnails(chunk_result.thumbnail_path, job.output_path)
+
+        concat_list = os.path.join(work_dir, "concat.txt")
+        with open(concat_list, "w") as f:
+            f.writelines(_concat_list_entry(result.output_path) for result in chunk_results)
+
+        command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+        if audio_path:
+            command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+        command += ["-c", "copy", "-map_metadata", "-1"] + build_movflags_args(job)
+        command.append(job.output_path)
+        print(f"[{thread_name}][FFmpeg] Concatenating {len(chunk_results)} chunks:\n{format_command(command)}")
+        run_ffmpeg(command)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not os.path.exists(job.output_path):
+        raise FileNotFoundError(f"Compressed file {job.output_path} not found after FFmpeg completion.")
+
+    passes = max(result.passes for result in chunk_results)
+    result = CompressionResult.from_files(job, format_command(command), time.time() - start_time, passes)
+    print(f"[{thread_name}] Compression Done! New Size: {result.output_size_mb:.2f} MB ({result.elapsed:.1f}s, {len(chunk_results)} segments)")
+    return result
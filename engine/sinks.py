@@ -0,0 +1,260 @@
+import os
+import time
+import shutil
+import asyncio
+import threading
+from dataclasses import replace
+
+from pyrogram import raw, types, utils
+from pyrogram.enums import ChatType
+from pyrogram.errors import MessageEmpty, UserNotParticipant
+
+from .commands import scaled_size
+from .probe import get_video_info_and_thumb, probe_media, remember_media_info
+from .thumbnails import thumbnail_path
+from .upload import GrowingFileUploader
+
+# -------------------------- وجهات الإخراج (Sinks) --------------------------
+# كل وجهة تستلم CompressionResult وتقرر ما يحدث للملف المضغوط:
+# رفع لقناة، رد بمستند، رد بفيديو قابل للتشغيل، أو تجميعه في ألبوم.
+
+
+def _render(caption, result):
+    """التسمية التوضيحية قد تكون نصاً ثابتاً أو دالة تُبنى من النتيجة."""
+    return caption(result) if callable(caption) else caption
+
+
+def _output_media_info(result):
+    """
+    مدة وأبعاد الناتج من فحص المصدر المحفوظ مسبقاً (الترميز لا يغير المدة، ويطبق الدوران
+    على الأبعاد)، فلا حاجة لتشغيل ffprobe على الناتج. None إذا لم يعد المصدر متاحاً.
+    """
+    try:
+        source = probe_media(result.job.input_path)
+    except Exception:
+        return None
+    width, height = scaled_size(*source.display_size, result.job.resolution)
+    return replace(source, path=result.output_path, width=width, height=height, rotation=0)
+
+
+class OutputSink:
+    """الواجهة الأساسية لوجهات الإخراج."""
+
+    def prepare(self, job):
+        """تُستدعى قبل بدء الترميز (مثلاً لتعديل صيغة الناتج أو بدء الرفع مبكراً)."""
+
+    def cancel(self):
+        """تُستدعى إذا فشل الترميز قبل الوصول إلى deliver."""
+
+    def deliver(self, result):
+        """تسليم الناتج؛ وجهات الرفع ترجع رسالة تيليجرام المرسلة (لحفظ file_id)."""
+        raise NotImplementedError
+
+
+class ChannelDocumentSink(OutputSink):
+    """رفع الملف المضغوط كمستند إلى القناة ثم نسخ الرسالة الأصلية بعده."""
+
+    def __init__(self, client, channel_id, message, caption, original_caption=None, progress=None):
+        self.client = client
+        self.channel_id = channel_id
+        self.message = message
+        self.caption = caption
+        self.original_caption = original_caption
+        self.progress = progress
+
+    def deliver(self, result):
+        thread_name = threading.current_thread().name
+        sent = self.client.send_document(
+            chat_id=self.channel_id,
+            document=result.output_path,
+            progress=self.progress,
+            caption=_render(self.caption, result)
+        )
+        print(f"[{thread_name}] Compressed video uploaded to channel: {self.channel_id} for original message ID {self.message.id}.")
+
+        if self.original_caption is None:
+            return sent
+        try:
+            self.client.copy_message(
+                chat_id=self.channel_id,
+                from_chat_id=self.message.chat.id,
+                message_id=self.message.id,
+                caption=self.original_caption
+            )
+            print(f"[{thread_name}] Original video (ID: {self.message.id}) copied to channel: {self.channel_id}.")
+        except (MessageEmpty, UserNotParticipant) as e:
+            print(f"[{thread_name}] Warning: Could not copy original message {self.message.id} to channel {self.channel_id} due to: {e}.")
+        except Exception as e:
+            print(f"[{thread_name}] Error copying original video to channel: {e}")
+        return sent
+
+
+class ReplyDocumentSink(OutputSink):
+    """الرد على رسالة المستخدم بالملف المضغوط كمستند."""
+
+    def __init__(self, message, caption, progress=None, progress_args=()):
+        self.message = message
+        self.caption = caption
+        self.progress = progress
+        self.progress_args = progress_args
+
+    def deliver(self, result):
+        return self.message.reply_document(
+            document=result.output_path,
+            progress=self.progress,
+            progress_args=self.progress_args,
+            caption=_render(self.caption, result)
+        )
+
+
+class ReplyVideoSink(OutputSink):
+    """الرد بالملف كفيديو قابل للتشغيل المباشر (Streamable) مع صورة مصغرة وأبعاد."""
+
+    def __init__(self, message, caption, progress=None, progress_args=()):
+        self.message = message
+        self.caption = caption
+        self.progress = progress
+        self.progress_args = progress_args
+
+    def deliver(self, result):
+        thumb_path, vid_duration, vid_width, vid_height = get_video_info_and_thumb(result.output_path, _output_media_info(result))
+        try:
+            return self.message.reply_video(
+                video=result.output_path,
+                progress=self.progress,
+                progress_args=self.progress_args,
+                caption=_render(self.caption, result),
+                duration=int(vid_duration),
+                width=vid_width,
+                height=vid_height,
+                thumb=thumb_path,
+                supports_streaming=True
+            )
+        finally:
+            if thumb_path and os.path.exists(thumb_path):
+                os.remove(thumb_path)
+
+
+class StreamingVideoSink(ReplyVideoSink):
+    """
+    مثل ReplyVideoSink لكن الرفع يبدأ أثناء الترميز: prepare(job) يجعل الناتج MP4 مجزأ
+    (moov في البداية فيبقى قابلاً للتشغيل المتدفق) ويبدأ رفع الأجزاء المكتملة، وdeliver ترفع
+    ما تبقى وترسل الفيديو. الملفات الصغيرة أو فشل الرفع المسبق يرجعان لـ ReplyVideoSink.
+    """
+
+    def __init__(self, client, message, caption, progress=None, progress_args=()):
+        super().__init__(message, caption, progress, progress_args)
+        self.client = client
+        self.uploader = None
+
+    def prepare(self, job):
+        if job.mode == 'target_size' and job.two_pass:
+            return  # إعادة الترميز لضبط الحجم تكتب الناتج من جديد، فلا يُرفع قبل انتهائها
+        job.faststart = False
+        job.fragmented = True
+        self.uploader = GrowingFileUploader(self.client, job.output_path)
+        self.uploader.start()
+
+    def cancel(self):
+        if self.uploader is not None:
+            self.uploader.cancel()
+
+    def _run_async(self, coroutine):
+        # أدوات Pyrogram الداخلية (تحليل النص والرسائل) غير متزامنة؛ نشغلها على حلقة العميل كما تفعل الدوال المتزامنة
+        return asyncio.run_coroutine_threadsafe(coroutine, self.client.loop).result()
+
+    def _sent_message(self, updates):
+        users = {user.id: user for user in updates.users}
+        chats = {chat.id: chat for chat in updates.chats}
+        for update in updates.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return self._run_async(types.Message._parse(self.client, update.message, users, chats))
+        return None
+
+    def deliver(self, result):
+        input_file = self.uploader.finish(self.progress, self.progress_args) if self.uploader else None
+        if input_file is None:
+            return super().deliver(result)
+
+        thumb_path, vid_duration, vid_width, vid_height = get_video_info_and_thumb(result.output_path, _output_media_info(result))
+        try:
+            media = raw.types.InputMediaUploadedDocument(
+                mime_type="video/mp4",
+                file=input_file,
+                thumb=self.client.save_file(thumb_path),
+                attributes=[
+                    raw.types.DocumentAttributeVideo(
+                        supports_streaming=True,
+                        duration=int(vid_duration or result.job.duration),
+                        w=vid_width,
+                        h=vid_height
+                    ),
+                    raw.types.DocumentAttributeFilename(file_name=os.path.basename(result.output_path))
+                ]
+            )
+            updates = self.client.invoke(raw.functions.messages.SendMedia(
+                peer=self.client.resolve_peer(self.message.chat.id),
+                media=media,
+                reply_to_msg_id=self.message.id if self.message.chat.type != ChatType.PRIVATE else None,
+                random_id=self.client.rnd_id(),
+                **self._run_async(utils.parse_text_entities(self.client, _render(self.caption, result), None, None))
+            ))
+            return self._sent_message(updates)
+        finally:
+            if thumb_path and os.path.exists(thumb_path):
+                os.remove(thumb_path)
+
+
+class AlbumQuotaExceeded(Exception):
+    """مساحة تجميع الألبوم الخاصة بالمستخدم لا تتسع للملف الجديد."""
+
+
+def staging_usage(user_dir):
+    """الحجم الحالي لملفات مجلد تجميع المستخدم بالبايت."""
+    if not os.path.isdir(user_dir):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(user_dir) if entry.is_file())
+
+
+class AlbumSink(OutputSink):
+    """
+    نقل الملف المضغوط إلى مجلد تجميع ألبوم المستخدم دون رفع فردي.
+    النقل إعادة تسمية (على نفس القرص) وليس نسخاً، فالناتج لا يُكتب مرتين. quota_mb حد مساحة
+    المستخدم، وتجاوزه يرفع AlbumQuotaExceeded قبل النقل (يبقى الناتج في مكانه).
+    on_ready(album_path) تُستدعى بعد الحفظ لتسجيل الملف عند المستخدم.
+    """
+
+    _quota_lock = threading.Lock()
+
+    def __init__(self, staging_dir, user_id, on_ready, quota_mb=None):
+        self.staging_dir = staging_dir
+        self.user_id = user_id
+        self.on_ready = on_ready
+        self.quota_mb = quota_mb
+
+    @property
+    def user_dir(self):
+        return os.path.join(self.staging_dir, str(self.user_id))
+
+    def deliver(self, result):
+        os.makedirs(self.user_dir, exist_ok=True)
+        album_copy_path = os.path.join(
+            self.user_dir, f"album_file_{self.user_id}_{int(time.time()*100)}_{os.path.basename(result.output_path)}"
+        )
+        with self._quota_lock:
+            if self.quota_mb is not None:
+                used_mb = staging_usage(self.user_dir) / (1024 * 1024)
+                if used_mb + result.output_size_mb > self.quota_mb:
+                    raise AlbumQuotaExceeded(
+                        f"Album staging for user {self.user_id} would use {used_mb + result.output_size_mb:.1f} MB "
+                        f"(quota {self.quota_mb} MB)"
+                    )
+            # shutil.move يعيد التسمية ذرياً على نفس القرص، وينسخ فقط إذا كان المجلد على قرص آخر
+            shutil.move(result.output_path, album_copy_path)
+        if result.thumbnail_path and os.path.exists(result.thumbnail_path):
+            os.replace(result.thumbnail_path, thumbnail_path(album_copy_path))
+        # أبعاد ومدة الملف معروفة من الترميز، فلا يُفحص مجدداً عند تجهيز الألبوم
+        info = _output_media_info(result)
+        if info is not None:
+            remember_media_info(album_copy_path, info)
+        self.on_ready(album_copy_path)
@@ -0,0 +1,94 @@
+import os
+import time
+import struct
+import threading
+from dataclasses import replace
+
+from .commands import build_ffmpeg_command
+from .job import CompressionResult
+from .metrics import ACTIVE_ENCODES, record_encode
+from .runner import format_command, run_ffmpeg
+from .thumbnails import discard_thumbnails, finalize_thumbnail
+
+# -------------------------- الضغط أثناء التنزيل --------------------------
+# تُمرر أجزاء التنزيل مباشرة إلى stdin الخاص بـ FFmpeg (وتُحفظ على القرص بنفس الوقت)،
+# فيبدأ الترميز قبل وصول آخر بايت. ملفات MP4 التي يقع moov في نهايتها تحتاج القفز
+# داخل الملف، فلا يمكن قراءتها من أنبوب ونرجع لمسار الملف بعد اكتمال التنزيل.
+
+
+def is_streamable(head):
+    """
+    فحص بداية الملف: MP4 يصلح للقراءة المتدفقة إذا ظهر moov (أو moof للـ MP4 المجزأ) قبل mdat.
+    الحاويات الأخرى (MKV/WebM/TS) لا تحتاج القفز فتُعتبر صالحة.
+    """
+    if head[4:8] != b"ftyp":
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[offset:offset + 8])
+        if box_type in (b"moov", b"moof"):
+            return True
+        if box_type == b"mdat":
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if size < 8:
+            break
+        offset += size
+    return False
+
+
+def can_stream(job):
+    """الأنماط التي تقرأ المصدر مرة واحدة من البداية للنهاية فقط."""
+    return job.segments <= 1 and not (job.mode == 'target_size' and job.two_pass)
+
+
+def stream_compress(job, chunks, on_progress=None):
+    """
+    ضغط المصدر أثناء تنزيله. chunks مُكرر بايتات (مثل app.stream_media)، ويُحفظ كل ما يصل
+    في job.input_path ليبقى الملف الأصلي متاحاً بعد الضغط.
+    ترجع CompressionResult، أو None إذا لم يكن الملف قابلاً للقراءة المتدفقة أو لم يكن النمط
+    مناسباً؛ في هذه الحالة يكتمل التنزيل إلى job.input_path ويضغط المستدعي من الملف.
+    """
+    thread_name = threading.current_thread().name
+    chunks = iter(chunks)
+    head = next(chunks, b"")
+
+    with open(job.input_path, "wb") as source_file:
+        source_file.write(head)
+
+        if not (can_stream(job) and is_streamable(head)):
+            print(f"[{thread_name}][Stream] '{os.path.basename(job.input_path)}' is not streamable, finishing download first.")
+            for chunk in chunks:
+                source_file.write(chunk)
+            return None
+
+        def tee():
+            yield head
+            for chunk in chunks:
+                source_file.write(chunk)
+                yield chunk
+
+        command = build_ffmpeg_command(replace(job, input_path="pipe:0"))
+        print(f"[{thread_name}][FFmpeg] Streaming encode for '{os.path.basename(job.input_path)}':\n{format_command(command)}")
+        start_time = time.time()
+        ACTIVE_ENCODES.inc()
+        try:
+            run_ffmpeg(command, job.duration, on_progress, stdin_chunks=tee())
+        except BaseException:
+            discard_thumbnails(job.output_path)
+            raise
+        finally:
+            # run_ffmpeg يستهلك tee() كاملاً (حتى لو توقف FFmpeg مبكراً)، فالمصدر محفوظ بالكامل هنا
+            ACTIVE_ENCODES.dec()
+
+    if not os.path.exists(job.output_path):
+        raise FileNotFoundError(f"Compressed file {job.output_path} not found after FFmpeg completion.")
+    result = CompressionResult.from_files(job, format_command(command), time.time() - start_time)
+    record_encode(result, job.duration)
+    if job.thumbnail_count:
+        result.thumbnail_path = finalize_thumbnail(job)
+    print(f"[{thread_name}] Streaming compression done! New Size: {result.output_size_mb:.2f} MB ({result.elapsed:.1f}s)")
+    return result
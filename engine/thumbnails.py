@@ -0,0 +1,67 @@
+import os
+import glob
+
+# -------------------------- الصور المصغرة أثناء الترميز --------------------------
+# بدل تشغيل FFmpeg جديد على الناتج بعد الضغط، تُضاف للأمر مخرجات JPEG إضافية تأخذ إطاراتها
+# من نفس فك الترميز، فتكون الصورة جاهزة لحظة انتهاء الضغط. مع عدة مرشحين تُختار الصورة
+# الأكبر حجماً (الأكثر تفاصيل، فتُتجنب الإطارات السوداء أو الفارغة).
+# الصورة تُحفظ بجانب الناتج باسم "<الناتج>_thumb.jpg" وهو نفس ما تبحث عنه get_video_info_and_thumb.
+
+THUMBNAIL_WIDTH = 320
+
+
+def thumbnail_path(video_path):
+    return video_path + "_thumb.jpg"
+
+
+def _candidate_path(video_path, index):
+    return f"{video_path}_thumb_{index:02d}.jpg"
+
+
+def thumbnail_times(duration, count):
+    """أزمنة المرشحين: صورة واحدة عند 10% (ثانية كحد أقصى)، أو عدة صور موزعة على طول المقطع."""
+    if count <= 1:
+        return [min(1.0, duration * 0.1) if duration > 0 else 1.0]
+    return [duration * (index + 1) / (count + 1) for index in range(count)]
+
+
+def build_thumbnail_args(job):
+    """مخرجات الصور المصغرة التي تُضاف بعد مسار الناتج في أمر الترميز (فك ترميز واحد للجميع)."""
+    args = []
+    for index, seconds in enumerate(thumbnail_times(job.duration, job.thumbnail_count)):
+        args += [
+            "-map", "0:v:0", "-vf", f"select='gte(t,{seconds:.3f})',scale={THUMBNAIL_WIDTH}:-2",
+            "-frames:v", "1", "-q:v", "5", _candidate_path(job.output_path, index),
+        ]
+    return args
+
+
+def _candidates(video_path):
+    return sorted(glob.glob(glob.escape(video_path) + "_thumb_[0-9][0-9].jpg"))
+
+
+def adopt_thumbnails(image_path, video_path):
+    """إضافة صورة جاهزة (مثل صورة جزء في الترميز المتوازي) كمرشح تالٍ لملف الفيديو."""
+    os.replace(image_path, _candidate_path(video_path, len(_candidates(video_path))))
+
+
+def finalize_thumbnail(job):
+    """اختيار أفضل مرشح ونقله إلى thumbnail_path(الناتج)؛ يرجع المسار أو None إذا لم تُنتج صورة."""
+    candidates = [path for path in _candidates(job.output_path) if os.path.getsize(path) > 0]
+    if not candidates:
+        discard_thumbnails(job.output_path)
+        return None
+    best = max(candidates, key=os.path.getsize)
+    os.replace(best, thumbnail_path(job.output_path))
+    discard_thumbnails(job.output_path, keep_final=True)
+    return thumbnail_path(job.output_path)
+
+
+def discard_thumbnails(video_path, keep_final=False):
+    """حذف المرشحين (والصورة النهائية إلا مع keep_final) المرتبطة بملف فيديو."""
+    paths = _candidates(video_path)
+    if not keep_final:
+        paths.append(thumbnail_path(video_path))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,110 @@
+import os
+import math
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyrogram import raw
+
+# -------------------------- الرفع أثناء الترميز --------------------------
+# مع MP4 المجزأ يكتب FFmpeg الملف بالتتابع ولا يعود لأي جزء بعد كتابته، فكل 512KB مكتملة
+# من الناتج نهائية ويمكن رفعها فوراً (upload.saveBigFilePart) بينما الترميز مستمر.
+# عدد الأجزاء الكلي غير معروف أثناء الكتابة فيُرسل -1 حتى تُرفع الأجزاء الأخيرة بالعدد الصحيح.
+
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024  # تيليجرام يقبل saveBigFilePart للملفات الأكبر من ذلك فقط
+UPLOAD_WORKERS = 4
+POLL_SECONDS = 0.5
+
+
+class GrowingFileUploader:
+    """
+    رفع ملف ما زال قيد الكتابة: start() قبل بدء الكاتب، و finish() بعد انتهائه ترفع الباقي
+    وترجع InputFileBig، أو None إذا بقي الملف صغيراً أو فشل الرفع المسبق (فيُرفع بالطريقة العادية).
+    """
+
+    def __init__(self, client, path, file_name=None):
+        self.client = client
+        self.path = path
+        self.file_name = file_name or os.path.basename(path)
+        self.file_id = client.rnd_id()
+        self._checksums = []  # crc32 لكل جزء مرفوع مسبقاً
+        self._writer_done = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._upload_while_writing, name=f"{threading.current_thread().name}-upload", daemon=True
+        )
+        self._thread.start()
+
+    def _send_part(self, fp, index, total_parts):
+        fp.seek(index * UPLOAD_PART_SIZE)
+        chunk = fp.read(UPLOAD_PART_SIZE)
+        self.client.invoke(raw.functions.upload.SaveBigFilePart(
+            file_id=self.file_id, file_part=index, file_total_parts=total_parts, bytes=chunk
+        ))
+        return chunk
+
+    def _upload_while_writing(self):
+        fp = None
+        try:
+            while not self._writer_done.wait(POLL_SECONDS):
+                size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                # الملف يكبر فقط، فتجاوزه لحد الملف الكبير يعني أن الناتج النهائي سيُرفع كملف كبير
+                if size <= BIG_FILE_THRESHOLD:
+                    continue
+                if fp is None:
+                    fp = open(self.path, "rb")
+                while len(self._checksums) < size // UPLOAD_PART_SIZE:
+                    chunk = self._send_part(fp, len(self._checksums), -1)
+                    self._checksums.append(zlib.crc32(chunk))
+        except Exception as e:
+            self._error = e
+            print(f"[{threading.current_thread().name}] Upload during encode stopped: {e}")
+        finally:
+            if fp is not None:
+                fp.close()
+
+    def cancel(self):
+        """إيقاف الرفع المسبق (عند فشل الترميز)."""
+        self._writer_done.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self, progress=None, progress_args=()):
+        """يُستدعى بعد اكتمال كتابة الملف: رفع الأجزاء المتبقية وإرجاع InputFileBig أو None."""
+        self.cancel()
+        size = os.path.getsize(self.path)
+        if self._error is not None or size <= BIG_FILE_THRESHOLD:
+            return None
+
+        total_parts = math.ceil(size / UPLOAD_PART_SIZE)
+        pending = []
+        with open(self.path, "rb") as fp:
+            # احتياط: أي جزء تغير بعد رفعه (لو أعاد المرمز الكتابة) يُرفع من جديد
+            for index, checksum in enumerate(self._checksums):
+                fp.seek(index * UPLOAD_PART_SIZE)
+                if zlib.crc32(fp.read(UPLOAD_PART_SIZE)) != checksum:
+                    pending.append(index)
+        pending += range(len(self._checksums), total_parts)
+        print(f"[{threading.current_thread().name}] {total_parts - len(pending)}/{total_parts} parts were uploaded during encode.")
+
+        done_parts = total_parts - len(pending)
+        lock = threading.Lock()
+
+        def send(index):
+            nonlocal done_parts
+            with open(self.path, "rb") as fp:
+                self._send_part(fp, index, total_parts)
+            if progress:
+                with lock:
+                    done_parts += 1
+                    current = min(done_parts * UPLOAD_PART_SIZE, size)
+                progress(current, size, *progress_args)
+
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+            list(pool.map(send, pending))
+
+        return raw.types.InputFileBig(id=self.file_id, parts=total_parts, name=self.file_name)
@@ -1,30 +1,43 @@
 import os
 import tempfile
-import subprocess
 import threading
 import time
-import re
-import json
-from concurrent.futures import ThreadPoolExecutor
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import MessageEmpty, UserNotParticipant, MessageNotModified, FloodWait
 
 from config import *
+from engine import (
+    CompressionJob, ReplyDocumentSink, compress, stream_compress, plan_segments, CompressionScheduler,
+    WorkerPool, DownloadRegistry, estimate_download_work, stream_keeps_encoder_busy,
+    ProgressDispatcher, get_telegram_duration, get_video_duration,
+    JobStore, make_job_key, ResultCache, media_unique_id, result_cache_key,
+    JobTimeline, start_metrics_server,
+    PHASE_DOWNLOADING, PHASE_DOWNLOADED, PHASE_QUEUED, PHASE_COMPRESSING, PHASE_UPLOADING,
+    LoopTimer, run_when_done,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
-download_executor = ThreadPoolExecutor(max_workers=5)
-compression_executor = ThreadPoolExecutor(max_workers=3)
+JOB_STORE_PATH = "./video_compressor_jobs.db"
+
+download_executor = WorkerPool('download', 5, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
 
 # قواميس التخزين
 user_states = {}
 user_settings = {}
 user_video_data = {}
-PROGRESS_TRACKER = {} # لتتبع وقت آخر تحديث لرسائل التقدم (تجنب الحظر FloodWait)
+progress_dispatcher = ProgressDispatcher()  # كل تعديلات رسائل التقدم تمر عبره (دمج وحد للمعدل وFloodWait)
+
+# سجل دائم لمراحل المهام لاستئنافها بعد إعادة تشغيل البوت
+job_store = JobStore(JOB_STORE_PATH)
+
+# نتائج الضغط المرفوعة (file_id) لإعادة إرسالها عند وصول نفس الفيديو بنفس الإعدادات
+result_cache = ResultCache()
 
 DEFAULT_SETTINGS = {
     'encoder': 'h264_nvenc',
@@ -39,7 +52,7 @@ def get_user_settings(user_id):
 
 # -------------------------- وظائف المساعدة وحساب الحجم --------------------------
 
-def update_progress_msg(current, total, client, message, action, start_time):
+def update_progress_msg(current, total, client, message, action, start_time, encode_event=None):
     """
     دالة موحدة لتحديث رسائل التقدم مع معالجة الأخطاء إذا كان الحجم الإجمالي غير معروف من سيرفر تيليجرام
     """
@@ -49,11 +62,9 @@ def update_progress_msg(current, total, client, message, action, start_time):
     # تحديد ما إذا كانت العملية انتهت أم لا
     is_finished = (current >= total) if total > 0 else False
     
-    # تحديث الرسالة والطباعة كل 5 ثوانٍ فقط (تخطينا مشكلة الصفر هنا)
-    if msg_id in PROGRESS_TRACKER and (now - PROGRESS_TRACKER[msg_id]) < 5.0 and not is_finished:
+    # تحديث الرسالة والطباعة كل PROGRESS_UPDATE_INTERVAL ثانية فقط (تخطينا مشكلة الصفر هنا)
+    if not progress_dispatcher.due(message.chat.id, msg_id, final=is_finished):
         return
-
-    PROGRESS_TRACKER[msg_id] = now
     
     percent = (current * 100 / total) if total > 0 else 0
     filled = int(percent / 10) if percent > 0 else 0
@@ -87,6 +98,20 @@ def update_progress_msg(current, total, client, message, action, start_time):
                 speed_text = f"🚀 **السرعة:** `{speed_mb:.2f} MB/s`\n"
                 console_speed = f"| السرعة: {speed_mb:.2f} MB/s "
 
+    # الضغط: السرعة والوقت المتبقي من تقدم FFmpeg نفسه بدلاً من تقديرهما من الزمن المنقضي
+    if encode_event is not None and encode_event.speed > 0:
+        speed_text = f"🚀 **السرعة:** `{encode_event.speed:.2f}x` | `{encode_event.fps:.0f} fps`\n"
+        if encode_event.projected_size > 0:
+            speed_text += f"📦 **الحجم المتوقع:** `{encode_event.projected_size / (1024 * 1024):.2f} MB`\n"
+        console_speed = f"| السرعة: {encode_event.speed:.2f}x "
+        if encode_event.eta is not None:
+            eta_text = f"{int(encode_event.eta)} ثانية"
+
+    if encode_event is not None and encode_event.attempt > 1:
+        action = f"{action} (إعادة ترميز لضبط الحجم، محاولة {encode_event.attempt})"
+    if encode_event is not None and encode_event.stage == 'resolution':
+        action = "🔍 **جاري اختيار أفضل دقة للحجم المطلوب (ترميز عينات)...**"
+        curr_val, total_val = f"{current:.0f} عينة", f"{total:.0f} عينة"
     text = (
         f"{action}\n"
         f"{bar} `{percent:.1f}%`\n"
@@ -101,63 +126,17 @@ def update_progress_msg(current, total, client, message, action, start_time):
     print(console_log)
     # -------------------------------------------------------------
     
-    try:
-        client.edit_message_text(chat_id=message.chat.id, message_id=message.id, text=text)
-    except FloodWait as e:
-        time.sleep(e.value)
-    except MessageNotModified:
-        pass
-    except Exception:
-        pass
-
-def time_to_seconds(time_str):
-    """تحويل وقت FFmpeg (HH:MM:SS.ms) إلى ثواني لاستخدامه في شريط التقدم"""
-    try:
-        h, m, s = time_str.split(':')
-        return int(h) * 3600 + int(m) * 60 + float(s)
-    except:
-        return 0
-
-def get_telegram_duration(message):
-    """جلب مدة الفيديو بسرعة من بيانات رسالة تيليجرام لضمان الدقة العالية"""
-    if message.video and message.video.duration:
-        return float(message.video.duration)
-    elif message.animation and message.animation.duration:
-        return float(message.animation.duration)
-    return 0
-
-def get_video_duration(file_path):
-    """جلب المدة الإجمالية كخيار بديل إذا فشل جلبها من تيليجرام"""
-    try:
-        cmd = f'ffprobe -v quiet -print_format json -show_format "{file_path}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except:
-        return 0
-
-def calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps=128):
-    """
-    المعادلة الدقيقة لحساب معدل البت (Bitrate) اللازم للوصول إلى حجم محدد (Target Size).
-    """
-    if duration_seconds <= 0:
-        return 500 # قيمة افتراضية آمنة إذا فشل تحديد مدة الفيديو
-        
-    # الحجم الكلي المستهدف بالكيلوبت
-    total_bitrate_kbps = (target_size_mb * 8192) / duration_seconds
-    
-    # المساحة المتبقية للصورة (بطرح مساحة الصوت المحجوزة)
-    video_bitrate_kbps = int(total_bitrate_kbps - audio_bitrate_kbps)
-    
-    # حد أدنى آمن لكي لا تنهار جودة الفيديو وتفشل العملية تماماً (50kbps)
-    return max(50, video_bitrate_kbps)
+    # لا ينتظر العامل التعديل: الموزع يرسل أحدث نص لاحقاً ويتعامل مع FloodWait
+    progress_dispatcher.push(client, message.chat.id, msg_id, text, final=is_finished)
 
 def cleanup_downloads():
+    """حذف الملفات اليتيمة فقط؛ ملفات المهام القابلة للاستئناف تبقى."""
     print("Cleaning up downloads directory...")
+    active_paths = job_store.active_paths()
     for filename in os.listdir(DOWNLOADS_DIR):
         file_path = os.path.join(DOWNLOADS_DIR, filename)
         try:
-            if os.path.isfile(file_path):
+            if os.path.isfile(file_path) and os.path.abspath(file_path) not in active_paths:
                 os.remove(file_path)
                 print(f"Deleted old file: {file_path}")
         except Exception:
@@ -177,19 +156,26 @@ def process_video_for_compression(video_data):
     user_id = video_data['user_id']
     user_prefs = get_user_settings(user_id)
     encoder = user_prefs['encoder']
+    timeline = video_data['timeline']
+    timeline.end('queue')
+    outcome = 'failed'
 
     # الحصول على مدة الفيديو للحساب التفاعلي ولضبط الحجم
-    total_duration = get_telegram_duration(message)
-    if total_duration <= 0:
-        total_duration = get_video_duration(file_path)
+    with timeline.phase('probe'):
+        total_duration = get_telegram_duration(message)
+        if total_duration <= 0 and os.path.exists(file_path):
+            total_duration = get_video_duration(file_path)
 
-    print(f"\n[{thread_name}] Original file: {os.path.basename(file_path)} | Size: {os.path.getsize(file_path)/(1024*1024):.2f}MB | Duration: {total_duration}s")
+    if os.path.exists(file_path):
+        print(f"\n[{thread_name}] Original file: {os.path.basename(file_path)} | Size: {os.path.getsize(file_path)/(1024*1024):.2f}MB | Duration: {total_duration}s")
+    else:
+        print(f"\n[{thread_name}] Streaming file: {os.path.basename(file_path)} | Duration: {total_duration}s")
 
     # تحديث رسالة الأزرار إذا وجدت
     if button_message_id and button_message_id in user_video_data:
         user_video_data[button_message_id]['processing_started'] = True
         try:
-            status_text = f"⏳ تم وضع الفيديو في طابور المعالجة..."
+            status_text = "⚙️ جاري المعالجة الآن..."
             app.edit_message_reply_markup(
                 chat_id=message.chat.id,
                 message_id=button_message_id,
@@ -200,111 +186,111 @@ def process_video_for_compression(video_data):
     temp_compressed_filename = None
 
     try:
-        if not os.path.exists(file_path):
+        if not video_data.get('stream') and not os.path.exists(file_path):
             message.reply_text("❌ حدث خطأ: لم يتم العثور على الملف الأصلي للمعالجة.")
             return
 
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
-
-        # بناء أوامر الجودة والحجم لـ FFmpeg
-        if isinstance(quality, dict) and 'target_size' in quality:
-            target_size_mb = quality['target_size']
-            
-            # جلب قيمة مساحة الصوت التي سيتم استخدامها، لتنقيصها من إجمالي المساحة المطلوبة
-            try: audio_k = int(str(VIDEO_AUDIO_BITRATE).lower().replace('k', '').strip())
-            except: audio_k = 128
-            
-            # حساب المعدل المضبوط
-            target_v_bitrate = calculate_target_bitrate(target_size_mb, total_duration, audio_k)
-            print(f"[{thread_name}] Mode: EXACT SIZE. Target: {target_size_mb} MB | Target Video Bitrate: {target_v_bitrate}k")
-            
-            # أوامر إلزام FFmpeg باحترام الحجم المحدد (ABR mode)
-            quality_settings = f"-b:v {target_v_bitrate}k -maxrate {target_v_bitrate}k -bufsize {target_v_bitrate*2}k -preset fast"
-            used_mode_text = f"🎯 طلب حجم مستهدف: ~{target_size_mb} MB"
-            
-        else:
-            # نمط ضغط הגودة العادي (CRF / CQ)
-            quality_value = int(quality.split('_')[1]) if isinstance(quality, str) and 'crf_' in quality else int(quality)
-            print(f"[{thread_name}] Mode: QUALITY (CRF/CQ). Level: {quality_value}")
-            
-            preset = "fast"
-            if quality_value <= 18: preset = "slow"
-            elif quality_value <= 23: preset = "medium"
-            elif quality_value >= 27: preset = "veryfast" if encoder == 'libx264' else "fast"
-            
-            quality_param = "cq" if "nvenc" in encoder else "crf"
-            quality_settings = f"-{quality_param} {quality_value} -preset {preset}"
-            used_mode_text = f"🎥 الجودة (CRF/CQ): {quality_value}"
-        
-        # إنشاء أمر FFmpeg الكامل
-        common_ffmpeg_part = (
-            f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} '
-            f'-c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} '
-            f'-ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -map_metadata -1'
+        job_store.record(video_data['job_key'], phase=PHASE_COMPRESSING, output_path=temp_compressed_filename, encoder=encoder)
+
+        # بناء مهمة الضغط (الجودة أو الحجم المستهدف)
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            duration=total_duration,
+            segments=plan_segments(total_duration, encoder)
         )
-        ffmpeg_command = f'{common_ffmpeg_part} {quality_settings} "{temp_compressed_filename}"'
+        used_mode_text = apply_quality(job, quality)
+        if job.mode == 'target_size':
+            print(f"[{thread_name}] Mode: EXACT SIZE. Target: {job.target_size_mb} MB")
+        else:
+            print(f"[{thread_name}] Mode: QUALITY (CRF/CQ). Level: {job.quality_value}")
+
+        # نفس الملف بنفس الإعدادات ضُغط من قبل: إعادة إرسال الناتج بدون ترميز (أو تنزيل في وضع التدفق)
+        cache_key = result_cache_key(media_unique_id(message), job)
+        if send_cached_result(message, cache_key, used_mode_text):
+            outcome = 'cached'
+            return
+
+        # بعد حساب مفتاح الذاكرة: الـ preset يغير الحجم والسرعة فقط، فالناتج المحفوظ صالح لأي اختيار
+        compression_executor.choose_preset(job, message)
 
         # إرسال رسالة التتبع الفعلي للضغط
         progress_msg = message.reply_text("🔄 **بدأ ضغط الفيديو (قد يأخذ وقتاً)...**", quote=True)
         start_time = time.time()
 
-        # تشغيل العملية وتحليل سطر Progress الخاص بها
-        process = subprocess.Popen(ffmpeg_command, shell=True, stderr=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
+        # تشغيل العملية وتمرير التقدم لرسالة التتبع
+        def on_encode_progress(event):
+            update_progress_msg(
+                current=event.out_time,
+                total=event.duration,
+                client=app,
+                message=progress_msg,
+                action="⚙️ **جاري المعالجة والضغط...**",
+                start_time=start_time,
+                encode_event=event
+            )
+
+        result = None
+        with timeline.phase('encode'):
+            if video_data.get('stream'):
+                # التنزيل والترميز معاً؛ None يعني أن الملف لا يُقرأ كتدفق فاكتمل تنزيله ونضغطه من القرص
+                timeline.begin('download')
+                result = stream_compress(job, app.stream_media(message), on_encode_progress)
+                timeline.end('download')
+                video_data['stream'] = False
+                job_store.record(video_data['job_key'], input_path=file_path)
+            if result is None:
+                result = compress(job, on_encode_progress)
+        if job.mode == 'target_size':
+            used_mode_text += f"\n🔁 عدد تمريرات الترميز: {result.passes}"
+            if job.resolution:
+                used_mode_text += f"\n📐 الدقة المختارة للحجم: {job.resolution}p"
+
+        progress_dispatcher.forget(progress_msg.chat.id, progress_msg.id)
 
-        for line in process.stderr:
-            if total_duration > 0:
-                time_match = re.search(r"time=\s*(\d{2}:\d{2}:\d{2}\.\d+)", line)
-                if time_match:
-                    current_time_str = time_match.group(1)
-                    current_time_sec = time_to_seconds(current_time_str)
-                    
-                    update_progress_msg(
-                        current=current_time_sec,
-                        total=total_duration,
-                        client=app,
-                        message=progress_msg,
-                        action="⚙️ **جاري المعالجة والضغط...**",
-                        start_time=start_time
-                    )
-
-        process.wait()
-        
-        if process.returncode != 0:
-            raise Exception("FFmpeg process crashed or failed.")
-            
         try: progress_msg.delete()
         except: pass
 
-        compressed_file_size_mb = os.path.getsize(temp_compressed_filename) / (1024 * 1024)
-        print(f"[{thread_name}] Compression Done! New Size: {compressed_file_size_mb:.2f} MB")
+        job_store.record(video_data['job_key'], phase=PHASE_UPLOADING)
 
         # رسالة جاري الرفع مع شريط تقدم
         upload_progress_msg = message.reply_text("📤 اكتمل الضغط! بدأ رفع الفيديو النهائي...", quote=True)
         upload_start_time = time.time()
 
-        message.reply_document(
-            document=temp_compressed_filename,
-            progress=update_progress_msg,
-            progress_args=(app, upload_progress_msg, "📤 **الرفع إلى التليجرام...**", upload_start_time),
-            caption=f"📦 **النتيجة النهائية**\n"
-                    f"🔻 الحجم القديم: {os.path.getsize(file_path) / (1024 * 1024):.2f} MB\n"
-                    f"✅ الحجم الجديد: {compressed_file_size_mb:.2f} MB\n\n"
-                    f"{used_mode_text}"
-        )
-        
+        with timeline.phase('upload'):
+            sent = ReplyDocumentSink(
+                message,
+                caption=f"📦 **النتيجة النهائية**\n"
+                        f"🔻 الحجم القديم: {result.input_size_mb:.2f} MB\n"
+                        f"✅ الحجم الجديد: {result.output_size_mb:.2f} MB\n\n"
+                        f"{used_mode_text}",
+                progress=update_progress_msg,
+                progress_args=(app, upload_progress_msg, "📤 **الرفع إلى التليجرام...**", upload_start_time)
+            ).deliver(result)
+        if sent is not None and sent.document:
+            result_cache.put(cache_key, sent.document.file_id, input_size=result.input_size, output_size=result.output_size)
+
+        progress_dispatcher.forget(upload_progress_msg.chat.id, upload_progress_msg.id)
+
         try: upload_progress_msg.delete()
         except: pass
-        
+        outcome = 'done'
+
     except Exception as e:
         print(f"[{thread_name}] Processing error: {e}")
         message.reply_text(f"❌ حدث خطأ أثناء المعالجة أو الرفع:\n`{str(e)[:150]}`", quote=True)
     finally:
         # حذف الملفات المؤقتة فور انتهاء كل المهام المرتبطة بها
-        if temp_compressed_filename and os.path.exists(temp_compressed_filename):
-            os.remove(temp_compressed_filename)
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+        with timeline.phase('cleanup'):
+            if temp_compressed_filename and os.path.exists(temp_compressed_filename):
+                os.remove(temp_compressed_filename)
+            download_registry.release_source(video_data)
+            job_store.finish(video_data['job_key'])
+        timeline.finish(outcome)
+        print(f"[{thread_name}] Job {video_data['job_key']} {outcome}: {timeline.summary()}")
 
         auto_compress_status_message_id = video_data.get('auto_compress_status_message_id')
         if auto_compress_status_message_id:
@@ -330,6 +316,53 @@ def process_video_for_compression(video_data):
         elif video_data['message'].id in user_video_data:
             del user_video_data[video_data['message'].id]
 
+def apply_quality(job, quality):
+    """ضبط نمط المهمة من اختيار المستخدم (CRF/CQ أو حجم مستهدف) وإرجاع نص وصف النمط."""
+    if isinstance(quality, dict) and 'target_size' in quality:
+        job.target_size_mb = quality['target_size']
+        job.two_pass = True
+        job.auto_resolution = TARGET_SIZE_AUTO_RESOLUTION  # الدقة تُختار بالعينات عند بدء الضغط
+        return f"🎯 طلب حجم مستهدف: ~{job.target_size_mb} MB"
+    # نمط ضغط الجودة العادي (CRF / CQ)
+    job.quality_value = int(quality.split('_')[1]) if isinstance(quality, str) and 'crf_' in quality else int(quality)
+    return f"🎥 الجودة (CRF/CQ): {job.quality_value}"
+
+def send_cached_result(message, cache_key, used_mode_text):
+    """إعادة إرسال ناتج مضغوط سابقاً عبر file_id؛ ترجع False إذا لم يوجد أو لم يعد صالحاً."""
+    entry = result_cache.get(cache_key)
+    if entry is None:
+        return False
+    try:
+        message.reply_document(
+            document=entry['file_id'],
+            caption=f"📦 **النتيجة النهائية** (♻️ محفوظة مسبقاً)\n"
+                    f"🔻 الحجم القديم: {entry['input_size']/(1024*1024):.2f} MB\n"
+                    f"✅ الحجم الجديد: {entry['output_size']/(1024*1024):.2f} MB\n\n"
+                    f"{used_mode_text}"
+        )
+    except Exception as e:
+        print(f"Cached result for {cache_key[0]} could not be resent, compressing again: {e}")
+        result_cache.discard(cache_key)
+        return False
+    print(f"Result cache hit for {cache_key[0]} (message {message.id}).")
+    return True
+
+
+submit_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
+def enqueue_compression(video_data):
+    """
+    تسجيل الجودة المختارة في السجل الدائم ثم إرسال المهمة لجدولة الضغط،
+    وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها.
+    """
+    job_store.record(video_data['job_key'], phase=PHASE_QUEUED, quality=video_data['quality'])
+    if 'finished' in video_data['timeline'].events:
+        video_data['timeline'] = JobTimeline(video_data['job_key'])  # اختيار جودة أخرى لنفس الفيديو مهمة جديدة
+    video_data['timeline'].begin('queue')
+    return submit_compression(video_data)
+
+
 def auto_select_medium_quality(button_message_id):
     if button_message_id in user_video_data:
         video_data = user_video_data[button_message_id]
@@ -340,7 +373,7 @@ def auto_select_medium_quality(button_message_id):
                     chat_id=video_data['message'].chat.id, message_id=button_message_id,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ تم تفعيل اختيار (متوسط) لانتهاء الوقت", callback_data="none")]]))
             except Exception: pass
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
 
 # -------------------------- معالجات رسائل تيليجرام --------------------------
 
@@ -352,6 +385,21 @@ def start_command(client, message):
         reply_markup=settings_button, quote=True
     )
 
+@app.on_message(filters.command("queue"))
+def queue_command(client, message):
+    lines = ["📊 **حالة طوابير الضغط:**"]
+    for name, stats in compression_executor.stats().items():
+        lines.append(
+            f"\n🔹 **{name.upper()}**: قيد التنفيذ `{stats['running']}/{stats['max_workers']}` | بالانتظار `{stats['queued']}`\n"
+            f"⏱ متوسط الانتظار: `{stats['avg_wait']:.0f} ثانية` | أقدم مهمة منتظرة: `{stats['oldest_waiting']:.0f} ثانية`"
+        )
+    cache = result_cache.stats()
+    lines.append(
+        f"\n♻️ **النتائج المحفوظة**: `{cache['entries']}/{cache['max_entries']}` | "
+        f"إصابة `{cache['hits']}` | إخفاق `{cache['misses']}` ({cache['hit_rate']*100:.0f}%)"
+    )
+    message.reply_text("\n".join(lines), quote=True)
+
 @app.on_message(filters.command("settings"))
 def settings_command(client, message):
     send_settings_menu(client, message.chat.id, message.from_user.id)
@@ -401,7 +449,7 @@ def handle_text_inputs(client, message):
                             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"🎯 طلب الوصول لـ ~{size} MB استلم", callback_data="none")]]))
                     except Exception: pass
                     
-                    compression_executor.submit(process_video_for_compression, video_data)
+                    enqueue_compression(video_data)
                     del user_states[user_id]
                 else:
                     message.reply_text("❌ انتهت صلاحية هذا الزر (الفيديو ممسوح أو العملية قيد التنفيذ مسبقاً).", quote=True)
@@ -439,21 +487,68 @@ def send_settings_menu(client, chat_id, user_id, message_id=None):
 
 @app.on_message(filters.video | filters.animation)
 def handle_incoming_video(client, message):
+    start_download(client, message)
+
+def start_download(client, message):
+    user_prefs = get_user_settings(message.from_user.id)
+    if user_prefs['auto_compress']:
+        # الجودة معروفة مسبقاً: إذا كان الناتج محفوظاً لا حاجة للتنزيل أصلاً
+        job = CompressionJob(input_path=None, output_path=None, encoder=user_prefs['encoder'])
+        used_mode_text = apply_quality(job, user_prefs['auto_quality_value'])
+        if send_cached_result(message, result_cache_key(media_unique_id(message), job), used_mode_text):
+            JobTimeline(make_job_key(message.chat.id, message.id)).finish('cached')
+            return
+        if STREAMING_COMPRESSION and stream_keeps_encoder_busy(message, user_prefs['encoder']):
+            start_streaming_compression(message)
+            return
+
     file_id = message.video.file_id if message.video else message.animation.file_id
     file_name_prefix = os.path.join(DOWNLOADS_DIR, f"{message.from_user.id}_{message.id}_{int(time.time())}.mp4")
     
     download_msg = message.reply_text("📥 يتم إنشاء الاتصال لتنزيل الفيديو لخادم المعالجة...", quote=True)
     start_time = time.time()
-    
-    download_future = download_executor.submit(
-        client.download_media,
-        message=file_id,
-        file_name=file_name_prefix,
-        progress=update_progress_msg,
-        progress_args=(client, download_msg, "📥 **جاري تنزيل الملف الخ...**", start_time)
+    video_data = new_video_data(message, download_msg)
+
+    download_future, shared = download_registry.acquire(
+        media_unique_id(message),
+        lambda: download_executor.submit(
+            video_data['timeline'].timed('download', client.download_media),
+            message=file_id,
+            file_name=file_name_prefix,
+            progress=update_progress_msg,
+            progress_args=(client, download_msg, "📥 **جاري تنزيل الملف الخ...**", start_time),
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+        )
+    )
+    if shared:
+        try: download_msg.edit_text("📥 نفس الملف قيد التنزيل (أو جاهز) لطلب آخر، سيُستخدم مباشرة دون تنزيل جديد...")
+        except Exception: pass
+
+    video_data['download_future'] = download_future
+    user_video_data[message.id] = video_data
+    job_store.record(
+        user_video_data[message.id]['job_key'], phase=PHASE_DOWNLOADING,
+        user_id=message.from_user.id, chat_id=message.chat.id, message_id=message.id
+    )
+    run_when_done(app, download_future, post_download_actions, message.id)
+
+def start_streaming_compression(message):
+    """الضغط التلقائي: الجودة معروفة مسبقاً، فتُرسل المهمة للطابور مباشرة ويبدأ الترميز أثناء التنزيل."""
+    video_data = new_video_data(message)
+    video_data['file'] = os.path.join(DOWNLOADS_DIR, f"{message.from_user.id}_{message.id}_{int(time.time())}.mp4")
+    video_data['stream'] = True
+    video_data['quality'] = get_user_settings(message.from_user.id)['auto_quality_value']
+    user_video_data[message.id] = video_data
+    job_store.record(
+        video_data['job_key'], phase=PHASE_DOWNLOADING,
+        user_id=message.from_user.id, chat_id=message.chat.id, message_id=message.id
     )
+    status_msg = message.reply_text(f"📡 سيبدأ الضغط التلقائي لـ **CRF {video_data['quality']}** أثناء تنزيل الملف...", quote=True)
+    video_data['auto_compress_status_message_id'] = status_msg.id
+    enqueue_compression(video_data)
 
-    user_video_data[message.id] = {
+def new_video_data(message, download_msg=None, download_future=None):
+    return {
         'message': message,
         'download_msg': download_msg,
         'download_future': download_future,
@@ -463,50 +558,96 @@ def handle_incoming_video(client, message):
         'quality': None,
         'processing_started': False,
         'user_id': message.from_user.id,
-        'auto_compress_status_message_id': None 
-    }    
-    threading.Thread(target=post_download_actions, args=[message.id]).start()
+        'auto_compress_status_message_id': None,
+        'job_key': make_job_key(message.chat.id, message.id),
+        'stream': False,
+        'source_released': False,
+        'timeline': JobTimeline(make_job_key(message.chat.id, message.id))
+    }
 
 def post_download_actions(original_message_id):
     if original_message_id not in user_video_data: return
     video_data = user_video_data[original_message_id]
     message = video_data['message']
-    user_id = video_data['user_id']
     download_msg = video_data['download_msg']
 
     try:
         file_path = video_data['download_future'].result()
         video_data['file'] = file_path
+        job_store.record(video_data['job_key'], phase=PHASE_DOWNLOADED, input_path=file_path)
+        
+        if download_msg: progress_dispatcher.forget(download_msg.chat.id, download_msg.id)
         
         try: download_msg.delete()
         except: pass
-        
-        user_prefs = get_user_settings(user_id)
-        if user_prefs['auto_compress']:
-            video_data['quality'] = user_prefs['auto_quality_value']
-            status_msg = message.reply_text(f"✅ تم تحميل الملف. يضغط تلقائياً لـ **CRF {video_data['quality']}**...", quote=True)
-            video_data['auto_compress_status_message_id'] = status_msg.id
-            compression_executor.submit(process_video_for_compression, video_data)
-        else:
-            markup = InlineKeyboardMarkup([
-                [InlineKeyboardButton("أدنى جودة (27)", callback_data="crf_27"),
-                 InlineKeyboardButton("متوسط (23)", callback_data="crf_23"),
-                 InlineKeyboardButton("عالي جداً (18)", callback_data="crf_18")],
-                [InlineKeyboardButton("🎯 استهداف وتحديد حجم الميغا بالضبط", callback_data="target_size_prompt")],
-                [InlineKeyboardButton("❌ إلغاء العملية بأكملها", callback_data="cancel_compression")]
-            ])
-            reply_message = message.reply_text("✅ استُلم الملف.\nتفضل بتحديد الجودة المطلوبة (أو اطلب تقليصه لحجم محدد):", reply_markup=markup, quote=True)
-            video_data['button_message_id'] = reply_message.id
-            user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
-            # اختيار ذاتي إن مر 5 دقائق
-            timer = threading.Timer(300, auto_select_medium_quality, args=[reply_message.id])
-            user_video_data[reply_message.id]['timer'] = timer
-            timer.start()
+
+        offer_quality_choice(original_message_id)
             
     except Exception as e:
         message.reply_text(f"❌ وقع خطأ مقاطع أثناء التحميل أو بعده:\n`{e}`")
+        download_registry.release_source(video_data)
+        job_store.finish(video_data['job_key'])
+        video_data['timeline'].finish('failed')
         if original_message_id in user_video_data: del user_video_data[original_message_id]
 
+def offer_quality_choice(original_message_id):
+    """بعد توفر الملف: ضغط تلقائي حسب الإعدادات أو عرض أزرار اختيار الجودة."""
+    video_data = user_video_data[original_message_id]
+    message = video_data['message']
+    user_id = video_data['user_id']
+
+    user_prefs = get_user_settings(user_id)
+    if user_prefs['auto_compress']:
+        video_data['quality'] = user_prefs['auto_quality_value']
+        status_msg = message.reply_text(f"✅ تم تحميل الملف. يضغط تلقائياً لـ **CRF {video_data['quality']}**...", quote=True)
+        video_data['auto_compress_status_message_id'] = status_msg.id
+        enqueue_compression(video_data)
+    else:
+        markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("أدنى جودة (27)", callback_data="crf_27"),
+             InlineKeyboardButton("متوسط (23)", callback_data="crf_23"),
+             InlineKeyboardButton("عالي جداً (18)", callback_data="crf_18")],
+            [InlineKeyboardButton("🎯 استهداف وتحديد حجم الميغا بالضبط", callback_data="target_size_prompt")],
+            [InlineKeyboardButton("❌ إلغاء العملية بأكملها", callback_data="cancel_compression")]
+        ])
+        reply_message = message.reply_text("✅ استُلم الملف.\nتفضل بتحديد الجودة المطلوبة (أو اطلب تقليصه لحجم محدد):", reply_markup=markup, quote=True)
+        video_data['button_message_id'] = reply_message.id
+        user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
+        # اختيار ذاتي إن مر 5 دقائق
+        timer = LoopTimer(app, 300, auto_select_medium_quality, args=[reply_message.id])
+        user_video_data[reply_message.id]['timer'] = timer
+        timer.start()
+
+def resume_pending_jobs():
+    """استئناف المهام غير المكتملة من التشغيل السابق بدلاً من حذف ملفاتها."""
+    for job in job_store.recoverable():
+        try:
+            message = app.get_messages(job['chat_id'], job['message_id'])
+        except Exception as e:
+            print(f"Could not fetch message for job {job['job_key']}: {e}")
+            message = None
+        if not message or message.empty or not (message.video or message.animation):
+            job_store.finish(job['job_key'])
+            continue
+
+        input_path = job['input_path']
+        if job['phase'] == PHASE_DOWNLOADING or not input_path or not os.path.exists(input_path):
+            print(f"Resuming job {job['job_key']}: restarting download.")
+            start_download(app, message)
+            continue
+
+        video_data = new_video_data(message)
+        video_data['file'] = input_path
+        user_video_data[message.id] = video_data
+        if job['phase'] != PHASE_DOWNLOADED and job['quality'] is not None:
+            print(f"Resuming job {job['job_key']}: re-queueing compression ({job['phase']}).")
+            video_data['quality'] = job['quality']
+            message.reply_text("♻️ أُعيد تشغيل البوت، تم استئناف ضغط هذا الفيديو تلقائياً...", quote=True)
+            enqueue_compression(video_data)
+        else:
+            print(f"Resuming job {job['job_key']}: waiting for quality choice.")
+            offer_quality_choice(message.id)
+
 @app.on_callback_query()
 def universal_callback_handler(client, callback_query):
     data = callback_query.data
@@ -564,8 +705,10 @@ def universal_callback_handler(client, callback_query):
     # أوامر إنهاء أو مقاطعة
     if data in ["cancel_compression", "finish_process"]:
         if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
-        file_path = video_data.get('file')
-        if file_path and os.path.exists(file_path): os.remove(file_path)
+        download_registry.release_source(video_data)
+        job_store.finish(video_data['job_key'])
+        if 'finished' not in video_data['timeline'].events:
+            video_data['timeline'].finish('cancelled')
         try:
             message.delete()
             video_data['message'].reply_text("🗑️ دُمر الطلب وأُزيل من الذاكرة بأمرك.", quote=True)
@@ -594,10 +737,15 @@ def universal_callback_handler(client, callback_query):
 
     video_data['quality'] = data
     callback_query.answer("في المعالجة... يرجى التمهل")
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
 
 # -------------------------- التشغيل --------------------------
 if __name__ == "__main__":
+    app.start()
+    start_metrics_server(METRICS_PORT)
     cleanup_downloads()
+    resume_pending_jobs()
     print("\n✅ البوت تم تجهيزه. المزامنة مستمرة بنجاح وخاصية تحديد الحجم المستهدف شغالة...")
-    app.run()
+    idle()
+    app.stop()
+    job_store.close()
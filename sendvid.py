@@ -1,30 +1,32 @@
 import os
 import tempfile
-import subprocess
 import threading
 import time
-import re
-import json
-from concurrent.futures import ThreadPoolExecutor
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import MessageEmpty, UserNotParticipant, MessageNotModified, FloodWait
 
 from config import *
+from engine import (
+    CompressionJob, ReplyVideoSink, StreamingVideoSink, process_job, plan_segments, CompressionScheduler,
+    WorkerPool, DownloadRegistry, estimate_download_work,
+    ProgressDispatcher, get_telegram_duration, get_video_duration, discard_thumbnails,
+    LoopTimer, run_when_done, start_metrics_server,
+)
 
 # -------------------------- الثوابت والإعدادات --------------------------
 DOWNLOADS_DIR = "./downloads"
 if not os.path.exists(DOWNLOADS_DIR):
     os.makedirs(DOWNLOADS_DIR)
 
-download_executor = ThreadPoolExecutor(max_workers=5)
-compression_executor = ThreadPoolExecutor(max_workers=3)
+download_executor = WorkerPool('download', 5, user_max_jobs=DOWNLOAD_USER_MAX_CONCURRENT)
+download_registry = DownloadRegistry()  # نفس الملف المرسل عدة مرات بنفس الوقت يُنزل مرة واحدة
+compression_executor = CompressionScheduler()
 
 # قواميس التخزين
 user_states = {}
 user_settings = {}
 user_video_data = {}
-PROGRESS_TRACKER = {} # لتتبع وقت آخر تحديث لرسائل التقدم (تجنب الحظر FloodWait)
+progress_dispatcher = ProgressDispatcher()  # كل تعديلات رسائل التقدم تمر عبره (دمج وحد للمعدل وFloodWait)
 
 DEFAULT_SETTINGS = {
     'encoder': 'h264_nvenc',
@@ -39,7 +41,7 @@ def get_user_settings(user_id):
 
 # -------------------------- وظائف المساعدة وحساب الحجم والتقدم --------------------------
 
-def update_progress_msg(current, total, client, message, action, start_time, known_size=0):
+def update_progress_msg(current, total, client, message, action, start_time, known_size=0, encode_event=None):
     """
     دالة موحدة لتحديث رسائل التقدم مع استخدام حجم احتياطي مؤكد لضمان دقة الحسابات
     """
@@ -51,10 +53,8 @@ def update_progress_msg(current, total, client, message, action, start_time, kno
 
     is_finished = (current >= total) if total > 0 else False
     
-    if msg_id in PROGRESS_TRACKER and (now - PROGRESS_TRACKER[msg_id]) < 5.0 and not is_finished:
+    if not progress_dispatcher.due(message.chat.id, msg_id, final=is_finished):
         return
-
-    PROGRESS_TRACKER[msg_id] = now
     
     percent = (current * 100 / total) if total > 0 else 0
     filled = int(percent / 10) if percent > 0 else 0
@@ -86,6 +86,20 @@ def update_progress_msg(current, total, client, message, action, start_time, kno
                 speed_text = f"🚀 **السرعة:** `{speed_mb:.2f} MB/s`\n"
                 console_speed = f"| السرعة: {speed_mb:.2f} MB/s "
 
+    # الضغط: السرعة والوقت المتبقي من تقدم FFmpeg نفسه بدلاً من تقديرهما من الزمن المنقضي
+    if encode_event is not None and encode_event.speed > 0:
+        speed_text = f"🚀 **السرعة:** `{encode_event.speed:.2f}x` | `{encode_event.fps:.0f} fps`\n"
+        if encode_event.projected_size > 0:
+            speed_text += f"📦 **الحجم المتوقع:** `{encode_event.projected_size / (1024 * 1024):.2f} MB`\n"
+        console_speed = f"| السرعة: {encode_event.speed:.2f}x "
+        if encode_event.eta is not None:
+            eta_text = f"{int(encode_event.eta)} ثانية"
+
+    if encode_event is not None and encode_event.attempt > 1:
+        action = f"{action} (إعادة ترميز لضبط الحجم، محاولة {encode_event.attempt})"
+    if encode_event is not None and encode_event.stage == 'resolution':
+        action = "🔍 **جاري اختيار أفضل دقة للحجم المطلوب (ترميز عينات)...**"
+        curr_val, total_val = f"{current:.0f} عينة", f"{total:.0f} عينة"
     text = (
         f"{action}\n"
         f"{bar} `{percent:.1f}%`\n"
@@ -98,80 +112,9 @@ def update_progress_msg(current, total, client, message, action, start_time, kno
     console_log = f"[Task Msg:{msg_id}] {clean_action} | {percent:.1f}% | {curr_val} / {total_val} {console_speed}| المتبقي: {eta_text}"
     print(console_log)
     
-    try:
-        client.edit_message_text(chat_id=message.chat.id, message_id=message.id, text=text)
-    except FloodWait as e:
-        time.sleep(e.value)
-    except MessageNotModified:
-        pass
-    except Exception:
-        pass
-        
-def get_video_info_and_thumb(file_path):
-    """
-    تستخرج المدة والأبعاد من الفيديو وتلتقط صورة مصغرة (Thumbnail) لتستخدمها تيليجرام
-    """
-    duration = 0.0
-    width = 0
-    height = 0
-    thumb_path = None
-
-    try:
-        cmd = f'ffprobe -v quiet -print_format json -show_streams "{file_path}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-        
-        for stream in data.get('streams', []):
-            if stream.get('codec_type') == 'video':
-                width = int(stream.get('width', 0))
-                height = int(stream.get('height', 0))
-                duration = float(stream.get('duration', 0))
-                break
-        
-        thumb_time = min(1.0, duration * 0.1) if duration > 0 else 1.0
-        thumb_path = file_path + "_thumb.jpg"
+    # لا ينتظر العامل التعديل: الموزع يرسل أحدث نص لاحقاً ويتعامل مع FloodWait
+    progress_dispatcher.push(client, message.chat.id, msg_id, text, final=is_finished)
         
-        thumb_cmd = f'ffmpeg -y -ss {thumb_time} -i "{file_path}" -vframes 1 -vf "scale=320:-1" -q:v 5 "{thumb_path}" -loglevel quiet'
-        subprocess.run(thumb_cmd, shell=True)
-        
-        if not os.path.exists(thumb_path):
-            thumb_path = None
-            
-    except Exception as e:
-        print(f"Error getting video info & thumb: {e}")
-        
-    return thumb_path, duration, width, height
-
-def time_to_seconds(time_str):
-    try:
-        h, m, s = time_str.split(':')
-        return int(h) * 3600 + int(m) * 60 + float(s)
-    except:
-        return 0
-
-def get_telegram_duration(message):
-    if message.video and message.video.duration:
-        return float(message.video.duration)
-    elif message.animation and message.animation.duration:
-        return float(message.animation.duration)
-    return 0
-
-def get_video_duration(file_path):
-    try:
-        cmd = f'ffprobe -v quiet -print_format json -show_format "{file_path}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        data = json.loads(result.stdout)
-        return float(data['format']['duration'])
-    except:
-        return 0
-
-def calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps=128):
-    if duration_seconds <= 0:
-        return 500
-    total_bitrate_kbps = (target_size_mb * 8192) / duration_seconds
-    video_bitrate_kbps = int(total_bitrate_kbps - audio_bitrate_kbps)
-    return max(50, video_bitrate_kbps)
-
 def cleanup_downloads():
     print("Cleaning up downloads directory...")
     for filename in os.listdir(DOWNLOADS_DIR):
@@ -207,7 +150,7 @@ def process_video_for_compression(video_data):
     if button_message_id and button_message_id in user_video_data:
         user_video_data[button_message_id]['processing_started'] = True
         try:
-            status_text = f"⏳ تم وضع الفيديو في طابور المعالجة..."
+            status_text = "⚙️ جاري المعالجة الآن..."
             app.edit_message_reply_markup(
                 chat_id=message.chat.id,
                 message_id=button_message_id,
@@ -216,7 +159,6 @@ def process_video_for_compression(video_data):
         except: pass
 
     temp_compressed_filename = None
-    thumb_path = None
 
     try:
         if not os.path.exists(file_path):
@@ -226,87 +168,79 @@ def process_video_for_compression(video_data):
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False, dir=DOWNLOADS_DIR) as temp_file:
             temp_compressed_filename = temp_file.name
 
+        job = CompressionJob(
+            input_path=file_path,
+            output_path=temp_compressed_filename,
+            encoder=encoder,
+            duration=total_duration,
+            segments=plan_segments(total_duration, encoder),
+            faststart=True,
+            thumbnail_count=1  # الصورة المصغرة تُستخرج من نفس الترميز
+        )
         if isinstance(quality, dict) and 'target_size' in quality:
             target_size_mb = quality['target_size']
-            try: audio_k = int(str(VIDEO_AUDIO_BITRATE).lower().replace('k', '').strip())
-            except: audio_k = 128
-            target_v_bitrate = calculate_target_bitrate(target_size_mb, total_duration, audio_k)
-            print(f"[{thread_name}] Mode: EXACT SIZE. Target: {target_size_mb} MB | Target Video Bitrate: {target_v_bitrate}k")
-            quality_settings = f"-b:v {target_v_bitrate}k -maxrate {target_v_bitrate}k -bufsize {target_v_bitrate*2}k -preset fast"
+            job.target_size_mb = target_size_mb
+            job.two_pass = True
+            job.auto_resolution = TARGET_SIZE_AUTO_RESOLUTION  # الدقة تُختار بالعينات عند بدء الضغط
+            print(f"[{thread_name}] Mode: EXACT SIZE. Target: {target_size_mb} MB")
             used_mode_text = f"🎯 طلب حجم مستهدف: ~{target_size_mb:.2f} MB"
         else:
             quality_value = int(quality.split('_')[1]) if isinstance(quality, str) and 'crf_' in quality else int(quality)
+            job.quality_value = quality_value
             print(f"[{thread_name}] Mode: QUALITY (CRF/CQ). Level: {quality_value}")
-            preset = "fast"
-            if quality_value <= 18: preset = "slow"
-            elif quality_value <= 23: preset = "medium"
-            elif quality_value >= 27: preset = "veryfast" if encoder == 'libx264' else "fast"
-            quality_param = "cq" if "nvenc" in encoder else "crf"
-            quality_settings = f"-{quality_param} {quality_value} -preset {preset}"
             used_mode_text = f"🎥 الجودة (CRF/CQ): {quality_value}"
-        
-        common_ffmpeg_part = (
-            f'ffmpeg -y -i "{file_path}" -c:v {encoder} -pix_fmt {VIDEO_PIXEL_FORMAT} '
-            f'-c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} '
-            f'-ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -map_metadata -1'
-        )
-        ffmpeg_command = f'{common_ffmpeg_part} {quality_settings} -movflags +faststart "{temp_compressed_filename}"'
+
+        compression_executor.choose_preset(job, message)
 
         progress_msg = message.reply_text("🔄 **بدأ ضغط الفيديو (قد يأخذ وقتاً)...**", quote=True)
         start_time = time.time()
 
-        process = subprocess.Popen(ffmpeg_command, shell=True, stderr=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
-
-        for line in process.stderr:
-            if total_duration > 0:
-                time_match = re.search(r"time=\s*(\d{2}:\d{2}:\d{2}\.\d+)", line)
-                if time_match:
-                    current_time_str = time_match.group(1)
-                    current_time_sec = time_to_seconds(current_time_str)
-                    update_progress_msg(
-                        current=current_time_sec,
-                        total=total_duration,
-                        client=app,
-                        message=progress_msg,
-                        action="⚙️ **جاري المعالجة والضغط...**",
-                        start_time=start_time
-                    )
-
-        process.wait()
-        
-        if process.returncode != 0:
-            raise Exception("FFmpeg process crashed or failed.")
-            
-        try: progress_msg.delete()
-        except: pass
+        def on_encode_progress(event):
+            update_progress_msg(
+                current=event.out_time,
+                total=event.duration,
+                client=app,
+                message=progress_msg,
+                action="⚙️ **جاري المعالجة والضغط...**",
+                start_time=start_time,
+                encode_event=event
+            )
 
-        compressed_file_size_mb = os.path.getsize(temp_compressed_filename) / (1024 * 1024)
-        print(f"[{thread_name}] Compression Done! New Size: {compressed_file_size_mb:.2f} MB")
-
-        upload_progress_msg = message.reply_text("📤 اكتمل الضغط! بدأ الرفع النهائي كفيديو...", quote=True)
-        upload_start_time = time.time()
-
-        # استخراج الصورة المصغرة والمعلومات لجعل الفيديو Streamable
-        thumb_path, vid_duration, vid_width, vid_height = get_video_info_and_thumb(temp_compressed_filename)
-
-        # الرفع باستخدام reply_video
-        message.reply_video(
-            video=temp_compressed_filename,
-            progress=update_progress_msg,
-            progress_args=(app, upload_progress_msg, "📤 **الرفع إلى التليجرام...**", upload_start_time),
-            caption=f"📦 **النتيجة النهائية**\n"
-                    f"🔻 الحجم القديم: {os.path.getsize(file_path) / (1024 * 1024):.2f} MB\n"
-                    f"✅ الحجم الجديد: {compressed_file_size_mb:.2f} MB\n\n"
-                    f"{used_mode_text}",
-            duration=int(vid_duration),
-            width=vid_width,
-            height=vid_height,
-            thumb=thumb_path, 
-            supports_streaming=True 
-        )
-        
-        try: upload_progress_msg.delete()
-        except: pass
+        def build_caption(result):
+            mode_text = used_mode_text
+            if job.mode == 'target_size':
+                mode_text += f"\n🔁 عدد تمريرات الترميز: {result.passes}"
+            return (f"📦 **النتيجة النهائية**\n"
+                    f"🔻 الحجم القديم: {result.input_size_mb:.2f} MB\n"
+                    f"✅ الحجم الجديد: {result.output_size_mb:.2f} MB\n\n"
+                    f"{mode_text}")
+
+        upload = {}
+
+        def on_upload_progress(current, total):
+            # الرفع النهائي يبدأ داخل process_job بعد الترميز: أول تحديث ينقل العرض لرسالة رفع جديدة
+            if not upload:
+                progress_dispatcher.forget(progress_msg.chat.id, progress_msg.id)
+                try: progress_msg.delete()
+                except: pass
+                upload['msg'] = message.reply_text("📤 اكتمل الضغط! بدأ الرفع النهائي كفيديو...", quote=True)
+                upload['start_time'] = time.time()
+            update_progress_msg(current, total, app, upload['msg'], "📤 **الرفع إلى التليجرام...**", upload['start_time'])
+
+        # الرفع كفيديو Streamable؛ مع STREAMING_UPLOAD تُرفع أجزاء الناتج المكتملة أثناء الترميز
+        # والصورة المصغرة والمعلومات تُضاف عند التسليم
+        if STREAMING_UPLOAD:
+            sink = StreamingVideoSink(app, message, caption=build_caption, progress=on_upload_progress)
+        else:
+            sink = ReplyVideoSink(message, caption=build_caption, progress=on_upload_progress)
+        process_job(job, sink, on_encode_progress)
+
+        for status_msg in (progress_msg, upload.get('msg')):
+            if status_msg is None:
+                continue
+            progress_dispatcher.forget(status_msg.chat.id, status_msg.id)
+            try: status_msg.delete()
+            except: pass
         
     except Exception as e:
         print(f"[{thread_name}] Processing error: {e}")
@@ -315,8 +249,8 @@ def process_video_for_compression(video_data):
         # حذف الملفات المؤقتة فقط (لا نحذف file_path للسماح بتكرار العملية)
         if temp_compressed_filename and os.path.exists(temp_compressed_filename):
             os.remove(temp_compressed_filename)
-        if thumb_path and os.path.exists(thumb_path):
-            os.remove(thumb_path)
+        if temp_compressed_filename:
+            discard_thumbnails(temp_compressed_filename)
 
         auto_compress_status_message_id = video_data.get('auto_compress_status_message_id')
         if auto_compress_status_message_id:
@@ -341,6 +275,11 @@ def process_video_for_compression(video_data):
                     reply_markup=markup)
             except: pass
 
+
+# إرسال المهمة لمجمع مرمز المستخدم وعرض ترتيبها الفعلي في الطابور والوقت المتوقع لبدئها
+enqueue_compression = compression_executor.video_submitter(process_video_for_compression, get_user_settings, client=app)
+
+
 def auto_select_medium_quality(button_message_id):
     if button_message_id in user_video_data:
         video_data = user_video_data[button_message_id]
@@ -351,7 +290,7 @@ def auto_select_medium_quality(button_message_id):
                     chat_id=video_data['message'].chat.id, message_id=button_message_id,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✅ تم تفعيل اختيار (متوسط) لانتهاء الوقت", callback_data="none")]]))
             except Exception: pass
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
 
 # -------------------------- معالجات رسائل تيليجرام --------------------------
 
@@ -392,7 +331,7 @@ def handle_text_inputs(client, message):
                         app.edit_message_reply_markup(chat_id=message.chat.id, message_id=button_message_id,
                             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"🎯 الحجم: ~{size} MB جاري التنفيذ...", callback_data="none")]]))
                     except Exception: pass
-                    compression_executor.submit(process_video_for_compression, video_data)
+                    enqueue_compression(video_data)
                     del user_states[user_id]
             else: message.reply_text("❌ الجلسة منتهية.")
         except: message.reply_text("❌ أرسل رقماً صحيحاً.")
@@ -420,7 +359,7 @@ def handle_text_inputs(client, message):
                             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(f"📉 نسبة {percentage}% (~{target_mb:.1f} MB)", callback_data="none")]]))
                     except Exception: pass
                     
-                    compression_executor.submit(process_video_for_compression, video_data)
+                    enqueue_compression(video_data)
                     del user_states[user_id]
             else: message.reply_text("❌ الجلسة منتهية.")
         except ValueError:
@@ -467,17 +406,18 @@ def handle_incoming_video(client, message):
     download_msg = message.reply_text("📥 جاري تنزيل الملف للسيرفر...", quote=True)
     start_time = time.time()
     
-    download_future = download_executor.submit(
-        client.download_media, message=file_id, file_name=file_name_prefix,
-        progress=update_progress_msg, progress_args=(client, download_msg, "📥 **جاري التنزيل...**", start_time, file_size)
-    )
+    download_future, _ = download_registry.download(message, lambda: download_executor.submit(
+            client.download_media, message=file_id, file_name=file_name_prefix,
+            progress=update_progress_msg, progress_args=(client, download_msg, "📥 **جاري التنزيل...**", start_time, file_size),
+            user_id=message.from_user.id, cost=estimate_download_work(message)
+    ))
 
     user_video_data[message.id] = {
         'message': message, 'download_msg': download_msg, 'download_future': download_future,
         'file': None, 'button_message_id': None, 'timer': None, 'quality': None,
         'processing_started': False, 'user_id': message.from_user.id, 'auto_compress_status_message_id': None 
     }    
-    threading.Thread(target=post_download_actions, args=[message.id]).start()
+    run_when_done(app, download_future, post_download_actions, message.id)
     
 def post_download_actions(original_message_id):
     if original_message_id not in user_video_data: return
@@ -489,6 +429,7 @@ def post_download_actions(original_message_id):
     try:
         file_path = video_data['download_future'].result()
         video_data['file'] = file_path
+        progress_dispatcher.forget(download_msg.chat.id, download_msg.id)
         try: download_msg.delete()
         except: pass
         
@@ -497,7 +438,7 @@ def post_download_actions(original_message_id):
             video_data['quality'] = user_prefs['auto_quality_value']
             status_msg = message.reply_text(f"✅ تم تحميل الملف. جاري الضغط التلقائي...", quote=True)
             video_data['auto_compress_status_message_id'] = status_msg.id
-            compression_executor.submit(process_video_for_compression, video_data)
+            enqueue_compression(video_data)
         else:
             markup = InlineKeyboardMarkup([
                 [InlineKeyboardButton("أدنى جودة (27)", callback_data="crf_27"),
@@ -510,11 +451,12 @@ def post_download_actions(original_message_id):
             reply_message = message.reply_text("✅ استُلم الملف. اختر الجودة المطلوبة أو حدد نسبة الضغط:", reply_markup=markup, quote=True)
             video_data['button_message_id'] = reply_message.id
             user_video_data[reply_message.id] = user_video_data.pop(original_message_id)
-            timer = threading.Timer(300, auto_select_medium_quality, args=[reply_message.id])
+            timer = LoopTimer(app, 300, auto_select_medium_quality, args=[reply_message.id])
             user_video_data[reply_message.id]['timer'] = timer
             timer.start()
     except Exception as e:
         message.reply_text(f"❌ خطأ: `{e}`")
+        download_registry.release_source(video_data)
         if original_message_id in user_video_data: del user_video_data[original_message_id]
 
 @app.on_callback_query()
@@ -559,7 +501,7 @@ def universal_callback_handler(client, callback_query):
 
     if data in ["cancel_compression", "finish_process"]:
         if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
-        if video_data.get('file') and os.path.exists(video_data['file']): os.remove(video_data['file'])
+        download_registry.release_source(video_data)
         try: message.delete()
         except: pass
         if button_message_id in user_video_data: del user_video_data[button_message_id]
@@ -583,9 +525,10 @@ def universal_callback_handler(client, callback_query):
     if video_data.get('timer') and video_data['timer'].is_alive(): video_data['timer'].cancel()
     video_data['quality'] = data
     callback_query.answer("بدأت المعالجة...")
-    compression_executor.submit(process_video_for_compression, video_data)
+    enqueue_compression(video_data)
 
 if __name__ == "__main__":
     cleanup_downloads()
+    start_metrics_server(METRICS_PORT)
     print("✅ البوت يعمل بكفاءة...")
     app.run()
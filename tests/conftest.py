@@ -0,0 +1,5 @@
+import os
+import sys
+
+# الاختبارات تستورد المحرك و config من جذر المستودع كما تفعل البوتات
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
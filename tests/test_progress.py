@@ -0,0 +1,55 @@
+from engine.progress import ProgressParser
+
+# كتلة حقيقية من مخرجات "ffmpeg -progress pipe:1" عندما لا يعرف FFmpeg الزمن (قبل أول إطار
+# أو أثناء تفريغ المرمز في نهاية الترميز)
+NA_BLOCK = """frame=0
+fps=0.00
+stream_0_0_q=0.0
+bitrate=N/A
+total_size=N/A
+out_time_us=N/A
+out_time_ms=N/A
+out_time=N/A
+dup_frames=0
+drop_frames=0
+speed=N/A
+progress=continue
+"""
+
+
+def block(out_time_us, total_size, end=False):
+    return (
+        f"frame=100\nfps=25.00\nbitrate=500.0kbits/s\ntotal_size={total_size}\n"
+        f"out_time_us={out_time_us}\nout_time_ms={out_time_us}\nspeed=1.5x\n"
+        f"progress={'end' if end else 'continue'}\n"
+    )
+
+
+def feed(parser, text):
+    events = [parser.feed(line) for line in text.splitlines(keepends=True)]
+    return [event for event in events if event is not None]
+
+
+def test_na_block_before_first_frame_is_zero():
+    events = feed(ProgressParser(duration=20), NA_BLOCK)
+    assert len(events) == 1
+    assert events[0].out_time == 0.0
+    assert events[0].total_size == 0
+
+
+def test_na_block_keeps_previous_position():
+    parser = ProgressParser(duration=20)
+    events = feed(parser, block(17_000_000, 900_000) + NA_BLOCK * 3 + block(19_900_000, 1_000_000, end=True))
+    assert [round(event.percent, 1) for event in events] == [85.0, 85.0, 85.0, 85.0, 100.0]
+    assert [event.total_size for event in events] == [900_000, 900_000, 900_000, 900_000, 1_000_000]
+    assert events[-1].done
+
+
+def test_thumbnail_output_does_not_rewind_final_block():
+    # مع مخرجات الصور المصغرة تبلغ الكتلة الأخيرة زمن مخرج الصورة (0.04 ثانية) لا الفيديو
+    parser = ProgressParser(duration=20)
+    final = block(40_000, 1_000_000, end=True).replace("speed=1.5x", "speed=0.00102x")
+    events = feed(parser, block(10_000_000, 500_000) + final)
+    assert [event.percent for event in events] == [50.0, 100.0]
+    assert events[-1].done
+    assert events[-1].speed == 1.5
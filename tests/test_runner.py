@@ -0,0 +1,25 @@
+import pytest
+
+from engine.runner import run_ffmpeg
+
+
+def test_stdin_chunks_consumed_after_early_exit():
+    # "head -c 1" يغلق الأنبوب بعد أول بايت، كما يفعل FFmpeg عند توقفه مبكراً
+    consumed = []
+
+    def chunks():
+        for index in range(200):
+            consumed.append(index)
+            yield b"x" * 65536
+
+    run_ffmpeg(["head", "-c", "1"], stdin_chunks=chunks())
+    assert len(consumed) == 200
+
+
+def test_stdin_source_error_is_raised():
+    def chunks():
+        yield b"x" * 1024
+        raise ConnectionError("download dropped")
+
+    with pytest.raises(ConnectionError):
+        run_ffmpeg(["sh", "-c", "cat > /dev/null"], stdin_chunks=chunks())